@@ -0,0 +1,4 @@
+from .jobs import JobManager, QueueFullError
+from .routes import create_router
+
+__all__ = ['JobManager', 'QueueFullError', 'create_router']
@@ -0,0 +1,233 @@
+"""Bounded in-process job queue and worker pool behind the REST API."""
+
+import asyncio
+import io
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from core.cancellation import CancellationToken, GenerationCancelled
+from monitoring.metrics import QUEUE_WAIT
+
+
+OPERATIONS = {"sketch": "sketch", "transform": "manipulation"}
+FINISHED_STATES = ("succeeded", "failed", "cancelled")
+
+
+class QueueFullError(Exception):
+    """Raised on submit when the job queue is at capacity."""
+
+
+class Job:
+    """
+    State of one submitted job.
+
+    Worker threads update the job; asyncio consumers wait for changes with
+    `changes()`, which is woken through the consumer's own event loop.
+    """
+
+    def __init__(self, operation, request):
+        self.id = uuid.uuid4().hex
+        self.operation = operation
+        self.request = request
+        self.token = CancellationToken()
+        self.status = "queued"
+        self.step = 0
+        self.error = None
+        self.result = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.version = 0
+        self._lock = threading.Lock()
+        self._watchers = set()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def update(self, **changes):
+        """Apply changes from any thread and wake every waiting consumer."""
+        with self._lock:
+            for name, value in changes.items():
+                setattr(self, name, value)
+            self.version += 1
+            watchers = list(self._watchers)
+        for loop, event in watchers:
+            loop.call_soon_threadsafe(event.set)
+
+    def snapshot(self):
+        """JSON-serializable view of the job's status and progress."""
+        with self._lock:
+            total = self.request.num_inference_steps
+            return {
+                "id": self.id,
+                "operation": self.operation,
+                "status": self.status,
+                "step": self.step,
+                "total_steps": total,
+                "progress": self.step / total if total else 0.0,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "version": self.version,
+            }
+
+    async def changes(self, heartbeat_seconds=15.0):
+        """
+        Yield a snapshot on every change until the job has finished.
+
+        Yields None when nothing changed for heartbeat_seconds, so streaming
+        responses can send keep-alives.
+        """
+        watcher = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._watchers.add(watcher)
+        try:
+            version = None
+            while True:
+                watcher[1].clear()
+                snapshot = self.snapshot()
+                if snapshot["version"] != version:
+                    version = snapshot["version"]
+                    yield snapshot
+                if snapshot["status"] in FINISHED_STATES:
+                    return
+                try:
+                    await asyncio.wait_for(watcher[1].wait(), heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._lock:
+                self._watchers.discard(watcher)
+
+
+class JobManager:
+    """
+    Runs submitted jobs on a pool of worker threads sharing one ImageGenerator.
+
+    Submissions are validated up front and rejected with QueueFullError once
+    `max_queue_size` jobs are waiting. Finished jobs keep their PNG result
+    for `result_ttl_seconds`, and at most `max_finished_jobs` are retained.
+    """
+
+    def __init__(self, image_generator, workers=2, max_queue_size=64,
+                 result_ttl_seconds=600, max_finished_jobs=256):
+        self.image_generator = image_generator
+        self.result_ttl_seconds = result_ttl_seconds
+        self.max_finished_jobs = max_finished_jobs
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue_size)))
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._worker_loop, name=f"api-worker-{index}", daemon=True)
+            for index in range(max(1, int(workers)))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, operation, image, params):
+        """
+        Validate a job and queue it.
+
+        Args:
+            operation: "sketch" or "transform"
+            image: PIL Image (sketch canvas or source image)
+            params: Dict with "prompt" and optional hyperparameters; missing
+                ones default to SKETCH_HYPERPARAMS / MANIPULATION_HYPERPARAMS
+
+        Returns:
+            Job: The queued job
+
+        Raises:
+            ValueError: If the job is invalid or its pipeline is not loaded
+            QueueFullError: If the queue is at capacity
+        """
+        if operation not in OPERATIONS:
+            raise ValueError(f"operation must be one of {', '.join(OPERATIONS)}")
+        request = self.image_generator.prepare_request(OPERATIONS[operation], image, params)
+
+        job = Job(operation, request)
+        with self._lock:
+            self._prune()
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise QueueFullError(f"Job queue is full ({self._queue.maxsize} waiting)") from None
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        """Return a job by id, or None if it is unknown or expired."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued or running job.
+
+        Returns:
+            Job: The job, or None if it is unknown
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            # Under the lock a worker cannot switch the job to running in between,
+            # so a queued job is either marked cancelled here or sees the token
+            if job is not None and not job.finished:
+                job.token.cancel("stopped")
+                if job.status == "queued":
+                    job.update(status="cancelled", finished_at=time.time())
+        return job
+
+    def get_stats(self):
+        """Return queue depth and job counts by status."""
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return {"queued": self._queue.qsize(), "capacity": self._queue.maxsize,
+                "workers": len(self._workers), "jobs": counts}
+
+    def _prune(self):
+        """Forget expired finished jobs and the oldest ones beyond the retention cap."""
+        now = time.time()
+        finished = [job for job in self._jobs.values() if job.finished]
+        for index, job in enumerate(finished):
+            expired = now - job.finished_at > self.result_ttl_seconds
+            if expired or len(finished) - index > self.max_finished_jobs:
+                del self._jobs[job.id]
+
+    def _worker_loop(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job):
+        """Run one job through the ImageGenerator and store its PNG result."""
+        with self._lock:
+            if job.token.cancelled:
+                return
+            job.update(status="running", started_at=time.time())
+        QUEUE_WAIT.observe(job.started_at - job.created_at, queue="api-jobs")
+
+        def on_step(step, latents):
+            job.update(step=step + 1)
+
+        try:
+            image = self.image_generator.generate(job.request, on_step, job.token)
+            job.token.raise_if_cancelled()
+
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG")
+            job.update(status="succeeded", step=job.request.num_inference_steps,
+                       result=buffer.getvalue(), finished_at=time.time())
+        except GenerationCancelled:
+            job.update(status="cancelled", finished_at=time.time())
+        except Exception as e:
+            job.update(status="failed", error=str(e), finished_at=time.time())
@@ -0,0 +1,123 @@
+"""FastAPI routes of the asynchronous job API."""
+
+import base64
+import binascii
+import io
+import json
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import Response, StreamingResponse
+from PIL import Image, UnidentifiedImageError
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+
+from .jobs import QueueFullError
+
+
+class JobSubmission(BaseModel):
+    """Body of POST /jobs. Omitted hyperparameters use the tab defaults."""
+
+    operation: str = "sketch"
+    image: str  # Base64-encoded PNG or JPEG
+    prompt: str
+    negative_prompt: Optional[str] = None
+    guidance_scale: Optional[float] = None
+    image_guidance_scale: Optional[float] = None
+    controlnet_conditioning_scale: Optional[float] = None
+    num_inference_steps: Optional[int] = None
+    seed: Optional[int] = None
+    scheduler: Optional[str] = None
+
+
+def _decode_image(data):
+    if "," in data and data.startswith("data:"):
+        data = data.split(",", 1)[1]
+    try:
+        image = Image.open(io.BytesIO(base64.b64decode(data, validate=True)))
+        image.load()
+    except (binascii.Error, UnidentifiedImageError, OSError) as e:
+        raise ValueError(f"image is not a valid base64-encoded image ({e})") from e
+    return image
+
+
+def create_router(job_manager, heartbeat_seconds=15.0):
+    """
+    Build the job API router.
+
+    Routes:
+        POST /jobs: Submit a job, 202 with its status (429 when the queue is full)
+        GET /jobs/{id}: Status and progress
+        GET /jobs/{id}/events: Server-sent events with every status change
+        GET /jobs/{id}/result: The PNG result once the job has succeeded
+        DELETE /jobs/{id}: Cancel a queued or running job
+        GET /stats: Queue depth and job counts by status
+
+    Args:
+        job_manager: JobManager running the jobs
+        heartbeat_seconds: Keep-alive interval of the event stream
+
+    Returns:
+        APIRouter
+    """
+    router = APIRouter()
+
+    def get_job(job_id):
+        job = job_manager.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'")
+        return job
+
+    @router.post("/jobs", status_code=202)
+    async def submit_job(submission: JobSubmission):
+        params = submission.model_dump(exclude={"operation", "image"}, exclude_none=True)
+
+        def submit():
+            return job_manager.submit(submission.operation, _decode_image(submission.image), params)
+
+        # Decoding and preprocessing are CPU work; keep them off the event loop
+        try:
+            job = await run_in_threadpool(submit)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except QueueFullError as e:
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "5"})
+        return job.snapshot()
+
+    @router.get("/jobs/{job_id}")
+    async def job_status(job_id: str):
+        return get_job(job_id).snapshot()
+
+    @router.get("/jobs/{job_id}/events")
+    async def job_events(job_id: str):
+        job = get_job(job_id)
+
+        async def stream():
+            async for snapshot in job.changes(heartbeat_seconds):
+                if snapshot is None:
+                    yield ": keep-alive\n\n"
+                else:
+                    yield f"event: {snapshot['status']}\ndata: {json.dumps(snapshot)}\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache"})
+
+    @router.get("/jobs/{job_id}/result")
+    async def job_result(job_id: str):
+        job = get_job(job_id)
+        if job.status == "failed":
+            raise HTTPException(status_code=500, detail=job.error)
+        if job.status != "succeeded":
+            raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+        return Response(content=job.result, media_type="image/png")
+
+    @router.delete("/jobs/{job_id}")
+    async def cancel_job(job_id: str):
+        get_job(job_id)
+        return job_manager.cancel(job_id).snapshot()
+
+    @router.get("/stats")
+    async def queue_stats():
+        return job_manager.get_stats()
+
+    return router
@@ -1,11 +1,16 @@
+import signal
+
 import gradio as gr
 
 # Import configuration and models
 from config.app_config import config
 from models.model_manager import ModelManager
+from models.schedulers import recommended_min_steps
 
 # Import core functionality
-from core.generation import ImageGenerator
+from core.generation import CANCELLED_HTML, ImageGenerator
+from core.prefork import PreforkPool
+from monitoring.metrics import flatten_stats, metrics
 
 # Import UI components
 from ui.styles import CUSTOM_CSS
@@ -20,6 +25,8 @@ class SketchMagicApp:
     def __init__(self):
         self.model_manager = None
         self.image_generator = None
+        self.job_manager = None
+        self.worker_pool = None
         self.demo = None
         self._initialize_models()
         self._create_interface()
@@ -28,7 +35,17 @@ class SketchMagicApp:
         """Initialize the model manager and image generator."""
         print("🎨 Initializing Sketch to Magic...")
         self.model_manager = ModelManager()
-        self.image_generator = ImageGenerator(self.model_manager)
+        # Fork before any other thread starts, so workers inherit a quiet process
+        if config.PREFORK["workers"] > 0:
+            self.worker_pool = PreforkPool(
+                self.model_manager,
+                workers=config.PREFORK["workers"],
+                threads_per_worker=config.PREFORK["threads_per_worker"],
+            )
+        self.image_generator = ImageGenerator(self.model_manager, worker_pool=self.worker_pool)
+        # Prefork workers warm themselves up after forking
+        if config.WARMUP["enabled"] and self.worker_pool is None:
+            self.image_generator.warm_up()
     
     def _create_interface(self):
         """Create the main Gradio interface."""
@@ -63,12 +80,12 @@ class SketchMagicApp:
         # Unpack components
         (sketch_input, prompt_input, negative_prompt_input, guidance_scale_sketch, 
          num_steps_sketch, seed_sketch, controlnet_scale, generated_image_output_sketch, 
-         status_sketch, clear_prompts_btn, generate_btn) = sketch_components
+         status_sketch, clear_prompts_btn, generate_btn, stop_sketch_btn, scheduler_sketch) = sketch_components
         
         (input_image_display_manipulation, modification_input,
          guidance_scale_modify, image_guidance_scale, num_steps_modify, seed_modify,
          modified_image_output_manipulation, status_modify,
-         clear_modify_prompt_btn, modify_btn) = transform_components
+         clear_modify_prompt_btn, modify_btn, stop_modify_btn, scheduler_modify) = transform_components
 
         # Clear buttons
         clear_prompts_btn.click(
@@ -78,47 +95,116 @@ class SketchMagicApp:
         
         clear_modify_prompt_btn.click(lambda: "", outputs=modification_input)
 
-        # Generate image from sketch
-        generate_btn.click(
-            fn=self.image_generator.generate_from_sketch,
+        # Show the recommended step count of the selected sampler
+        def scheduler_steps_info(scheduler):
+            return gr.update(info=f"Recommended: at least {recommended_min_steps(scheduler)} steps with this sampler")
+
+        scheduler_sketch.change(scheduler_steps_info, inputs=scheduler_sketch, outputs=num_steps_sketch, queue=False)
+        scheduler_modify.change(scheduler_steps_info, inputs=scheduler_modify, outputs=num_steps_modify, queue=False)
+
+        # Stream latent previews during denoising when enabled
+        if config.STEP_PREVIEWS["enabled"]:
+            sketch_fn = self.image_generator.generate_from_sketch_stream
+            transform_fn = self.image_generator.transform_image_stream
+        else:
+            sketch_fn = self.image_generator.generate_from_sketch
+            transform_fn = self.image_generator.transform_image
+
+        # Generations run under an admission ticket; a queued click that was stopped
+        # or superseded by a newer one of the same session is skipped without running
+        admission = self.image_generator.admission
+        skipped = {reason: (gr.update(), html) for reason, html in CANCELLED_HTML.items()}
+        sketch_fn = admission.guard(sketch_fn, "sketch", skipped)
+        transform_fn = admission.guard(transform_fn, "manipulation", skipped)
+        concurrency = self.image_generator.get_event_concurrency()
+
+        # Generate image from sketch. A click is first admitted (or rejected when the
+        # queue or session is full) and stops the session's running generation, so
+        # the superseded run frees its worker within one step.
+        sketch_event = generate_btn.click(
+            fn=self.image_generator.admit_sketch,
+            inputs=[num_steps_sketch],
+            outputs=[status_sketch],
+            queue=False,
+            trigger_mode="multiple"
+        ).success(
+            fn=sketch_fn,
             inputs=[
                 sketch_input, prompt_input, negative_prompt_input,
-                guidance_scale_sketch, num_steps_sketch, seed_sketch, controlnet_scale
+                guidance_scale_sketch, num_steps_sketch, seed_sketch, controlnet_scale,
+                scheduler_sketch
             ],
             outputs=[generated_image_output_sketch, status_sketch],
-            show_progress="full"
-        ).then(
+            show_progress="full",
+            concurrency_limit=concurrency["sketch"]
+        )
+        # Chain the copy steps off the generation event so Stop cancels the
+        # generation itself rather than the last copy step
+        sketch_event.then(
             fn=lambda img: img,
             inputs=[generated_image_output_sketch],
-            outputs=[generated_image_placeholder]
+            outputs=[generated_image_placeholder],
+            queue=False
         ).then(
             fn=lambda img_state: img_state,
             inputs=[generated_image_placeholder],
-            outputs=[input_image_display_manipulation]
+            outputs=[input_image_display_manipulation],
+            queue=False
+        )
+
+        stop_sketch_btn.click(
+            fn=self.image_generator.stop_sketch,
+            queue=False,
+            cancels=[sketch_event]
         )
 
         # Transform image
         def get_valid_image(uploaded_img, generated_img):
             return uploaded_img if uploaded_img is not None else generated_img
 
-        modify_btn.click(
+        transform_event = modify_btn.click(
+            fn=self.image_generator.admit_transform,
+            inputs=[num_steps_modify],
+            outputs=[status_modify],
+            queue=False,
+            trigger_mode="multiple"
+        ).success(
             fn=get_valid_image,
             inputs=[input_image_display_manipulation, generated_image_placeholder],
-            outputs=input_image_display_manipulation
-        ).then(
-            fn=self.image_generator.transform_image,
+            outputs=input_image_display_manipulation,
+            queue=False
+        ).success(
+            fn=transform_fn,
             inputs=[
                 input_image_display_manipulation, modification_input,
-                guidance_scale_modify, image_guidance_scale, num_steps_modify, seed_modify
+                guidance_scale_modify, image_guidance_scale, num_steps_modify, seed_modify,
+                scheduler_modify
             ],
             outputs=[modified_image_output_manipulation, status_modify],
-            show_progress="full"
+            show_progress="full",
+            concurrency_limit=concurrency["manipulation"]
+        )
+
+        stop_modify_btn.click(
+            fn=self.image_generator.stop_transform,
+            queue=False,
+            cancels=[transform_event]
         )
     
     def launch(self, share=False, inbrowser=True, server_name="0.0.0.0", server_port=None):
         """Launch the Gradio application."""
         if self.demo is None:
             raise RuntimeError("Interface not created. Call _create_interface() first.")
+
+        self._install_profiler_signal()
+
+        # Admission control keeps the number of requests in line within max_size,
+        # so Gradio's own limit only guards events outside the generation chains
+        self.demo.queue(max_size=config.QUEUE["max_size"], default_concurrency_limit=1)
+
+        if config.METRICS["enabled"] or config.PROFILER["admin_path"] or config.REST_API["enabled"]:
+            self._launch_server(server_name, server_port)
+            return
         
         self.demo.launch(
             share=share,
@@ -128,6 +214,63 @@ class SketchMagicApp:
             server_port=server_port
         )
 
+    def _install_profiler_signal(self):
+        """Arm the profiler on SIGUSR1 where the platform supports it."""
+        if not hasattr(signal, "SIGUSR1"):
+            return
+        signal.signal(
+            signal.SIGUSR1,
+            lambda signum, frame: self.image_generator.profiler.arm(config.PROFILER["captures_per_trigger"])
+        )
+
+    def _launch_server(self, server_name, server_port):
+        """Serve the Gradio app and the metrics, admin and job API endpoints from one server."""
+        import uvicorn
+        from fastapi import FastAPI
+        from fastapi.responses import PlainTextResponse
+
+        server = FastAPI()
+        port = server_port or 7860
+
+        if config.METRICS["enabled"]:
+            metrics.gauge(
+                "sketchmagic_component_stat",
+                "Counters and settings reported by ImageGenerator.get_stats(), by component and stat.",
+                ["component", "stat"],
+                function=lambda: {
+                    tuple(key.split(".", 1)): value
+                    for key, value in flatten_stats(self.image_generator.get_stats()).items()
+                },
+            )
+
+            @server.get(config.METRICS["path"], response_class=PlainTextResponse)
+            def scrape():
+                return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+            print(f"📈 Metrics available at http://{server_name}:{port}{config.METRICS['path']}")
+
+        if config.PROFILER["admin_path"]:
+            @server.post(config.PROFILER["admin_path"])
+            def arm_profiler(count: int = config.PROFILER["captures_per_trigger"]):
+                self.image_generator.profiler.arm(count)
+                return {"armed": count, "output_dir": self.image_generator.profiler.output_dir}
+
+        if config.REST_API["enabled"]:
+            from api import JobManager, create_router
+
+            self.job_manager = JobManager(
+                self.image_generator,
+                workers=config.REST_API["workers"],
+                max_queue_size=config.REST_API["max_queue_size"],
+                result_ttl_seconds=config.REST_API["result_ttl_seconds"],
+                max_finished_jobs=config.REST_API["max_finished_jobs"],
+            )
+            server.include_router(create_router(self.job_manager), prefix=config.REST_API["path"])
+            print(f"🔌 Job API available at http://{server_name}:{port}{config.REST_API['path']}/jobs")
+
+        server = gr.mount_gradio_app(server, self.demo, path="/")
+        print("Serving with uvicorn; share and inbrowser are not supported in this mode.")
+        uvicorn.run(server, host=server_name, port=port)
+
 
 def main():
     """Main entry point for the application."""
@@ -0,0 +1,234 @@
+"""Headless batch generation from a JSONL file of jobs.
+
+Each line of the jobs file is one job. Paths are relative to the jobs file,
+hyperparameters default to SKETCH_HYPERPARAMS / MANIPULATION_HYPERPARAMS:
+
+    {"id": "cottage", "operation": "sketch", "image": "sketches/cottage.png",
+     "prompt": "a cozy cottage in an enchanted forest", "seed": 42}
+    {"id": "cottage-watercolor", "operation": "transform", "image": "outputs/cottage.png",
+     "prompt": "make it look like a watercolor painting", "image_guidance_scale": 1.5}
+
+Outputs are written to <output-dir>/<id>.png and each finished job is
+appended to <output-dir>/manifest.jsonl as soon as it completes, so a re-run
+skips every job that already succeeded:
+
+    python batch_generate.py jobs.jsonl --output-dir outputs --batch-size 4
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from PIL import Image
+
+from config.app_config import config
+from core.generation import SEED_INFO, ImageGenerator
+from models.model_manager import ModelManager
+
+
+OPERATIONS = {"sketch": "sketch", "transform": "manipulation"}
+MANIFEST_NAME = "manifest.jsonl"
+
+
+def _job_id(job):
+    """Stable id for jobs without one, derived from the job's content."""
+    payload = json.dumps(job, sort_keys=True)
+    return "job-" + hashlib.sha256(payload.encode("utf-8")).hexdigest()[:12]
+
+
+def load_jobs(path):
+    """
+    Parse and validate a JSONL jobs file.
+
+    Args:
+        path: Path to the jobs file
+
+    Returns:
+        list: Job dicts with "id" set and "image" resolved against the jobs file
+
+    Raises:
+        ValueError: If a line is not a valid job or ids are duplicated
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    jobs, seen = [], set()
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_number}: invalid JSON ({e})") from e
+
+            if job.get("operation", "sketch") not in OPERATIONS:
+                raise ValueError(f"{path}:{line_number}: operation must be one of {', '.join(OPERATIONS)}")
+            if not job.get("image") or not job.get("prompt"):
+                raise ValueError(f"{path}:{line_number}: 'image' and 'prompt' are required")
+
+            job.setdefault("operation", "sketch")
+            job["id"] = str(job.get("id") or _job_id(job))
+            if job["id"] in seen:
+                raise ValueError(f"{path}:{line_number}: duplicate job id '{job['id']}'")
+            seen.add(job["id"])
+            job["image"] = os.path.join(base_dir, job["image"])
+            jobs.append(job)
+    return jobs
+
+
+def load_completed(manifest_path):
+    """Ids of jobs recorded as succeeded whose output still exists."""
+    completed = set()
+    if not os.path.isfile(manifest_path):
+        return completed
+    with open(manifest_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A run killed mid-write leaves at most one truncated line
+                continue
+            if record.get("status") == "ok" and os.path.isfile(record.get("output", "")):
+                completed.add(record["id"])
+    return completed
+
+
+class ManifestWriter:
+    """Appends one JSON record per finished job and flushes it to disk immediately."""
+
+    def __init__(self, path):
+        self._file = open(path, "a")
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record, default=str) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def _batch_order(job):
+    """Sort key putting sketch jobs that can share a pipeline call next to each other."""
+    params = {**config.SKETCH_HYPERPARAMS, **job}
+    return (
+        int(params["num_inference_steps"]), float(params["guidance_scale"]),
+        float(params["controlnet_conditioning_scale"]), job.get("scheduler") or "",
+    )
+
+
+def run_job(image_generator, job, output_dir):
+    """
+    Run one job and save its output.
+
+    Args:
+        image_generator: ImageGenerator to run the job with
+        job: Job dict from load_jobs
+        output_dir: Directory for the output image
+
+    Returns:
+        dict: Manifest record for the job
+    """
+    start = time.perf_counter()
+    record = {"id": job["id"], "operation": job["operation"], "prompt": job["prompt"]}
+    try:
+        image = Image.open(job["image"])
+        image.load()
+
+        request = image_generator.prepare_request(OPERATIONS[job["operation"]], image, job)
+        output = image_generator.generate(request)
+
+        output_path = os.path.join(output_dir, f"{job['id']}.png")
+        tmp_path = output_path + ".tmp"
+        output.save(tmp_path, format="PNG")
+        os.replace(tmp_path, output_path)
+        # The seed the output was generated with, drawn by the generator for random (-1) jobs
+        record.update(status="ok", output=output_path, seed=output.info.get(SEED_INFO, request.seed),
+                      scheduler=request.scheduler)
+    except Exception as e:
+        record.update(status="error", error=str(e))
+
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def run_batch(args):
+    """
+    Run every pending job of a jobs file.
+
+    Sketch jobs run before transform jobs, so transforms can use sketch
+    outputs of the same file as their input.
+
+    Returns:
+        tuple: (succeeded, failed, skipped) job counts
+    """
+    jobs = load_jobs(args.jobs)
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest_path = os.path.join(args.output_dir, MANIFEST_NAME)
+    completed = set() if args.force else load_completed(manifest_path)
+    pending = [job for job in jobs if job["id"] not in completed]
+    print(f"📋 {len(jobs)} jobs, {len(jobs) - len(pending)} already completed, {len(pending)} to run.")
+    if not pending:
+        return 0, 0, len(jobs)
+
+    # Compatible sketch jobs submitted together are merged by the micro-batcher
+    if args.batch_size > 1:
+        config.SKETCH_BATCHING["enabled"] = True
+        config.SKETCH_BATCHING["max_batch_size"] = args.batch_size
+
+    image_generator = ImageGenerator(ModelManager())
+    sketch_jobs = sorted((job for job in pending if job["operation"] == "sketch"), key=_batch_order)
+    transform_jobs = [job for job in pending if job["operation"] == "transform"]
+
+    succeeded = failed = 0
+    manifest = ManifestWriter(manifest_path)
+    try:
+        for stage_jobs, workers in ((sketch_jobs, args.batch_size), (transform_jobs, 1)):
+            with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="batch-job") as executor:
+                futures = [executor.submit(run_job, image_generator, job, args.output_dir) for job in stage_jobs]
+                # Record each job as soon as it finishes, so an interrupted run
+                # does not redo jobs that completed behind a slower one
+                for future in as_completed(futures):
+                    record = future.result()
+                    manifest.write(record)
+                    if record["status"] == "ok":
+                        succeeded += 1
+                        print(f"✅ {record['id']} ({record['seconds']:.1f}s)")
+                    else:
+                        failed += 1
+                        print(f"❌ {record['id']}: {record['error']}")
+    finally:
+        manifest.close()
+
+    return succeeded, failed, len(jobs) - len(pending)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate images for a JSONL file of jobs without the UI.")
+    parser.add_argument("jobs", help="JSONL file with one job per line")
+    parser.add_argument("--output-dir", default="outputs", help="Directory for images and manifest.jsonl")
+    parser.add_argument("--batch-size", type=int, default=config.SKETCH_BATCHING["max_batch_size"],
+                        help="Sketch jobs run concurrently and merged into one pipeline call (1 disables batching)")
+    parser.add_argument("--force", action="store_true", help="Re-run jobs the manifest records as completed")
+    parser.add_argument("--device", choices=["cpu", "cuda"], help="Override config.DEVICE")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.device:
+        config.DEVICE = args.device
+
+    succeeded, failed, skipped = run_batch(args)
+    print(f"🏁 {succeeded} succeeded, {failed} failed, {skipped} skipped.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
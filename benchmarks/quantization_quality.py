@@ -0,0 +1,190 @@
+"""Quality check of int8 dynamic quantization against float32 on fixed seeds.
+
+Generates the same seeded sketch and transform outputs with and without
+INT8_QUANTIZATION and reports PSNR / SSIM per output, plus load memory and
+generation time of both modes:
+
+    python -m benchmarks.quantization_quality --output quant.json
+    python -m benchmarks.quantization_quality --tiny --resolution 64 --steps 4
+"""
+
+import argparse
+import gc
+import json
+import math
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from config.app_config import config
+from core.generation import ImageGenerator, SketchRequest, TransformRequest
+from models.model_manager import ModelManager
+from monitoring.metrics import current_rss_bytes
+from .run_benchmarks import _git_commit, _make_photo, _make_sketch
+from .tiny_pipelines import build_tiny_checkpoints
+
+
+SKETCH_PROMPT = "a cozy cottage in an enchanted forest"
+TRANSFORM_PROMPT = "make it look like a watercolor painting"
+
+
+def psnr(a, b, data_range=255.0):
+    """Peak signal-to-noise ratio in dB between two uint8 images."""
+    mse = np.mean((np.asarray(a, dtype=np.float64) - np.asarray(b, dtype=np.float64)) ** 2)
+    return math.inf if mse == 0 else 10.0 * math.log10(data_range**2 / mse)
+
+
+def _box_filter(x, size):
+    """Mean over every size x size window (valid region only)."""
+    c = np.pad(x, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    return (c[size:, size:] - c[:-size, size:] - c[size:, :-size] + c[:-size, :-size]) / size**2
+
+
+def ssim(a, b, data_range=255.0, window=7):
+    """Mean structural similarity over 7x7 windows, averaged across channels."""
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    c1 = (0.01 * data_range) ** 2
+    c2 = (0.03 * data_range) ** 2
+
+    scores = []
+    for channel in range(a.shape[2]):
+        x, y = a[..., channel], b[..., channel]
+        mu_x, mu_y = _box_filter(x, window), _box_filter(y, window)
+        var_x = _box_filter(x * x, window) - mu_x**2
+        var_y = _box_filter(y * y, window) - mu_y**2
+        cov = _box_filter(x * y, window) - mu_x * mu_y
+        ssim_map = ((2 * mu_x * mu_y + c1) * (2 * cov + c2)) / ((mu_x**2 + mu_y**2 + c1) * (var_x + var_y + c2))
+        scores.append(ssim_map.mean())
+    return float(np.mean(scores))
+
+
+def generate_outputs(seeds, resolution, steps):
+    """
+    Load the pipelines with the current config and generate one output per seed and operation.
+
+    Returns:
+        dict: Images per operation, generation seconds per operation, RSS after
+        loading in MB and the execution signature
+    """
+    ModelManager._instance = None
+    model_manager = ModelManager()
+    rss_mb = current_rss_bytes() / 1024**2
+    image_generator = ImageGenerator(model_manager)
+
+    sketch = _make_sketch(resolution)
+    photo = _make_photo(resolution)
+    images = {"sketch": [], "manipulation": []}
+    seconds = {"sketch": [], "manipulation": []}
+    for seed in seeds:
+        start = time.perf_counter()
+        images["sketch"].append(image_generator._run_sketch_batch([SketchRequest(
+            prompt=SKETCH_PROMPT, negative_prompt=None, image=sketch, num_inference_steps=steps,
+            guidance_scale=7.5, controlnet_conditioning_scale=1.0, seed=seed,
+        )])[0])
+        seconds["sketch"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        images["manipulation"].append(image_generator._run_transform(TransformRequest(
+            prompt=TRANSFORM_PROMPT, image=photo, guidance_scale=7.5, image_guidance_scale=1.5,
+            num_inference_steps=steps, seed=seed,
+        )))
+        seconds["manipulation"].append(time.perf_counter() - start)
+
+    return {
+        "images": images,
+        "seconds": {op: statistics.mean(values) for op, values in seconds.items()},
+        "rss_mb": rss_mb,
+        "execution": model_manager.get_execution_signature(),
+    }
+
+
+def _release_models():
+    ModelManager._instance = None
+    gc.collect()
+
+
+def compare(reference, candidate):
+    """PSNR / SSIM of every candidate output against its float32 reference."""
+    report = {}
+    for operation, references in reference["images"].items():
+        pairs = zip(references, candidate["images"][operation])
+        scores = [{"psnr": psnr(ref, out), "ssim": ssim(ref, out)} for ref, out in pairs]
+        report[operation] = {
+            "per_seed": scores,
+            "mean_psnr": statistics.mean(score["psnr"] for score in scores),
+            "min_psnr": min(score["psnr"] for score in scores),
+            "mean_ssim": statistics.mean(score["ssim"] for score in scores),
+            "min_ssim": min(score["ssim"] for score in scores),
+        }
+    return report
+
+
+def run_quality_check(args):
+    """Run the float32 and int8 passes and return the report as a dict."""
+    if args.tiny:
+        checkpoint_dir = args.checkpoint_dir or tempfile.mkdtemp(prefix="sketchmagic-quant-")
+        for attr, path in build_tiny_checkpoints(checkpoint_dir).items():
+            setattr(config, attr, path)
+    config.DEVICE = "cpu"
+    config.DTYPE = torch.float32
+    config.RESULT_CACHE["enabled"] = False
+    config.SKETCH_BATCHING["enabled"] = False
+    if args.cache_dir:
+        config.INT8_QUANTIZATION["cache_dir"] = args.cache_dir
+
+    config.INT8_QUANTIZATION["enabled"] = False
+    reference = generate_outputs(args.seeds, args.resolution, args.steps)
+    _release_models()
+
+    config.INT8_QUANTIZATION["enabled"] = True
+    quantized = generate_outputs(args.seeds, args.resolution, args.steps)
+    _release_models()
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.time(),
+        "torch": torch.__version__,
+        "params": {"seeds": args.seeds, "resolution": args.resolution, "steps": args.steps, "tiny": args.tiny},
+        "components": config.INT8_QUANTIZATION["components"],
+        "quality": compare(reference, quantized),
+        "seconds": {"float32": reference["seconds"], "int8": quantized["seconds"]},
+        # RSS is cumulative within one process, so the int8 figure is an upper bound
+        "rss_after_load_mb": {"float32": reference["rss_mb"], "int8": quantized["rss_mb"]},
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare int8-quantized outputs against float32 on fixed seeds.")
+    parser.add_argument("--output", help="Write the JSON report to this file (default: stdout)")
+    parser.add_argument("--seeds", type=lambda value: [int(v) for v in value.split(",")],
+                        default=[0, 1, 2], help="Comma-separated seeds")
+    parser.add_argument("--resolution", type=int, default=512, help="Input image size in pixels")
+    parser.add_argument("--steps", type=int, default=20, help="Denoising steps per generation")
+    parser.add_argument("--tiny", action="store_true", help="Use tiny random-weight checkpoints (offline smoke test)")
+    parser.add_argument("--checkpoint-dir", help="Where to write the tiny checkpoints (default: a temp dir)")
+    parser.add_argument("--cache-dir", help="Override INT8_QUANTIZATION['cache_dir']")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_quality_check(args)
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"📊 Quantization quality report written to {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""End-to-end benchmark of the generation stack on tiny random-weight pipelines.
+
+Runs fully offline on CPU and writes a JSON report that can be compared
+across commits:
+
+    python -m benchmarks.run_benchmarks --output bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+from PIL import Image, ImageDraw
+
+from config.app_config import config
+from core.generation import ImageGenerator, SketchRequest, TransformRequest
+from models.model_manager import ModelManager
+from .tiny_pipelines import build_tiny_checkpoints
+
+
+def _no_progress(*args, **kwargs):
+    """Stand-in for gr.Progress outside of a Gradio event."""
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak / (1024**2) if sys.platform == "darwin" else peak / 1024
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def _summarize(samples):
+    """Summary statistics in milliseconds for a list of durations in seconds."""
+    millis = [1000.0 * sample for sample in samples]
+    return {
+        "mean_ms": statistics.mean(millis),
+        "p50_ms": statistics.median(millis),
+        "min_ms": min(millis),
+        "max_ms": max(millis),
+        "samples": len(millis),
+    }
+
+
+def _make_sketch(size):
+    """A white canvas with a few black strokes, like a Gradio Paint export."""
+    image = Image.new("RGB", (size, size), "white")
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((size // 4, size // 4, 3 * size // 4, 3 * size // 4), outline="black", width=max(1, size // 32))
+    draw.line((0, size - 1, size - 1, 0), fill="black", width=max(1, size // 32))
+    return image
+
+
+def _make_photo(size, seed=0):
+    pixels = np.random.default_rng(seed).integers(0, 256, (size, size, 3), dtype=np.uint8)
+    return Image.fromarray(pixels, mode="RGB")
+
+
+def measure_cold_start():
+    """Time ModelManager construction, including every eager pipeline load."""
+    ModelManager._instance = None
+    start = time.perf_counter()
+    model_manager = ModelManager()
+    elapsed = time.perf_counter() - start
+    return model_manager, {
+        "seconds": elapsed,
+        "components": model_manager.get_load_timings(),
+        "status": model_manager.get_load_status(),
+    }
+
+
+def measure_step_latency(run, repeats):
+    """Per-step latency from the timestamps of the pipeline's step callback."""
+    steps = []
+    for _ in range(repeats):
+        stamps = [time.perf_counter()]
+        run(lambda step, latents: stamps.append(time.perf_counter()))
+        steps.extend(b - a for a, b in zip(stamps[1:], stamps[2:]))
+    return _summarize(steps) if steps else None
+
+
+def measure_end_to_end(call, repeats):
+    """End-to-end latency of a public ImageGenerator method."""
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        image, status = call()
+        samples.append(time.perf_counter() - start)
+        if image is None:
+            raise RuntimeError(f"Generation failed during benchmark: {status}")
+    return _summarize(samples)
+
+
+def measure_throughput(image_generator, request, batch_sizes, repeats):
+    """Images per second when running the sketch pipeline at several batch sizes."""
+    results = {}
+    for batch_size in batch_sizes:
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            image_generator._run_sketch_batch([request] * batch_size)
+            samples.append(time.perf_counter() - start)
+        results[str(batch_size)] = {
+            "latency": _summarize(samples),
+            "images_per_second": batch_size / statistics.mean(samples),
+        }
+    return results
+
+
+def run_benchmarks(args):
+    """Run every benchmark and return the report as a dict."""
+    checkpoint_dir = args.checkpoint_dir or tempfile.mkdtemp(prefix="sketchmagic-bench-")
+    for attr, path in build_tiny_checkpoints(checkpoint_dir).items():
+        setattr(config, attr, path)
+    if args.device:
+        config.DEVICE = args.device
+        config.DTYPE = torch.float32 if args.device == "cpu" else config.DTYPE
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    # The end-to-end handlers would otherwise bucket (upscale) and crop their
+    # inputs, so every section measures requests at --resolution
+    config.RESOLUTION_BUCKETS = {**config.RESOLUTION_BUCKETS, "enabled": False}
+    config.SKETCH_PREPROCESSING = {**config.SKETCH_PREPROCESSING, "crop_to_strokes": False}
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.time(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "device": config.DEVICE,
+        "threads": torch.get_num_threads(),
+        "params": {
+            "resolution": args.resolution,
+            "steps": args.steps,
+            "repeats": args.repeats,
+            "batch_sizes": args.batch_sizes,
+            "resolution_buckets": config.RESOLUTION_BUCKETS["enabled"],
+            "crop_to_strokes": config.SKETCH_PREPROCESSING["crop_to_strokes"],
+        },
+    }
+
+    model_manager, report["cold_start"] = measure_cold_start()
+    image_generator = ImageGenerator(model_manager)
+
+    sketch = _make_sketch(args.resolution)
+    photo = _make_photo(args.resolution)
+    prompt = "a cozy cottage in an enchanted forest"
+    sketch_request = SketchRequest(
+        prompt=prompt, negative_prompt=None, image=sketch,
+        num_inference_steps=args.steps, guidance_scale=7.5,
+        controlnet_conditioning_scale=1.0, seed=0,
+    )
+    transform_request = TransformRequest(
+        prompt="make it look like a watercolor painting", image=photo,
+        guidance_scale=7.5, image_guidance_scale=1.5,
+        num_inference_steps=args.steps, seed=0,
+    )
+
+    # Warm up once so steady-state numbers exclude first-call allocations
+    image_generator._run_sketch_batch([sketch_request])
+    image_generator._run_transform(transform_request)
+
+    report["step_latency"] = {
+        "sketch": measure_step_latency(
+            lambda callback: image_generator._run_sketch_batch([sketch_request], [callback]), args.repeats
+        ),
+        "transform": measure_step_latency(
+            lambda callback: image_generator._run_transform(transform_request, callback), args.repeats
+        ),
+    }
+    report["end_to_end"] = {
+        "generate_from_sketch": measure_end_to_end(
+            lambda: image_generator.generate_from_sketch(
+                sketch, prompt, "", 7.5, args.steps, -1, 1.0, progress=_no_progress
+            ), args.repeats
+        ),
+        "transform_image": measure_end_to_end(
+            lambda: image_generator.transform_image(
+                photo, transform_request.prompt, 7.5, 1.5, args.steps, -1, progress=_no_progress
+            ), args.repeats
+        ),
+    }
+    report["throughput"] = measure_throughput(image_generator, sketch_request, args.batch_sizes, args.repeats)
+    report["peak_rss_mb"] = _peak_rss_mb()
+    report["stats"] = image_generator.get_stats()
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the generation stack on tiny random-weight pipelines.")
+    parser.add_argument("--output", help="Write the JSON report to this file (default: stdout)")
+    parser.add_argument("--resolution", type=int, default=64, help="Input image size in pixels")
+    parser.add_argument("--steps", type=int, default=4, help="Denoising steps per generation")
+    parser.add_argument("--repeats", type=int, default=3, help="Measurements per benchmark")
+    parser.add_argument("--batch-sizes", type=lambda value: [int(v) for v in value.split(",")],
+                        default=[1, 2, 4], help="Comma-separated batch sizes for the throughput benchmark")
+    parser.add_argument("--device", choices=["cpu", "cuda"], help="Override config.DEVICE")
+    parser.add_argument("--threads", type=int, help="torch intra-op thread count")
+    parser.add_argument("--checkpoint-dir", help="Where to write the tiny checkpoints (default: a temp dir)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_benchmarks(args)
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"📊 Benchmark report written to {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Micro-benchmark of sketch preprocessing against the previous PIL round trip.
+
+Times the vectorized preprocess_sketch_input and the old
+convert("L").convert("RGB") path on blank, sparse and dense canvases:
+
+    python -m benchmarks.sketch_preprocessing --sizes 512,1024 --output prep.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+import timeit
+
+from PIL import Image, ImageDraw
+
+from core.image_processing import preprocess_sketch_input
+from .run_benchmarks import _git_commit
+
+
+def legacy_preprocess(sketch_image):
+    """The preprocessing path before vectorization, kept as the baseline."""
+    return sketch_image.convert("L").convert("RGB"), None
+
+
+def make_canvas(kind, size):
+    """A white RGB canvas: blank, a single doodle, or dense strokes over the whole area."""
+    image = Image.new("RGB", (size, size), "white")
+    draw = ImageDraw.Draw(image)
+    width = max(1, size // 128)
+    if kind == "sparse":
+        draw.ellipse((size // 3, size // 3, size // 2, size // 2), outline="black", width=width)
+    elif kind == "dense":
+        for offset in range(0, size, max(4, size // 32)):
+            draw.line((offset, 0, size - 1 - offset, size - 1), fill="black", width=width)
+            draw.line((0, offset, size - 1, size - 1 - offset), fill="black", width=width)
+    return image
+
+
+def time_call(func, image, repeats, number):
+    """Best-of and median microseconds per call."""
+    samples = timeit.repeat(lambda: func(image), repeat=repeats, number=number)
+    per_call = [1e6 * sample / number for sample in samples]
+    return {"min_us": min(per_call), "median_us": statistics.median(per_call)}
+
+
+def run_benchmarks(args):
+    """Time both preprocessing paths on every canvas kind and size."""
+    variants = {
+        "legacy": legacy_preprocess,
+        "vectorized": preprocess_sketch_input,
+        "vectorized_cropped": lambda image: preprocess_sketch_input(image, crop_margin=32),
+    }
+    results = {}
+    for size in args.sizes:
+        for kind in ("blank", "sparse", "dense"):
+            canvas = make_canvas(kind, size)
+            entry = {name: time_call(func, canvas, args.repeats, args.number) for name, func in variants.items()}
+            entry["rejected"] = preprocess_sketch_input(canvas)[0] is None
+            entry["speedup"] = entry["legacy"]["min_us"] / entry["vectorized"]["min_us"]
+            results[f"{kind}_{size}"] = entry
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.time(),
+        "params": {"sizes": args.sizes, "repeats": args.repeats, "number": args.number},
+        "results": results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmark sketch preprocessing.")
+    parser.add_argument("--output", help="Write the JSON report to this file (default: stdout)")
+    parser.add_argument("--sizes", type=lambda value: [int(v) for v in value.split(",")],
+                        default=[512, 1024], help="Comma-separated canvas sizes in pixels")
+    parser.add_argument("--repeats", type=int, default=5, help="Timing repeats per case")
+    parser.add_argument("--number", type=int, default=50, help="Calls per timing repeat")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_benchmarks(args)
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"📊 Sketch preprocessing report written to {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Tiny randomly initialized checkpoints for offline benchmarking.
+
+The checkpoints use the same classes ModelManager loads (ControlNet, SD-1.5
+and InstructPix2Pix layouts) with a handful of channels, so the full loading
+and generation code paths run on CPU in seconds without network access.
+"""
+
+import json
+import os
+
+import torch
+from diffusers import (
+    AutoencoderKL, ControlNetModel, DDIMScheduler, UNet2DConditionModel,
+    StableDiffusionPipeline, StableDiffusionInstructPix2PixPipeline,
+)
+from diffusers.pipelines.stable_diffusion.safety_checker import StableDiffusionSafetyChecker
+from transformers import (
+    CLIPConfig, CLIPImageProcessor, CLIPTextConfig, CLIPTextModel,
+    CLIPTokenizer, CLIPVisionConfig,
+)
+from transformers.models.clip.tokenization_clip import bytes_to_unicode
+
+
+CROSS_ATTENTION_DIM = 32
+SAFETY_IMAGE_SIZE = 32
+
+
+def _build_tokenizer(directory):
+    """Build a character-level CLIP tokenizer from generated vocab files."""
+    os.makedirs(directory, exist_ok=True)
+    characters = list(bytes_to_unicode().values())
+    tokens = ["<|startoftext|>", "<|endoftext|>"] + characters + [c + "</w>" for c in characters]
+    vocab_file = os.path.join(directory, "vocab.json")
+    merges_file = os.path.join(directory, "merges.txt")
+    with open(vocab_file, "w", encoding="utf-8") as f:
+        json.dump({token: index for index, token in enumerate(tokens)}, f)
+    with open(merges_file, "w", encoding="utf-8") as f:
+        f.write("#version: 0.2\n")
+    return CLIPTokenizer(vocab_file, merges_file, model_max_length=77), len(tokens)
+
+
+def _build_text_encoder(vocab_size):
+    return CLIPTextModel(CLIPTextConfig(
+        bos_token_id=0,
+        eos_token_id=1,
+        pad_token_id=1,
+        hidden_size=CROSS_ATTENTION_DIM,
+        intermediate_size=37,
+        num_attention_heads=4,
+        num_hidden_layers=2,
+        vocab_size=vocab_size,
+        max_position_embeddings=77,
+    ))
+
+
+def _build_unet(in_channels=4):
+    return UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=1,
+        sample_size=32,
+        in_channels=in_channels,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        cross_attention_dim=CROSS_ATTENTION_DIM,
+    )
+
+
+def _build_controlnet():
+    return ControlNetModel(
+        block_out_channels=(32, 64),
+        layers_per_block=1,
+        in_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        cross_attention_dim=CROSS_ATTENTION_DIM,
+        conditioning_embedding_out_channels=(16, 32),
+    )
+
+
+def _build_vae():
+    return AutoencoderKL(
+        block_out_channels=(32, 64),
+        in_channels=3,
+        out_channels=3,
+        down_block_types=("DownEncoderBlock2D", "DownEncoderBlock2D"),
+        up_block_types=("UpDecoderBlock2D", "UpDecoderBlock2D"),
+        latent_channels=4,
+    )
+
+
+def _build_safety_checker():
+    vision_config = CLIPVisionConfig(
+        hidden_size=CROSS_ATTENTION_DIM,
+        intermediate_size=37,
+        num_attention_heads=4,
+        num_hidden_layers=2,
+        image_size=SAFETY_IMAGE_SIZE,
+        patch_size=4,
+    )
+    text_config = CLIPTextConfig(hidden_size=CROSS_ATTENTION_DIM, intermediate_size=37,
+                                 num_attention_heads=4, num_hidden_layers=2)
+    config = CLIPConfig.from_text_vision_configs(text_config, vision_config, projection_dim=CROSS_ATTENTION_DIM)
+    return StableDiffusionSafetyChecker(config)
+
+
+def _build_scheduler():
+    return DDIMScheduler(
+        beta_start=0.00085,
+        beta_end=0.012,
+        beta_schedule="scaled_linear",
+        clip_sample=False,
+        set_alpha_to_one=False,
+    )
+
+
+def build_tiny_checkpoints(root, seed=0):
+    """
+    Write tiny random-weight checkpoints to disk.
+
+    Args:
+        root: Directory to write the checkpoints into
+        seed: Seed for the random weights
+
+    Returns:
+        dict: Local model ids to assign to CONTROLNET_MODEL_ID,
+        STABLE_DIFFUSION_MODEL_ID and INSTRUCTPIX2PIX_MODEL_ID
+    """
+    torch.manual_seed(seed)
+    paths = {
+        "CONTROLNET_MODEL_ID": os.path.join(root, "controlnet"),
+        "STABLE_DIFFUSION_MODEL_ID": os.path.join(root, "stable-diffusion"),
+        "INSTRUCTPIX2PIX_MODEL_ID": os.path.join(root, "instruct-pix2pix"),
+    }
+
+    tokenizer, vocab_size = _build_tokenizer(os.path.join(root, "tokenizer-src"))
+    text_encoder = _build_text_encoder(vocab_size)
+    vae = _build_vae()
+    feature_extractor = CLIPImageProcessor(crop_size=SAFETY_IMAGE_SIZE, size=SAFETY_IMAGE_SIZE)
+
+    _build_controlnet().save_pretrained(paths["CONTROLNET_MODEL_ID"])
+
+    StableDiffusionPipeline(
+        vae=vae,
+        text_encoder=text_encoder,
+        tokenizer=tokenizer,
+        unet=_build_unet(),
+        scheduler=_build_scheduler(),
+        safety_checker=_build_safety_checker(),
+        feature_extractor=feature_extractor,
+    ).save_pretrained(paths["STABLE_DIFFUSION_MODEL_ID"])
+
+    # InstructPix2Pix shares the VAE and text encoder, like the real checkpoints
+    StableDiffusionInstructPix2PixPipeline(
+        vae=vae,
+        text_encoder=text_encoder,
+        tokenizer=tokenizer,
+        unet=_build_unet(in_channels=8),
+        scheduler=_build_scheduler(),
+        safety_checker=None,
+        feature_extractor=feature_extractor,
+        requires_safety_checker=False,
+    ).save_pretrained(paths["INSTRUCTPIX2PIX_MODEL_ID"])
+
+    return paths
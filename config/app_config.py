@@ -31,6 +31,209 @@ class AppConfig:
     STABLE_DIFFUSION_MODEL_ID = "runwayml/stable-diffusion-v1-5"
     INSTRUCTPIX2PIX_MODEL_ID = "timbrooks/instruct-pix2pix"
 
+    # Default scheduler of each pipeline, by name from models/schedulers.py
+    # (unipc, dpmpp_2m, euler_a, ddim, lcm); the UI can override it per request
+    DEFAULT_SCHEDULERS = {
+        "sketch": "unipc",
+        "manipulation": "euler_a",
+    }
+
+    # Pipeline Loading Strategy
+    # "eager" loads the pipeline when ModelManager starts, "lazy" defers it
+    # until the first request that needs it.
+    PIPELINE_LOAD_MODES = {
+        "sketch": "eager",
+        "manipulation": "eager",
+    }
+
+    # Reuse one VAE, text encoder and tokenizer across pipelines when their
+    # checkpoint files are byte-identical
+    SHARE_PIPELINE_COMPONENTS = True
+
+    # Thread pool size for downloading and reading pipeline checkpoint files;
+    # the modules are then built one at a time (1 reads them one after another)
+    MODEL_LOAD_WORKERS = 6
+
+    # Pipeline Residency
+    # Memory budget in GB for pipeline weights on DEVICE (None keeps every
+    # pipeline resident). Idle pipelines beyond the budget are either moved
+    # to CPU ("offload") or freed and reloaded on next use ("drop").
+    RESIDENCY_MEMORY_BUDGET_GB = None
+    RESIDENCY_EVICTION_POLICY = "offload"
+
+    # Micro-batching of concurrent sketch generations: compatible requests
+    # arriving within window_ms are run through one pipeline call
+    SKETCH_BATCHING = {
+        "enabled": False,
+        "max_batch_size": 4,
+        "window_ms": 50,
+    }
+
+    # LRU cache of CLIP prompt embeddings shared by both pipelines. Presets
+    # from EXAMPLE_PROMPTS / EXAMPLE_MODIFICATIONS are encoded at startup and
+    # saved to persist_path when it is set.
+    PROMPT_EMBEDDING_CACHE = {
+        "enabled": False,
+        "max_entries": 256,
+        "precompute_presets": True,
+        "persist_path": None,
+    }
+
+    # LRU cache of VAE-encoded InstructPix2Pix source images keyed by image
+    # content and VAE tiling, so repeated transforms of the same picture skip
+    # the VAE encode. Bounded by memory_mb of latents.
+    IMAGE_LATENT_CACHE = {
+        "enabled": False,
+        "memory_mb": 64,
+    }
+
+    # Cache of generated images for seeded (deterministic) requests, with a
+    # size-bounded memory tier and an optional LRU disk tier
+    RESULT_CACHE = {
+        "enabled": False,
+        "memory_mb": 256,
+        "disk_dir": None,
+        "disk_mb": 2048,
+    }
+
+    # Streaming previews: every `interval` denoising steps the UI receives a
+    # cheap linear latent-to-RGB preview (no VAE decode)
+    STEP_PREVIEWS = {
+        "enabled": False,
+        "interval": 5,
+        "max_size": 512,
+    }
+
+    # Prometheus-style metrics: when enabled, the app is served by uvicorn
+    # with a plain-text scrape endpoint at `path` next to the Gradio UI
+    METRICS = {
+        "enabled": False,
+        "path": "/metrics",
+    }
+
+    # On-demand torch.profiler capture, armed with SIGUSR1 (captures_per_trigger
+    # calls) or, when admin_path is set, with POST <admin_path>?count=N
+    PROFILER = {
+        "output_dir": "profiles",
+        "captures_per_trigger": 1,
+        "admin_path": None,
+        "row_limit": 40,
+    }
+
+    # Event queue admission control. At most max_size requests wait or run
+    # at once and each session may hold per_session_limit of them; further
+    # clicks are rejected with a message instead of queueing. concurrency caps
+    # simultaneous runs per event (None follows SKETCH_BATCHING and PREFORK).
+    # Clicks still queued after max_wait_seconds (or whose event Gradio
+    # dropped) expire and free their slot; their events are skipped if they
+    # run later. Tickets are forgotten entirely after stale_seconds.
+    QUEUE = {
+        "max_size": 32,
+        "per_session_limit": 4,
+        "concurrency": {"sketch": None, "manipulation": None},
+        "max_wait_seconds": 300,
+        "stale_seconds": 900,
+    }
+
+    # Warm-up at startup: before the app reports ready, every loaded pipeline
+    # in pipelines runs `runs` dummy generations of `steps` steps at each
+    # RESOLUTION_BUCKETS size (or at default_size when bucketing is off), so
+    # first real requests do not pay for allocator growth, kernel selection
+    # and thread pool start-up. Lazy pipelines are loaded for warm-up only
+    # with load_lazy; otherwise their first request pays both costs.
+    WARMUP = {
+        "enabled": False,
+        "pipelines": ["sketch", "manipulation"],
+        "steps": 2,
+        "runs": 2,
+        "default_size": (512, 512),
+        "load_lazy": False,
+    }
+
+    # Prefork mode (CPU only): with workers > 0, the pipelines are loaded once
+    # and that many worker processes are forked to run pipeline calls,
+    # sharing the weights copy-on-write. threads_per_worker defaults to the
+    # CPU count divided by workers.
+    PREFORK = {
+        "workers": 0,
+        "threads_per_worker": None,
+    }
+
+    # Asynchronous job API served under path next to the UI: jobs are queued
+    # (at most max_queue_size waiting, then 429) and run by a pool of worker
+    # threads sharing the pipelines. Finished results are kept for
+    # result_ttl_seconds, and at most max_finished_jobs of them.
+    REST_API = {
+        "enabled": False,
+        "path": "/api",
+        "workers": 2,
+        "max_queue_size": 64,
+        "result_ttl_seconds": 600,
+        "max_finished_jobs": 256,
+    }
+
+    # CPU execution profile (ignored on CUDA). bf16 stores the UNet and
+    # ControlNet in bfloat16 and runs them under bfloat16 autocast; without it
+    # CPU calls run in plain float32. autotune times every combination of
+    # thread count, bf16 and channels-last on a tiny UNet input at startup and
+    # keeps the fastest.
+    CPU_EXECUTION = {
+        "num_threads": None,
+        "interop_threads": None,
+        "bf16": False,
+        "channels_last": False,
+        "autotune": False,
+        "autotune_latent_size": 32,
+    }
+
+    # Execution backend of the sketch pipeline. "onnx" runs the text encoder,
+    # ControlNet, UNet and VAE decoder on ONNX Runtime's CPU provider from a
+    # one-time export cached in cache_dir; when the export is missing (and
+    # export_if_missing is off), fails, or the device is CUDA, the PyTorch
+    # pipeline is used.
+    SKETCH_BACKEND = {
+        "backend": "pytorch",
+        "cache_dir": "onnx_cache",
+        "export_if_missing": True,
+        "opset": 17,
+        "intra_op_threads": None,
+    }
+
+    # Dynamic int8 quantization of the nn.Linear layers of these components
+    # (CPU only, disables bf16). Quantized state dicts are cached in cache_dir
+    # so the quantization runs once per set of weights.
+    INT8_QUANTIZATION = {
+        "enabled": False,
+        "components": ["text_encoder", "unet", "controlnet"],
+        "cache_dir": "quantized_cache",
+    }
+
+    # Activation memory budget per pipeline call, in GB (None disables). Each
+    # request's peak is estimated from resolution, batch size and dtype, and
+    # VAE slicing, attention slicing and tiled VAE decode are switched on,
+    # cheapest first, until the estimate fits. Every toggle is logged.
+    ACTIVATION_MEMORY_BUDGET_GB = None
+
+    # Sketch preprocessing: canvases are binarized at ink_threshold and
+    # rejected when they have fewer than min_ink_pixels stroke pixels, before
+    # any model work. With crop_to_strokes, the work area is cropped to the
+    # strokes' bounding box plus crop_margin pixels of background.
+    SKETCH_PREPROCESSING = {
+        "ink_threshold": 128,
+        "min_ink_pixels": 16,
+        "crop_to_strokes": False,
+        "crop_margin": 32,
+    }
+
+    # Resolution buckets as (width, height). Inputs are resized into the
+    # closest bucket with their aspect ratio preserved and padded; outputs are
+    # cropped back to the input's content area and size. Fixed shapes keep
+    # cost predictable and let the micro-batcher group requests.
+    RESOLUTION_BUCKETS = {
+        "enabled": False,
+        "sizes": [(512, 512), (512, 768), (768, 512)],
+    }
+
     # Default Hyperparameters for Sketch to Image (First Tab)
     SKETCH_HYPERPARAMS = {
         "guidance_scale": 7.5,
@@ -0,0 +1,241 @@
+"""Admission control and ETA estimates for queued UI generations."""
+
+import functools
+import inspect
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+from monitoring.metrics import QUEUE_WAIT
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is turned away because the queue or the session is at its limit."""
+
+
+class AdmissionController:
+    """
+    Admits UI requests into the event queue and estimates their wait.
+
+    Every click is admitted with a ticket before its event is queued. Requests
+    are rejected when `max_pending` tickets are queued or running across all
+    sessions, or when the session already holds `per_session_limit`. When a
+    session clicks again while an older event of the same operation is still
+    queued, the new ticket replaces the older one and the older event is
+    skipped as soon as it is dequeued, so only the latest click does work.
+    Stopping a session cancels its queued tickets, and tickets still waiting
+    after `max_wait_seconds` (events Gradio dropped, or a queue that did not
+    move) expire. Cancelled and expired tickets stop counting against the
+    limits at once and are kept only to skip their event if it is dequeued
+    later.
+
+    ETAs multiply the measured seconds per denoising step of each operation
+    (an exponential moving average) by the steps queued ahead, divided by the
+    operation's event concurrency, plus the request's own steps.
+    """
+
+    def __init__(self, max_pending=32, per_session_limit=4, concurrency=None,
+                 max_wait_seconds=300, stale_seconds=900, smoothing=0.2):
+        """
+        Args:
+            max_pending: Maximum tickets queued or running across all sessions
+            per_session_limit: Maximum tickets per session (None for no limit)
+            concurrency: Dict of operation to event concurrency limit
+            max_wait_seconds: Queued tickets expire after waiting this long;
+                their events are skipped if they are dequeued later
+            stale_seconds: Tickets older than this are forgotten entirely
+            smoothing: Weight of the newest measurement in the moving average
+        """
+        self.max_pending = max_pending
+        self.per_session_limit = per_session_limit
+        self.concurrency = dict(concurrency or {})
+        self.max_wait_seconds = max_wait_seconds
+        self.stale_seconds = stale_seconds
+        self.smoothing = smoothing
+        self._tickets = OrderedDict()
+        self._seq = itertools.count()
+        self._seconds_per_step = {}
+        self._stats = {"admitted": 0, "rejected_queue": 0, "rejected_session": 0, "skipped": 0, "stopped": 0,
+                       "expired": 0}
+        self._lock = threading.Lock()
+
+    def admit(self, session_id, operation, num_inference_steps):
+        """
+        Admit a request and estimate when it will finish.
+
+        Args:
+            session_id: Client session identifier
+            operation: "sketch" or "manipulation"
+            num_inference_steps: Requested denoising steps
+
+        Returns:
+            dict: "ahead" (requests of the operation queued or running before
+            this one) and "eta_seconds" (None until a step time was measured)
+
+        Raises:
+            AdmissionRejected: If the queue or the session is at its limit
+        """
+        with self._lock:
+            self._expire()
+            # Cancelled and expired tickets only wait to skip their event, so
+            # they count against neither the limits nor the ETA
+            live = [ticket for ticket in self._tickets.values() if ticket["cancelled"] is None]
+            if len(live) >= self.max_pending:
+                self._stats["rejected_queue"] += 1
+                raise AdmissionRejected(
+                    f"The server is busy ({len(live)} requests in line). Please try again in a moment."
+                )
+            # Queued tickets of the same operation are replaced by this one
+            replaced = [ticket for ticket in live if ticket["session"] == session_id
+                        and ticket["operation"] == operation and not ticket["started"]]
+            session_tickets = sum(1 for ticket in live if ticket["session"] == session_id) - len(replaced)
+            if self.per_session_limit is not None and session_tickets >= self.per_session_limit:
+                self._stats["rejected_session"] += 1
+                raise AdmissionRejected(
+                    f"You already have {session_tickets} requests in progress. Please wait for them to finish."
+                )
+
+            for ticket in replaced:
+                ticket["cancelled"] = "superseded"
+            self._stats["skipped"] += len(replaced)
+            ahead = [ticket for ticket in live if ticket["operation"] == operation and ticket["cancelled"] is None]
+            self._tickets[next(self._seq)] = {
+                "session": session_id,
+                "operation": operation,
+                "steps": int(num_inference_steps),
+                "admitted_at": time.monotonic(),
+                "started": False,
+                "cancelled": None,
+            }
+            self._stats["admitted"] += 1
+
+            eta = None
+            rate = self._seconds_per_step.get(operation)
+            if rate is not None:
+                queued_steps = sum(ticket["steps"] for ticket in ahead)
+                eta = rate * (queued_steps / max(1, self.concurrency.get(operation, 1)) + int(num_inference_steps))
+            return {"ahead": len(ahead), "eta_seconds": eta}
+
+    def begin(self, session_id, operation):
+        """
+        Mark the session's oldest waiting ticket of an operation as running.
+
+        Returns:
+            str: None if the request should run, otherwise why it is skipped:
+            "stopped" if the session stopped it while it was queued,
+            "superseded" if a newer request of the session was admitted, or
+            "expired" if it waited longer than max_wait_seconds
+        """
+        with self._lock:
+            self._expire()
+            waiting = [seq for seq, ticket in self._tickets.items()
+                       if ticket["session"] == session_id and ticket["operation"] == operation
+                       and not ticket["started"]]
+            if not waiting:
+                return None
+            ticket = self._tickets[waiting[0]]
+            if ticket["cancelled"] is not None:
+                del self._tickets[waiting[0]]
+                return ticket["cancelled"]
+            ticket["started"] = True
+            # Time the click spent in Gradio's queue before a worker picked it up
+            QUEUE_WAIT.observe(time.monotonic() - ticket["admitted_at"], queue=f"gradio-{operation}")
+            return None
+
+    def finish(self, session_id, operation):
+        """Release the session's running ticket of an operation."""
+        with self._lock:
+            for seq, ticket in self._tickets.items():
+                if ticket["session"] == session_id and ticket["operation"] == operation and ticket["started"]:
+                    del self._tickets[seq]
+                    return
+
+    def cancel_session(self, session_id, operation=None):
+        """
+        Cancel every queued ticket of a session, or only those of one operation.
+
+        Cancelled tickets are released from the limits at once and kept only
+        so their events are skipped if dequeued; running tickets are released
+        by finish() once the stopped run returns.
+        """
+        with self._lock:
+            for ticket in self._tickets.values():
+                if (ticket["session"] == session_id and operation in (None, ticket["operation"])
+                        and not ticket["started"] and ticket["cancelled"] is None):
+                    ticket["cancelled"] = "stopped"
+                    self._stats["stopped"] += 1
+
+    def observe(self, operation, num_inference_steps, seconds):
+        """Fold a measured generation time into the operation's seconds per step."""
+        if num_inference_steps <= 0 or seconds <= 0:
+            return
+        rate = seconds / num_inference_steps
+        with self._lock:
+            previous = self._seconds_per_step.get(operation)
+            self._seconds_per_step[operation] = rate if previous is None else (
+                self.smoothing * rate + (1 - self.smoothing) * previous
+            )
+
+    def guard(self, fn, operation, skipped_results):
+        """
+        Wrap a Gradio event handler so it runs under its session's ticket.
+
+        The wrapper keeps fn's signature, so Gradio still injects gr.Request
+        and progress. Skipped events return (or yield) the entry of
+        skipped_results for the reason begin() gave ("stopped", "superseded"
+        or "expired") without running fn.
+        """
+        signature = inspect.signature(fn)
+
+        def session_of(args, kwargs):
+            request = signature.bind_partial(*args, **kwargs).arguments.get("gr_request")
+            return getattr(request, "session_hash", None) if request is not None else None
+
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def stream_wrapper(*args, **kwargs):
+                session_id = session_of(args, kwargs)
+                skipped = self.begin(session_id, operation)
+                if skipped is not None:
+                    yield skipped_results[skipped]
+                    return
+                try:
+                    yield from fn(*args, **kwargs)
+                finally:
+                    self.finish(session_id, operation)
+            return stream_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            session_id = session_of(args, kwargs)
+            skipped = self.begin(session_id, operation)
+            if skipped is not None:
+                return skipped_results[skipped]
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.finish(session_id, operation)
+        return wrapper
+
+    def _expire(self):
+        now = time.monotonic()
+        for seq, ticket in list(self._tickets.items()):
+            age = now - ticket["admitted_at"]
+            if age > self.stale_seconds:
+                del self._tickets[seq]
+            elif not ticket["started"] and ticket["cancelled"] is None and age > self.max_wait_seconds:
+                ticket["cancelled"] = "expired"
+                self._stats["expired"] += 1
+
+    def get_stats(self):
+        """Return admission counts, tickets in line per operation and seconds per step."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = {}
+            for ticket in self._tickets.values():
+                if ticket["cancelled"] is not None:
+                    continue
+                stats["pending"][ticket["operation"]] = stats["pending"].get(ticket["operation"], 0) + 1
+            stats["seconds_per_step"] = dict(self._seconds_per_step)
+        return stats
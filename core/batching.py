@@ -0,0 +1,108 @@
+"""Dynamic micro-batching of compatible generation requests."""
+
+import threading
+import time
+from concurrent.futures import Future
+
+from monitoring.metrics import QUEUE_WAIT
+
+
+class MicroBatcher:
+    """
+    Collects compatible requests for a short window and runs them as one batch.
+
+    Requests are grouped by a batch key; only requests with equal keys
+    (same resolution, step count, guidance, ...) are run together. The first
+    request of a batch waits at most `window_seconds` for companions, and a
+    batch is dispatched early once it reaches `max_batch_size`.
+    """
+
+    def __init__(self, run_batch, max_batch_size=4, window_seconds=0.05, name="batcher"):
+        """
+        Args:
+            run_batch: Callable taking a list of requests and returning a list
+                of results in the same order; exception instances in the list
+                are raised to the corresponding caller
+            max_batch_size: Maximum number of requests per pipeline call
+            window_seconds: How long to wait for compatible requests
+            name: Name of the worker thread
+        """
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.window_seconds = window_seconds
+        self._pending = []
+        self._cond = threading.Condition()
+        self._stats = {"batches": 0, "requests": 0}
+        self._worker = threading.Thread(target=self._worker_loop, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, batch_key, request):
+        """
+        Queue a request and block until its result is ready.
+
+        Args:
+            batch_key: Hashable key; only requests with equal keys share a batch
+            request: Request object passed to run_batch
+
+        Returns:
+            The result for this request
+
+        Raises:
+            Exception: Whatever run_batch raised for the batch
+        """
+        future = Future()
+        with self._cond:
+            self._pending.append((batch_key, request, future, time.monotonic()))
+            self._cond.notify_all()
+        return future.result()
+
+    def _take_batch(self):
+        """Wait for a dispatchable batch and remove it from the queue."""
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+
+            batch_key, _, _, first_arrival = self._pending[0]
+            deadline = first_arrival + self.window_seconds
+            while True:
+                matching = [entry for entry in self._pending if entry[0] == batch_key]
+                remaining = deadline - time.monotonic()
+                if len(matching) >= self.max_batch_size or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = matching[:self.max_batch_size]
+            taken = set(id(entry) for entry in batch)
+            self._pending = [entry for entry in self._pending if id(entry) not in taken]
+            return batch
+
+    def _worker_loop(self):
+        while True:
+            batch = self._take_batch()
+            dispatched = time.monotonic()
+            for _, _, _, arrival in batch:
+                QUEUE_WAIT.observe(dispatched - arrival, queue=self._worker.name)
+            requests = [request for _, request, _, _ in batch]
+            futures = [future for _, _, future, _ in batch]
+            try:
+                results = self.run_batch(requests)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            with self._cond:
+                self._stats["batches"] += 1
+                self._stats["requests"] += len(requests)
+            for future, result in zip(futures, results):
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def get_stats(self):
+        """Return the number of batches run and the average batch size."""
+        with self._cond:
+            stats = dict(self._stats)
+        stats["average_batch_size"] = stats["requests"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
@@ -0,0 +1,104 @@
+"""Cancellation of in-flight and superseded generation runs."""
+
+import threading
+
+
+class GenerationCancelled(Exception):
+    """Raised from the denoising loop when a run's cancellation token is set."""
+
+
+class CancellationToken:
+    """Thread-safe flag checked by a run at every denoising step."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason = None
+
+    def cancel(self, reason="cancelled"):
+        """Request cancellation; the run aborts at its next step."""
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        """Raise GenerationCancelled if cancellation was requested."""
+        if self._event.is_set():
+            raise GenerationCancelled(self.reason)
+
+
+class RunRegistry:
+    """
+    Tracks the active run per (session, operation).
+
+    Starting a new run for the same session and operation supersedes the
+    previous one by cancelling its token.
+    """
+
+    def __init__(self):
+        self._runs = {}
+        self._lock = threading.Lock()
+        self._stats = {"started": 0, "superseded": 0, "stopped": 0}
+
+    def start(self, session_id, operation):
+        """
+        Create a token for a new run, cancelling any older run it supersedes.
+
+        Args:
+            session_id: Client session identifier, or None for anonymous callers
+            operation: "sketch" or "manipulation"
+
+        Returns:
+            CancellationToken: Token for the new run
+        """
+        token = CancellationToken()
+        with self._lock:
+            self._stats["started"] += 1
+            if session_id is None:
+                return token
+            previous = self._runs.get((session_id, operation))
+            if previous is not None and not previous.cancelled:
+                previous.cancel("superseded")
+                self._stats["superseded"] += 1
+            self._runs[(session_id, operation)] = token
+        return token
+
+    def finish(self, session_id, operation, token):
+        """Forget a run once it has completed, unless a newer one replaced it."""
+        with self._lock:
+            if self._runs.get((session_id, operation)) is token:
+                del self._runs[(session_id, operation)]
+
+    def cancel(self, session_id, operation=None, reason="stopped"):
+        """
+        Stop the active run(s) of a session.
+
+        Args:
+            session_id: Client session identifier
+            operation: Only cancel this operation, or every operation if None
+            reason: "stopped" or "superseded"; passed to the tokens and
+                counted under that name in get_stats()
+
+        Returns:
+            int: Number of runs cancelled
+        """
+        cancelled = 0
+        with self._lock:
+            for (session, op), token in list(self._runs.items()):
+                if session == session_id and (operation is None or op == operation):
+                    if not token.cancelled:
+                        token.cancel(reason)
+                        cancelled += 1
+                    del self._runs[(session, op)]
+            self._stats[reason] += cancelled
+        return cancelled
+
+    def get_stats(self):
+        """Return counts of started, superseded and stopped runs."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["active"] = len(self._runs)
+            return stats
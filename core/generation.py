@@ -1,21 +1,142 @@
 """Core image generation and transformation logic."""
 
+import queue
+import random
+import re
+import statistics
+import threading
+import time
+from collections import namedtuple
+
 import torch
 import gradio as gr
+from PIL import Image, ImageDraw
 
 from config.app_config import config
-from .image_processing import preprocess_sketch_input, ensure_rgb_format, validate_image_input
+from models.schedulers import SCHEDULERS, recommended_min_steps
+from config.constants import EXAMPLE_PROMPTS, EXAMPLE_MODIFICATIONS
+from monitoring.profiler import ProfilerCapture
+from monitoring.metrics import (
+    BATCH_SIZE, DENOISING_STEPS_PER_SECOND, OOM_EVENTS, REQUEST_LATENCY, REQUESTS,
+)
+from .admission import AdmissionController, AdmissionRejected
+from .batching import MicroBatcher
+from .cancellation import GenerationCancelled, RunRegistry
+from .latent_cache import ImageLatentCache
+from .previews import is_preview_step, latents_to_preview
+from .prompt_cache import PromptEmbeddingCache
+from .result_cache import ResultCache
+from .image_processing import (
+    preprocess_sketch_input, ensure_rgb_format, validate_image_input, fit_to_bucket, restore_from_bucket,
+)
+
+
+SKETCH_SUCCESS_HTML = '<div class="status-success"><span class="status-icon">🎉</span>Success! Your sketch has been transformed!</div>'
+TRANSFORM_SUCCESS_HTML = '<div class="status-success"><span class="status-icon">✨</span>Amazing! Your image has been transformed!</div>'
+# PIL info key flagging outputs decoded with a VAE tiling forced by other requests
+FORCED_TILING_INFO = "sketchmagic_forced_vae_tiling"
+# PIL info key holding the seed an output was generated with (drawn for -1)
+SEED_INFO = "sketchmagic_seed"
+
+CANCELLED_HTML = {
+    "stopped": '<div class="status-error"><span class="status-icon">⏹️</span>Generation stopped.</div>',
+    "superseded": '<div class="status-error"><span class="status-icon">⏭️</span>Replaced by a newer request.</div>',
+    "expired": '<div class="status-error"><span class="status-icon">⌛</span>Waited too long in the queue. Please try again.</div>',
+}
+
+
+class SketchRequest(namedtuple("SketchRequest", [
+    "prompt", "negative_prompt", "image", "num_inference_steps",
+    "guidance_scale", "controlnet_conditioning_scale", "seed", "scheduler", "placement",
+], defaults=(None, None))):
+    """A single validated sketch-to-image request."""
+
+    __slots__ = ()
+
+    def batch_key(self):
+        """Requests with equal keys can share one pipeline call."""
+        return (
+            self.image.size, self.num_inference_steps,
+            self.guidance_scale, self.controlnet_conditioning_scale, self.scheduler,
+        )
+
+
+class TransformRequest(namedtuple("TransformRequest", [
+    "prompt", "image", "guidance_scale", "image_guidance_scale",
+    "num_inference_steps", "seed", "scheduler", "placement",
+], defaults=(None, None))):
+    """A single validated InstructPix2Pix transform request."""
+
+    __slots__ = ()
 
 
 class ImageGenerator:
     """Handles image generation and transformation operations."""
     
-    def __init__(self, model_manager):
+    def __init__(self, model_manager, worker_pool=None):
+        """
+        Args:
+            model_manager: ModelManager providing the pipelines
+            worker_pool: Optional PreforkPool; pipeline calls then run on its
+                worker processes. Batching and the result cache stay in this
+                process, while the prompt embedding and image latent caches
+                live in each worker next to the encoders they cache
+        """
         self.model_manager = model_manager
+        self.worker_pool = worker_pool
+        self._preview_lock = threading.Lock()
+        self._preview_stats = {"previews": 0, "seconds": 0.0}
+        self._warmup_stats = None
+        self._runs = RunRegistry()
+        self.profiler = ProfilerCapture(config.PROFILER["output_dir"], config.PROFILER["row_limit"], relay=worker_pool)
+        self.admission = AdmissionController(
+            max_pending=config.QUEUE["max_size"],
+            per_session_limit=config.QUEUE["per_session_limit"],
+            concurrency=self.get_event_concurrency(),
+            max_wait_seconds=config.QUEUE["max_wait_seconds"],
+            stale_seconds=config.QUEUE["stale_seconds"],
+        )
+
+        self._sketch_batcher = None
+        if config.SKETCH_BATCHING["enabled"]:
+            self._sketch_batcher = MicroBatcher(
+                lambda jobs: self._run_sketch_batch(*zip(*jobs)),
+                max_batch_size=config.SKETCH_BATCHING["max_batch_size"],
+                window_seconds=config.SKETCH_BATCHING["window_ms"] / 1000.0,
+                name="sketch-batcher",
+            )
+
+        self._result_cache = None
+        if config.RESULT_CACHE["enabled"]:
+            self._result_cache = ResultCache(
+                memory_bytes=config.RESULT_CACHE["memory_mb"] * 1024**2,
+                disk_dir=config.RESULT_CACHE["disk_dir"],
+                disk_bytes=config.RESULT_CACHE["disk_mb"] * 1024**2,
+            )
+
+        # With prefork workers the encoders only run in the workers, which keep
+        # their own prompt embedding and latent caches
+        self._latent_cache = None
+        if config.IMAGE_LATENT_CACHE["enabled"] and worker_pool is None:
+            self._latent_cache = ImageLatentCache(
+                vae_key_fn=model_manager.get_component_key,
+                max_bytes=config.IMAGE_LATENT_CACHE["memory_mb"] * 1024**2,
+            )
+
+        self._prompt_cache = None
+        if config.PROMPT_EMBEDDING_CACHE["enabled"] and worker_pool is None:
+            self._prompt_cache = PromptEmbeddingCache(
+                encoder_key_fn=model_manager.get_component_key,
+                max_entries=config.PROMPT_EMBEDDING_CACHE["max_entries"],
+                persist_path=config.PROMPT_EMBEDDING_CACHE["persist_path"],
+            )
+            if config.PROMPT_EMBEDDING_CACHE["precompute_presets"]:
+                self.warm_prompt_cache()
     
     def generate_from_sketch(self, sketch_input_data, prompt, negative_prompt, 
                            guidance_scale, num_inference_steps, seed, 
-                           controlnet_conditioning_scale, progress=gr.Progress()):
+                           controlnet_conditioning_scale, scheduler=None, progress=gr.Progress(),
+                           gr_request: gr.Request = None):
         """
         Converts a user sketch into a generated image based on a text prompt.
         
@@ -27,17 +148,86 @@ class ImageGenerator:
             num_inference_steps: Number of denoising steps
             seed: Random seed (-1 for random)
             controlnet_conditioning_scale: How much to follow the sketch
+            scheduler: Scheduler name (None for the configured default)
             progress: Gradio progress tracker
+            gr_request: Gradio request, used to supersede older runs of the session
             
         Returns:
             tuple: (generated_image, status_html)
         """
-        pipe_sketch = self.model_manager.get_sketch_pipeline()
-        if pipe_sketch is None:
+        request, error_html = self._prepare_sketch_request(
+            sketch_input_data, prompt, negative_prompt, guidance_scale,
+            num_inference_steps, seed, controlnet_conditioning_scale, scheduler
+        )
+        if error_html:
+            return None, error_html
+
+        start = time.perf_counter()
+        session_id = self._session_id(gr_request)
+        token = self._runs.start(session_id, "sketch")
+        try:
+            progress(0.1, desc="🎨 Preparing your sketch...")
+
+            generated_img = self._generate_sketch(request, token=token)
+
+            progress(1.0, desc="✨ Masterpiece created!")
+            self._record_request("sketch", start)
+            return generated_img, SKETCH_SUCCESS_HTML
+
+        except Exception as e:
+            self._record_request("sketch", start, e)
+            return self._handle_generation_error(e, "generating")
+        finally:
+            self._runs.finish(session_id, "sketch", token)
+
+    def generate_from_sketch_stream(self, sketch_input_data, prompt, negative_prompt,
+                                    guidance_scale, num_inference_steps, seed,
+                                    controlnet_conditioning_scale, scheduler=None, progress=gr.Progress(),
+                                    gr_request: gr.Request = None):
+        """
+        Streaming variant of generate_from_sketch for Gradio.
+
+        Yields a cheap latent preview every STEP_PREVIEWS["interval"] steps,
+        then the final image.
+
+        Yields:
+            tuple: (image, status_html)
+        """
+        request, error_html = self._prepare_sketch_request(
+            sketch_input_data, prompt, negative_prompt, guidance_scale,
+            num_inference_steps, seed, controlnet_conditioning_scale, scheduler
+        )
+        if error_html:
+            yield None, error_html
+            return
+
+        progress(0.1, desc="🎨 Preparing your sketch...")
+        yield from self._stream_generation(
+            lambda step_callback, token: self._generate_sketch(request, step_callback, token),
+            request.num_inference_steps, "sketch", "generating", SKETCH_SUCCESS_HTML,
+            "✨ Masterpiece created!", progress, gr_request
+        )
+
+    def _prepare_sketch_request(self, sketch_input_data, prompt, negative_prompt,
+                                guidance_scale, num_inference_steps, seed,
+                                controlnet_conditioning_scale, scheduler=None):
+        """
+        Validate sketch inputs and build a SketchRequest.
+
+        Returns:
+            tuple: (request, error_html), one of which is None
+        """
+        if not self.model_manager.is_pipeline_available("sketch"):
             return None, f'<div class="status-error">❌ Sketch-to-Image model not loaded. {self.model_manager.get_load_status()}</div>'
 
         # Preprocess sketch input
-        sketch_image, error_message = preprocess_sketch_input(sketch_input_data)
+        preprocessing = config.SKETCH_PREPROCESSING
+        sketch_image, error_message = preprocess_sketch_input(
+            sketch_input_data,
+            ink_threshold=preprocessing["ink_threshold"],
+            min_ink_pixels=preprocessing["min_ink_pixels"],
+            crop_margin=preprocessing["crop_margin"] if preprocessing["crop_to_strokes"] else None,
+        )
         if error_message:
             return None, f'<div class="status-error">❌ {error_message}</div>'
 
@@ -45,43 +235,158 @@ class ImageGenerator:
         if not prompt or prompt.strip() == "":
             return None, '<div class="status-error">❌ Please provide a detailed description of your sketch!</div>'
 
-        try:
-            progress(0.1, desc="🎨 Preparing your sketch...")
+        scheduler, error_html = self._resolve_scheduler("sketch", scheduler, num_inference_steps)
+        if error_html:
+            return None, error_html
+
+        # Snap the canvas to a resolution bucket; the output is cropped back later
+        placement = None
+        if config.RESOLUTION_BUCKETS["enabled"]:
+            sketch_image, placement = fit_to_bucket(sketch_image, config.RESOLUTION_BUCKETS["sizes"], pad="white")
+
+        request = SketchRequest(
+            prompt=prompt,
+            negative_prompt=negative_prompt if negative_prompt and negative_prompt.strip() else None,
+            image=sketch_image,
+            num_inference_steps=int(num_inference_steps),
+            guidance_scale=float(guidance_scale),
+            controlnet_conditioning_scale=float(controlnet_conditioning_scale),
+            seed=int(seed),
+            scheduler=scheduler,
+            placement=placement,
+        )
+        return request, None
+
+    def _generate_sketch(self, request, step_callback=None, token=None):
+        """Serve a sketch request from the result cache or run it through the pipeline."""
+        # Seeded requests are deterministic, so a previous result can be reused
+        cache_key = self._result_cache_key("sketch", request)
+        generated_img = self._result_cache.get(cache_key) if cache_key else None
+
+        if generated_img is None:
+            start = time.perf_counter()
+            # Generate image, sharing a pipeline call with compatible concurrent requests
+            with self.profiler.capture("sketch"):
+                if self.worker_pool is not None:
+                    generated_img = self.worker_pool.run("sketch", request, step_callback, token)
+                elif self._sketch_batcher is not None:
+                    generated_img = self._sketch_batcher.submit(request.batch_key(), (request, step_callback, token))
+                else:
+                    generated_img = self._run_sketch_batch([request], [step_callback], [token])[0]
+            if isinstance(generated_img, Exception):
+                raise generated_img
+            self.admission.observe("sketch", request.num_inference_steps, time.perf_counter() - start)
+
+            # Decoded with another VAE tiling than the request gets on its own
+            forced_tiling = generated_img.info.pop(FORCED_TILING_INFO, False)
+            if cache_key and not forced_tiling:
+                self._result_cache.put(cache_key, generated_img)
+
+        return self._finish_output(generated_img, request)
+
+    def _run_sketch_batch(self, requests, step_callbacks=None, tokens=None):
+        """
+        Run one or more compatible sketch requests through a single pipeline call.
+
+        Requests cancelled while waiting are skipped. The batch is aborted
+        once every request in it has been cancelled.
+
+        Args:
+            requests: List of SketchRequest sharing the same batch key
+            step_callbacks: Optional per-request callables taking (step, latents)
+            tokens: Optional per-request CancellationToken
+
+        Returns:
+            list: Generated images in request order, or a GenerationCancelled
+            instance for requests that were cancelled
+        """
+        tokens = list(tokens or [None] * len(requests))
+        step_callbacks = list(step_callbacks or [None] * len(requests))
+        results = [GenerationCancelled(token.reason) if token is not None and token.cancelled else None
+                   for token in tokens]
+        live = [index for index, result in enumerate(results) if result is None]
+        if not live:
+            return results
 
-            # Setup generator for reproducible results
-            generator = None
-            if seed != -1:
-                generator = torch.Generator(config.DEVICE).manual_seed(int(seed))
+        requests = [requests[index] for index in live]
+        step_callbacks = [step_callbacks[index] for index in live]
+        live_tokens = [tokens[index] for index in live]
 
-            conditioning_scale = float(controlnet_conditioning_scale)
+        workload = requests[0].image.size + (len(requests),)
+        tiling_seen = set()
+        with self.model_manager.use_pipeline("sketch", requests[0].scheduler, workload, tiling_seen) as pipe_sketch:
+            if pipe_sketch is None:
+                raise RuntimeError("Sketch-to-Image model not loaded.")
 
-            # Generate image
-            with torch.autocast(config.DEVICE):
+            first = requests[0]
+
+            # Per-item generators keep every request reproducible inside a batch,
+            # with a seed drawn for random (-1) ones so it can be reported
+            generator, seeds = zip(*(self._make_generator(r.seed) for r in requests))
+            generator = list(generator)
+
+            call_start = time.perf_counter()
+            with self.profiler.label_stages(pipe_sketch), self.model_manager.autocast():
                 result = pipe_sketch(
-                    prompt=prompt,
-                    negative_prompt=negative_prompt if negative_prompt and negative_prompt.strip() else None,
-                    image=sketch_image,
-                    num_inference_steps=int(num_inference_steps),
-                    guidance_scale=float(guidance_scale),
-                    controlnet_conditioning_scale=conditioning_scale,
-                    generator=generator
+                    image=[r.image for r in requests],
+                    num_inference_steps=first.num_inference_steps,
+                    guidance_scale=first.guidance_scale,
+                    controlnet_conditioning_scale=first.controlnet_conditioning_scale,
+                    generator=generator,
+                    **self._prompt_kwargs(
+                        pipe_sketch,
+                        [r.prompt for r in requests],
+                        [r.negative_prompt for r in requests]
+                    ),
+                    **self._step_callback_kwargs(step_callbacks, live_tokens)
                 )
 
-            generated_img = result.images[0]
+            generated_imgs = list(result.images)
+            self._record_pipeline_call("sketch", first.num_inference_steps, len(requests), call_start)
 
             # Cleanup memory
             del result
             self.model_manager.cleanup_memory()
 
-            progress(1.0, desc="✨ Masterpiece created!")
-            return generated_img, '<div class="status-success"><span class="status-icon">🎉</span>Success! Your sketch has been transformed!</div>'
+        self._mark_forced_tiling("sketch", requests[0].image.size, tiling_seen, generated_imgs)
+        for image, seed in zip(generated_imgs, seeds):
+            image.info[SEED_INFO] = seed
+        for index, image in zip(live, generated_imgs):
+            token = tokens[index]
+            results[index] = GenerationCancelled(token.reason) if token is not None and token.cancelled else image
+        return results
 
-        except Exception as e:
-            return self._handle_generation_error(e, "generating")
+    @staticmethod
+    def _resolve_scheduler(pipeline_name, scheduler, num_inference_steps):
+        """
+        Resolve a requested scheduler name, defaulting to the configured one.
+
+        Returns:
+            tuple: (scheduler_name, error_html), one of which is None
+        """
+        scheduler = scheduler or config.DEFAULT_SCHEDULERS[pipeline_name]
+        if scheduler not in SCHEDULERS:
+            return None, f'<div class="status-error">❌ Unknown scheduler "{scheduler}".</div>'
+        if int(num_inference_steps) < recommended_min_steps(scheduler):
+            print(f"⚠️ {scheduler} is run with {int(num_inference_steps)} steps, below its recommended "
+                  f"minimum of {recommended_min_steps(scheduler)}.")
+        return scheduler, None
+
+    @staticmethod
+    def _make_generator(seed):
+        """
+        Create a torch generator for a seed, drawing a random seed for -1.
+
+        Returns:
+            tuple: (torch.Generator, the seed it was seeded with)
+        """
+        if seed == -1:
+            seed = random.randint(0, 2**32 - 1)
+        return torch.Generator(config.DEVICE).manual_seed(int(seed)), int(seed)
 
     def transform_image(self, generated_image, manipulation_prompt, guidance_scale, 
                        image_guidance_scale, num_inference_steps, seed, 
-                       progress=gr.Progress()):
+                       scheduler=None, progress=gr.Progress(), gr_request: gr.Request = None):
         """
         Manipulates an existing image based on a text instruction.
         
@@ -92,13 +397,75 @@ class ImageGenerator:
             image_guidance_scale: How much to preserve original image
             num_inference_steps: Number of denoising steps
             seed: Random seed (-1 for random)
+            scheduler: Scheduler name (None for the configured default)
             progress: Gradio progress tracker
+            gr_request: Gradio request, used to supersede older runs of the session
             
         Returns:
             tuple: (modified_image, status_html)
         """
-        pipe_manipulate = self.model_manager.get_manipulate_pipeline()
-        if pipe_manipulate is None:
+        request, error_html = self._prepare_transform_request(
+            generated_image, manipulation_prompt, guidance_scale,
+            image_guidance_scale, num_inference_steps, seed, scheduler
+        )
+        if error_html:
+            return None, error_html
+
+        start = time.perf_counter()
+        session_id = self._session_id(gr_request)
+        token = self._runs.start(session_id, "manipulation")
+        try:
+            progress(0.2, desc="🔮 Reading your instructions...")
+            progress(0.5, desc="✨ Applying magical transformations...")
+
+            modified_img = self._generate_transform(request, token=token)
+
+            progress(1.0, desc="🪄 Transformation complete!")
+            self._record_request("manipulation", start)
+            return modified_img, TRANSFORM_SUCCESS_HTML
+
+        except Exception as e:
+            self._record_request("manipulation", start, e)
+            return self._handle_generation_error(e, "manipulation")
+        finally:
+            self._runs.finish(session_id, "manipulation", token)
+
+    def transform_image_stream(self, generated_image, manipulation_prompt, guidance_scale,
+                               image_guidance_scale, num_inference_steps, seed,
+                               scheduler=None, progress=gr.Progress(), gr_request: gr.Request = None):
+        """
+        Streaming variant of transform_image for Gradio.
+
+        Yields a cheap latent preview every STEP_PREVIEWS["interval"] steps,
+        then the final image.
+
+        Yields:
+            tuple: (image, status_html)
+        """
+        request, error_html = self._prepare_transform_request(
+            generated_image, manipulation_prompt, guidance_scale,
+            image_guidance_scale, num_inference_steps, seed, scheduler
+        )
+        if error_html:
+            yield None, error_html
+            return
+
+        progress(0.2, desc="🔮 Reading your instructions...")
+        yield from self._stream_generation(
+            lambda step_callback, token: self._generate_transform(request, step_callback, token),
+            request.num_inference_steps, "manipulation", "manipulation", TRANSFORM_SUCCESS_HTML,
+            "🪄 Transformation complete!", progress, gr_request
+        )
+
+    def _prepare_transform_request(self, generated_image, manipulation_prompt, guidance_scale,
+                                   image_guidance_scale, num_inference_steps, seed, scheduler=None):
+        """
+        Validate transform inputs and build a TransformRequest.
+
+        Returns:
+            tuple: (request, error_html), one of which is None
+        """
+        if not self.model_manager.is_pipeline_available("manipulation"):
             return None, f'<div class="status-error">❌ Image Manipulation model not loaded. {self.model_manager.get_load_status()}</div>'
 
         # Validate inputs
@@ -109,41 +476,560 @@ class ImageGenerator:
         if not manipulation_prompt or manipulation_prompt.strip() == "":
             return None, '<div class="status-error">❌ Please describe how you want to modify the image!</div>'
 
-        try:
-            progress(0.2, desc="🔮 Reading your instructions...")
+        scheduler, error_html = self._resolve_scheduler("manipulation", scheduler, num_inference_steps)
+        if error_html:
+            return None, error_html
 
-            # Setup generator for reproducible results
-            generator = None
-            if seed != -1:
-                generator = torch.Generator(config.DEVICE).manual_seed(int(seed))
+        image = ensure_rgb_format(generated_image)
+        placement = None
+        if config.RESOLUTION_BUCKETS["enabled"]:
+            image, placement = fit_to_bucket(image, config.RESOLUTION_BUCKETS["sizes"], pad="edge")
 
-            # Ensure image is in RGB format
-            generated_image = ensure_rgb_format(generated_image)
+        request = TransformRequest(
+            prompt=manipulation_prompt,
+            image=image,
+            guidance_scale=float(guidance_scale),
+            image_guidance_scale=float(image_guidance_scale),
+            num_inference_steps=int(num_inference_steps),
+            seed=int(seed),
+            scheduler=scheduler,
+            placement=placement,
+        )
+        return request, None
 
-            progress(0.5, desc="✨ Applying magical transformations...")
+    def _generate_transform(self, request, step_callback=None, token=None):
+        """Serve a transform request from the result cache or run it through the pipeline."""
+        cache_key = self._result_cache_key("manipulation", request)
+        modified_img = self._result_cache.get(cache_key) if cache_key else None
+
+        if modified_img is None:
+            start = time.perf_counter()
+            with self.profiler.capture("manipulation"):
+                if self.worker_pool is not None:
+                    modified_img = self.worker_pool.run("manipulation", request, step_callback, token)
+                else:
+                    modified_img = self._run_transform(request, step_callback, token)
+            self.admission.observe("manipulation", request.num_inference_steps, time.perf_counter() - start)
+            forced_tiling = modified_img.info.pop(FORCED_TILING_INFO, False)
+            if cache_key and not forced_tiling:
+                self._result_cache.put(cache_key, modified_img)
+
+        return self._finish_output(modified_img, request)
+
+    @staticmethod
+    def _finish_output(image, request):
+        """Crop an output back from its bucket, keeping the seed it was generated with in its info."""
+        seed = image.info.get(SEED_INFO, request.seed)
+        if request.placement is not None:
+            image = restore_from_bucket(image, request.placement)
+        image.info[SEED_INFO] = seed
+        return image
+
+    def _run_transform(self, request, step_callback=None, token=None):
+        """
+        Run a single transform request through the InstructPix2Pix pipeline.
+
+        Args:
+            request: TransformRequest to run
+            step_callback: Optional callable taking (step, latents)
+            token: Optional CancellationToken checked at every step
+
+        Returns:
+            PIL.Image: The transformed image
+        """
+        if token is not None:
+            token.raise_if_cancelled()
+
+        workload = request.image.size + (1,)
+        tiling_seen = set()
+        with self.model_manager.use_pipeline("manipulation", request.scheduler, workload, tiling_seen) as pipe_manipulate:
+            if pipe_manipulate is None:
+                raise RuntimeError("Image Manipulation model not loaded.")
+
+            # Setup generator for reproducible results, drawing a seed for -1
+            generator, seed = self._make_generator(request.seed)
 
             # Transform image
-            with torch.autocast(config.DEVICE):
+            call_start = time.perf_counter()
+            with self.profiler.label_stages(pipe_manipulate), self.model_manager.autocast():
+                # The pipeline takes 4-channel latents in place of the image and skips its VAE encode
+                image = request.image
+                if self._latent_cache is not None:
+                    image = self._latent_cache.get(pipe_manipulate, image, pipe_manipulate._execution_device)
                 result = pipe_manipulate(
-                    prompt=manipulation_prompt,
-                    image=generated_image,
-                    guidance_scale=float(guidance_scale),
-                    num_inference_steps=int(num_inference_steps),
-                    image_guidance_scale=float(image_guidance_scale),
-                    generator=generator
+                    image=image,
+                    guidance_scale=request.guidance_scale,
+                    num_inference_steps=request.num_inference_steps,
+                    image_guidance_scale=request.image_guidance_scale,
+                    generator=generator,
+                    **self._prompt_kwargs(pipe_manipulate, [request.prompt], [None]),
+                    **self._step_callback_kwargs([step_callback], [token])
                 )
 
             modified_img = result.images[0]
+            self._record_pipeline_call("manipulation", request.num_inference_steps, 1, call_start)
 
             # Cleanup memory
             del result
             self.model_manager.cleanup_memory()
 
-            progress(1.0, desc="🪄 Transformation complete!")
-            return modified_img, '<div class="status-success"><span class="status-icon">✨</span>Amazing! Your image has been transformed!</div>'
+        self._mark_forced_tiling("manipulation", request.image.size, tiling_seen, [modified_img])
+        modified_img.info[SEED_INFO] = seed
+        return modified_img
+
+    def _mark_forced_tiling(self, pipeline_name, size, tiling_seen, images):
+        """
+        Flag images whose VAE decode ran with another tiling than the request needs alone.
+
+        Concurrent requests (or the batch a request shared) can switch tiled
+        decode on, which changes the pixels; such images are returned but not
+        stored in the result cache.
+        """
+        if tiling_seen and tiling_seen != {self.model_manager.needs_vae_tiling(pipeline_name, *size)}:
+            for image in images:
+                image.info[FORCED_TILING_INFO] = True
+
+    @staticmethod
+    def _step_callback_kwargs(step_callbacks, tokens=None):
+        """
+        Build the pipeline's step-end callback arguments.
+
+        Each callback receives the step index and the latents of its own
+        batch item. When every item's token has been cancelled, the run is
+        aborted by raising GenerationCancelled from the denoising loop.
+        """
+        tokens = tokens or []
+        if not any(step_callbacks or []) and not any(tokens):
+            return {}
+
+        def on_step_end(pipe, step, timestep, callback_kwargs):
+            if tokens and all(token is not None and token.cancelled for token in tokens):
+                raise GenerationCancelled(tokens[0].reason)
+
+            latents = callback_kwargs["latents"]
+            for index, callback in enumerate(step_callbacks):
+                if callback is not None:
+                    callback(step, latents[index])
+            return callback_kwargs
+
+        return {
+            "callback_on_step_end": on_step_end,
+            "callback_on_step_end_tensor_inputs": ["latents"],
+        }
+
+    def prepare_request(self, operation, image, params):
+        """
+        Validate an input image and hyperparameters into a request for generate().
+
+        Args:
+            operation: "sketch" or "manipulation"
+            image: PIL Image (sketch canvas or source image)
+            params: Dict with "prompt" and optional "negative_prompt" (sketch
+                only), "guidance_scale", "image_guidance_scale",
+                "controlnet_conditioning_scale", "num_inference_steps",
+                "seed" and "scheduler"; missing or None values default to
+                SKETCH_HYPERPARAMS / MANIPULATION_HYPERPARAMS
+
+        Returns:
+            SketchRequest or TransformRequest
+
+        Raises:
+            ValueError: If the operation, image or hyperparameters are invalid
+                or the pipeline is not available
+        """
+        if operation == "sketch":
+            defaults = config.SKETCH_HYPERPARAMS
+        elif operation == "manipulation":
+            defaults = config.MANIPULATION_HYPERPARAMS
+        else:
+            raise ValueError('operation must be "sketch" or "manipulation"')
+        params = {**defaults, **{name: value for name, value in params.items() if value is not None}}
+
+        if operation == "sketch":
+            request, error_html = self._prepare_sketch_request(
+                image, params.get("prompt"), params.get("negative_prompt"), params["guidance_scale"],
+                params["num_inference_steps"], params["seed"], params["controlnet_conditioning_scale"],
+                params.get("scheduler"),
+            )
+        else:
+            request, error_html = self._prepare_transform_request(
+                image, params.get("prompt"), params["guidance_scale"], params["image_guidance_scale"],
+                params["num_inference_steps"], params["seed"], params.get("scheduler"),
+            )
+        if error_html:
+            raise ValueError(re.sub(r"<[^>]+>", "", error_html).replace("❌", "").strip())
+        return request
 
+    def generate(self, request, step_callback=None, token=None):
+        """
+        Run a request from prepare_request() outside the UI.
+
+        The request goes through the same path as UI clicks (result cache,
+        micro-batching, prefork workers) and is counted in the request
+        metrics; failures are logged before they are raised.
+
+        Args:
+            request: SketchRequest or TransformRequest
+            step_callback: Optional callable taking (step, latents)
+            token: Optional CancellationToken checked at every step
+
+        Returns:
+            PIL.Image: The output at the input's size; info[SEED_INFO] holds
+            the seed it was generated with
+
+        Raises:
+            GenerationCancelled: If the token was cancelled
+        """
+        operation = "sketch" if isinstance(request, SketchRequest) else "manipulation"
+        start = time.perf_counter()
+        try:
+            if operation == "sketch":
+                image = self._generate_sketch(request, step_callback, token)
+            else:
+                image = self._generate_transform(request, step_callback, token)
         except Exception as e:
-            return self._handle_generation_error(e, "manipulation")
+            self._record_request(operation, start, e)
+            self._handle_generation_error(e, "generating" if operation == "sketch" else "manipulation")
+            raise
+        self._record_request(operation, start)
+        return image
+
+    def _stream_generation(self, run, num_inference_steps, operation, operation_type,
+                           success_html, done_desc, progress, gr_request=None):
+        """
+        Run a generation on a worker thread and yield previews as they arrive.
+
+        If the consumer stops iterating (client disconnect or Gradio cancel),
+        the run's token is cancelled so the worker aborts at its next step.
+
+        Args:
+            run: Callable taking a step callback and a cancellation token and
+                returning the final image
+            num_inference_steps: Total denoising steps, for progress reporting
+            operation: "sketch" or "manipulation", for run tracking
+            operation_type: Operation name used in error messages
+            success_html: Status HTML for the final yield
+            done_desc: Progress description once finished
+            progress: Gradio progress tracker
+            gr_request: Gradio request identifying the session
+
+        Yields:
+            tuple: (image, status_html)
+        """
+        updates = queue.Queue()
+
+        def on_step(step, latents):
+            if not is_preview_step(step, num_inference_steps, config.STEP_PREVIEWS["interval"]):
+                return
+            completed = step + 1
+            start = time.perf_counter()
+            preview = latents_to_preview(latents, config.STEP_PREVIEWS["max_size"])
+            elapsed = time.perf_counter() - start
+            with self._preview_lock:
+                self._preview_stats["previews"] += 1
+                self._preview_stats["seconds"] += elapsed
+            updates.put(("preview", completed, preview))
+
+        start = time.perf_counter()
+        session_id = self._session_id(gr_request)
+        token = self._runs.start(session_id, operation)
+
+        def worker():
+            try:
+                updates.put(("done", run(on_step, token)))
+            except Exception as e:
+                updates.put(("error", e))
+
+        threading.Thread(target=worker, daemon=True).start()
+
+        finished = False
+        try:
+            while True:
+                kind, *payload = updates.get()
+                if kind == "preview":
+                    completed, preview = payload
+                    progress(completed / num_inference_steps, desc=f"Step {completed}/{num_inference_steps}")
+                    yield preview, f'<div class="status-progress">⏳ Step {completed}/{num_inference_steps}...</div>'
+                elif kind == "done":
+                    finished = True
+                    self._record_request(operation, start)
+                    progress(1.0, desc=done_desc)
+                    yield payload[0], success_html
+                    return
+                else:
+                    finished = True
+                    self._record_request(operation, start, payload[0])
+                    yield self._handle_generation_error(payload[0], operation_type)
+                    return
+        finally:
+            if not finished:
+                token.cancel("stopped")
+                self._record_request(operation, start, GenerationCancelled("stopped"))
+            self._runs.finish(session_id, operation, token)
+
+    @staticmethod
+    def _record_request(operation, start, error=None):
+        """Count a finished request by outcome and record the latency of successful ones."""
+        if error is None:
+            REQUEST_LATENCY.observe(time.perf_counter() - start, operation=operation)
+            status = "success"
+        elif isinstance(error, GenerationCancelled):
+            status = "cancelled"
+        else:
+            status = "error"
+        REQUESTS.inc(operation=operation, status=status)
+
+    @staticmethod
+    def _record_pipeline_call(operation, num_inference_steps, batch_size, start):
+        """Record the denoising throughput and batch size of a pipeline call."""
+        elapsed = time.perf_counter() - start
+        if elapsed > 0:
+            DENOISING_STEPS_PER_SECOND.observe(num_inference_steps / elapsed, operation=operation)
+        BATCH_SIZE.observe(batch_size, operation=operation)
+
+    @staticmethod
+    def _session_id(gr_request):
+        """Return the Gradio session id of a request, or None outside Gradio."""
+        return getattr(gr_request, "session_hash", None) if gr_request is not None else None
+
+    def stop_sketch(self, gr_request: gr.Request = None):
+        """Stop the session's running sketch generation within one step."""
+        self._runs.cancel(self._session_id(gr_request), "sketch")
+        self.admission.cancel_session(self._session_id(gr_request), "sketch")
+
+    def stop_transform(self, gr_request: gr.Request = None):
+        """Stop the session's running transformation within one step."""
+        self._runs.cancel(self._session_id(gr_request), "manipulation")
+        self.admission.cancel_session(self._session_id(gr_request), "manipulation")
+
+    def admit_sketch(self, num_inference_steps, gr_request: gr.Request = None):
+        """Stop the session's running sketch generation and admit a new one into the queue."""
+        return self._admit("sketch", num_inference_steps, gr_request)
+
+    def admit_transform(self, num_inference_steps, gr_request: gr.Request = None):
+        """Stop the session's running transformation and admit a new one into the queue."""
+        return self._admit("manipulation", num_inference_steps, gr_request)
+
+    def _admit(self, operation, num_inference_steps, gr_request):
+        """
+        Admit a UI request, superseding the session's running one.
+
+        Returns:
+            str: Status HTML with the request's place in line and ETA
+
+        Raises:
+            gr.Error: If the queue or the session is at its limit
+        """
+        session_id = self._session_id(gr_request)
+        try:
+            estimate = self.admission.admit(session_id, operation, num_inference_steps)
+        except AdmissionRejected as e:
+            raise gr.Error(f"🚦 {e}")
+        # The admitted click replaces the running run; older queued clicks are skipped when dequeued
+        self._runs.cancel(session_id, operation, reason="superseded")
+
+        eta = f", about {estimate['eta_seconds']:.0f}s" if estimate["eta_seconds"] is not None else ""
+        if estimate["ahead"]:
+            return f'<div class="status-progress">⏳ Queued behind {estimate["ahead"]} request(s){eta}...</div>'
+        return f'<div class="status-progress">⏳ Starting{eta}...</div>'
+
+    @staticmethod
+    def get_event_concurrency():
+        """
+        Get the number of simultaneous Gradio events per operation.
+
+        Unset limits follow the execution setup: enough sketch events to fill
+        a micro-batch, and one event per prefork worker.
+        """
+        workers = max(1, config.PREFORK["workers"])
+        sketch_batch = config.SKETCH_BATCHING["max_batch_size"] if config.SKETCH_BATCHING["enabled"] else 1
+        defaults = {"sketch": max(workers, sketch_batch), "manipulation": workers}
+        return {operation: config.QUEUE["concurrency"].get(operation) or default
+                for operation, default in defaults.items()}
+
+    def get_admission_stats(self):
+        """Get admitted, rejected and skipped request counts, requests in line and seconds per step."""
+        return self.admission.get_stats()
+
+    def get_run_stats(self):
+        """Get counts of started, superseded and stopped runs."""
+        return self._runs.get_stats()
+
+    def get_preview_stats(self):
+        """Get the number of previews produced and their total and average cost."""
+        with self._preview_lock:
+            stats = dict(self._preview_stats)
+        stats["average_ms"] = 1000.0 * stats["seconds"] / stats["previews"] if stats["previews"] else 0.0
+        return stats
+
+    def _result_cache_key(self, operation, request):
+        """Return the result cache key for a seeded request, or None if it is not cacheable."""
+        if self._result_cache is None or request.seed == -1:
+            return None
+
+        params = request._asdict()
+        image = params.pop("image")
+        if operation == "sketch":
+            model_ids = [config.CONTROLNET_MODEL_ID, config.STABLE_DIFFUSION_MODEL_ID]
+        else:
+            model_ids = [config.INSTRUCTPIX2PIX_MODEL_ID]
+        model_signature = {
+            "models": model_ids,
+            "device": config.DEVICE,
+            "dtype": str(config.DTYPE),
+            "execution": self.model_manager.get_execution_signature(),
+            "vae_tiling": self.model_manager.needs_vae_tiling(operation, *image.size),
+        }
+        return ResultCache.make_key(operation, image, params, model_signature)
+
+    def get_result_cache_stats(self):
+        """Get hit-rate statistics of the result cache."""
+        return self._result_cache.get_stats() if self._result_cache is not None else None
+
+    def _prompt_kwargs(self, pipe, prompts, negative_prompts):
+        """
+        Build the prompt arguments for a pipeline call.
+
+        With the embedding cache enabled, prompts are passed as cached
+        `prompt_embeds` / `negative_prompt_embeds`; otherwise as raw strings.
+        """
+        if self._prompt_cache is None:
+            return {
+                "prompt": prompts if len(prompts) > 1 else prompts[0],
+                "negative_prompt": ([n or "" for n in negative_prompts] if len(prompts) > 1 else negative_prompts[0])
+                if any(negative_prompts) else None,
+            }
+
+        device = pipe._execution_device
+        return {
+            "prompt_embeds": self._prompt_cache.get_batch(pipe, prompts, device),
+            "negative_prompt_embeds": self._prompt_cache.get_batch(pipe, [n or "" for n in negative_prompts], device),
+        }
+
+    def warm_prompt_cache(self):
+        """Precompute embeddings for the quick-prompt presets of every loaded pipeline."""
+        if self._prompt_cache is None:
+            return
+
+        presets = {"sketch": EXAMPLE_PROMPTS, "manipulation": EXAMPLE_MODIFICATIONS}
+        for name, texts in presets.items():
+            if not self.model_manager.is_pipeline_loaded(name):
+                continue
+            with self.model_manager.use_pipeline(name) as pipe:
+                if pipe is None:
+                    continue
+                with self.model_manager.autocast():
+                    self._prompt_cache.warm(pipe, [""] + list(texts), pipe._execution_device)
+        self._prompt_cache.save()
+
+    def warm_up(self):
+        """
+        Run tiny dummy generations through every loaded pipeline at each resolution bucket.
+
+        Without bucketing, inputs keep their own size, so only
+        WARMUP["default_size"] is warmed up. Lazy pipelines that are not
+        loaded yet are loaded first with WARMUP["load_lazy"], and skipped with
+        a warning otherwise.
+
+        The first calls pay for allocator growth, kernel selection and thread
+        pool start-up; running them before serving keeps that cost off real
+        requests. Each bucket is run WARMUP["runs"] times so the first run can
+        be compared with the steady state.
+
+        Returns:
+            dict: {pipeline: {"WxH": {"first_s", "steady_s", "runs"}}}
+        """
+        steps = int(config.WARMUP["steps"])
+        runs = max(1, int(config.WARMUP["runs"]))
+        if config.RESOLUTION_BUCKETS["enabled"]:
+            sizes = config.RESOLUTION_BUCKETS["sizes"]
+        else:
+            sizes = [tuple(config.WARMUP["default_size"])]
+        stats = {}
+        for name in config.WARMUP["pipelines"]:
+            if not self.model_manager.is_pipeline_loaded(name):
+                if not config.WARMUP["load_lazy"]:
+                    print(f"⚠️ Not warming up the lazy {name} pipeline; its first request pays for loading and "
+                          f"warm-up. Set WARMUP['load_lazy'] = True to load it now.")
+                    continue
+                print(f"⏳ Loading the lazy {name} pipeline for warm-up...")
+                with self.model_manager.use_pipeline(name) as pipe:
+                    loaded = pipe is not None
+                if not loaded:
+                    print(f"⚠️ Skipping warm-up of the {name} pipeline, it failed to load.")
+                    continue
+            stats[name] = {}
+            for width, height in sizes:
+                seconds = []
+                for _ in range(runs):
+                    start = time.perf_counter()
+                    self._run_warmup_call(name, width, height, steps)
+                    seconds.append(time.perf_counter() - start)
+                timing = {
+                    "first_s": seconds[0],
+                    "steady_s": statistics.median(seconds[1:]) if runs > 1 else None,
+                    "runs": runs,
+                }
+                stats[name][f"{width}x{height}"] = timing
+                self.admission.observe(name, steps, timing["steady_s"] or timing["first_s"])
+                steady = f", steady {timing['steady_s']:.2f}s" if timing["steady_s"] is not None else ""
+                print(f"🔥 Warm-up {name} {width}x{height}: first {timing['first_s']:.2f}s{steady} ({steps} steps).")
+
+        self._warmup_stats = stats
+        return stats
+
+    def _run_warmup_call(self, name, width, height, steps):
+        """Run one uncached generation on a synthetic input of the given size."""
+        if name == "sketch":
+            canvas = Image.new("RGB", (width, height), "white")
+            ImageDraw.Draw(canvas).ellipse((width // 4, height // 4, 3 * width // 4, 3 * height // 4),
+                                           outline="black", width=max(1, width // 64))
+            request = SketchRequest(
+                prompt="a house", negative_prompt=None, image=canvas, num_inference_steps=steps,
+                guidance_scale=7.5, controlnet_conditioning_scale=1.0, seed=0,
+            )
+            result = self._run_sketch_batch([request])[0]
+            if isinstance(result, Exception):
+                raise result
+        else:
+            request = TransformRequest(
+                prompt="make it blue", image=Image.new("RGB", (width, height), (128, 128, 128)),
+                guidance_scale=7.5, image_guidance_scale=1.5, num_inference_steps=steps, seed=0,
+            )
+            self._run_transform(request)
+
+    def get_warmup_stats(self):
+        """Get first-run and steady-state warm-up timings, or None if warm-up has not run."""
+        return self._warmup_stats
+
+    def get_latent_cache_stats(self):
+        """Get hit-rate statistics of the image latent cache."""
+        return self._latent_cache.get_stats() if self._latent_cache is not None else None
+
+    def get_prompt_cache_stats(self):
+        """Get hit-rate statistics of the prompt embedding cache."""
+        return self._prompt_cache.get_stats() if self._prompt_cache is not None else None
+
+    def get_stats(self):
+        """
+        Get the statistics of every part of the generation stack.
+
+        Returns:
+            dict: Stats keyed by component; None for components that are disabled
+        """
+        return {
+            "admission": self.get_admission_stats(),
+            "runs": self.get_run_stats(),
+            "previews": self.get_preview_stats(),
+            "warmup": self.get_warmup_stats(),
+            "result_cache": self.get_result_cache_stats(),
+            "latent_cache": self.get_latent_cache_stats(),
+            "prompt_cache": self.get_prompt_cache_stats(),
+            "batching": self._sketch_batcher.get_stats() if self._sketch_batcher is not None else None,
+            "prefork": self.worker_pool.get_stats() if self.worker_pool is not None else None,
+            "residency": self.model_manager.get_residency_stats(),
+            "cpu_profile": self.model_manager.get_cpu_profile(),
+        }
 
     def _handle_generation_error(self, error, operation_type):
         """
@@ -156,11 +1042,16 @@ class ImageGenerator:
         Returns:
             tuple: (None, error_html)
         """
+        if isinstance(error, GenerationCancelled):
+            print(f"{operation_type.capitalize()} run cancelled ({error}).")
+            return None, CANCELLED_HTML.get(str(error), CANCELLED_HTML["stopped"])
+
         error_msg = f"❌ Error during {operation_type}: {str(error)}"
         print(f"Error in {operation_type}: {error}")
         
         error_str = str(error).lower()
         if any(keyword in error_str for keyword in ["cuda out of memory", "hiplaunchkernel", "out of memory"]):
+            OOM_EVENTS.inc(stage="generation")
             error_msg = f"❌ GPU Memory (VRAM) Error during {operation_type}. Try reducing image size or complexity, or free up GPU memory. If the issue persists, restart the app."
         
         return None, f'<div class="status-error">{error_msg}</div>'
\ No newline at end of file
@@ -1,16 +1,26 @@
 """Image preprocessing and utility functions."""
 
+import math
+
 from PIL import Image
 import numpy as np
 
 
-def preprocess_sketch_input(sketch_image):
+def preprocess_sketch_input(sketch_image, ink_threshold=128, min_ink_pixels=16, crop_margin=None):
     """
     Ensures the sketch input is a PIL Image and converts it for ControlNet.
-    
+
+    The canvas is converted to grayscale once and binarized into black
+    strokes on white. Canvases with fewer than min_ink_pixels stroke pixels
+    are rejected before anything reaches the model.
+
     Args:
         sketch_image: Input from Gradio Paint component
-        
+        ink_threshold: Gray levels below this count as strokes
+        min_ink_pixels: Minimum stroke pixels for a non-empty canvas
+        crop_margin: If set, crop to the stroke bounding box and pad it by
+            this many pixels on every side
+
     Returns:
         tuple: (processed_image, error_message)
     """
@@ -32,8 +42,67 @@ def preprocess_sketch_input(sketch_image):
         else:
             return None, "Invalid image format received from sketch input. Please draw again."
 
-    sketch_image = sketch_image.convert("L").convert("RGB")
-    return sketch_image, None
+    ink = sketch_ink_mask(sketch_image, ink_threshold)
+    bbox = stroke_bbox(ink, min_ink_pixels)
+    if bbox is None:
+        return None, "The canvas is empty! Please draw something first."
+
+    if crop_margin is not None:
+        ink = crop_to_strokes(ink, bbox, crop_margin)
+    return ink_to_rgb(ink), None
+
+
+def sketch_ink_mask(image, threshold=128):
+    """
+    Boolean stroke mask of a canvas from a single grayscale conversion.
+
+    Transparent pixels count as background, so RGBA canvases with an empty
+    transparent layer are not mistaken for solid black.
+
+    Args:
+        image: PIL Image in any mode
+        threshold: Gray levels below this count as strokes
+
+    Returns:
+        np.ndarray: (height, width) bool array, True on strokes
+    """
+    if "A" in image.getbands() or "transparency" in image.info:
+        gray_alpha = np.asarray(image.convert("LA"))
+        return (gray_alpha[..., 0] < threshold) & (gray_alpha[..., 1] >= 128)
+    gray = np.asarray(image if image.mode == "L" else image.convert("L"))
+    return gray < threshold
+
+
+def stroke_bbox(ink, min_ink_pixels=1):
+    """
+    Bounding box of the strokes in an ink mask.
+
+    Args:
+        ink: Boolean stroke mask
+        min_ink_pixels: Minimum stroke pixels for a non-empty canvas
+
+    Returns:
+        tuple: (left, top, right, bottom) with exclusive right/bottom, or None
+        for an empty canvas
+    """
+    if np.count_nonzero(ink) < max(1, min_ink_pixels):
+        return None
+    rows = np.flatnonzero(ink.any(axis=1))
+    cols = np.flatnonzero(ink.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+
+def crop_to_strokes(ink, bbox, margin):
+    """Crop an ink mask to its stroke bounding box and pad it with background."""
+    left, top, right, bottom = bbox
+    return np.pad(ink[top:bottom, left:right], int(margin), constant_values=False)
+
+
+def ink_to_rgb(ink):
+    """Render an ink mask as black strokes on white in a single RGB allocation."""
+    pixels = np.full(ink.shape + (3,), 255, dtype=np.uint8)
+    pixels[ink] = 0
+    return Image.fromarray(pixels, mode="RGB")
 
 
 def ensure_rgb_format(image):
@@ -68,4 +137,81 @@ def validate_image_input(image, error_message_prefix="Image"):
     if not isinstance(image, Image.Image):
         return False, f"Invalid {error_message_prefix.lower()} format!"
     
-    return True, None
\ No newline at end of file
+    return True, None
+
+
+def nearest_bucket(size, buckets):
+    """
+    Pick the resolution bucket closest in aspect ratio, then in area.
+
+    Args:
+        size: (width, height) of the input
+        buckets: Iterable of (width, height) buckets
+
+    Returns:
+        tuple: The chosen (width, height) bucket
+    """
+    width, height = size
+    aspect = math.log(width / height)
+    area = width * height
+    return min(
+        (tuple(bucket) for bucket in buckets),
+        key=lambda b: (round(abs(math.log(b[0] / b[1]) - aspect), 6), abs(b[0] * b[1] - area))
+    )
+
+
+def fit_to_bucket(image, buckets, pad="white"):
+    """
+    Resize an image into its nearest bucket with aspect ratio preserved and pad the rest.
+
+    Args:
+        image: PIL Image in RGB
+        buckets: Iterable of (width, height) buckets
+        pad: "white" to pad with white (sketch canvases) or "edge" to
+            replicate the border pixels (photos)
+
+    Returns:
+        tuple: (bucketed_image, placement), where placement is
+        (left, top, content_width, content_height, original_width, original_height)
+        for restore_from_bucket
+    """
+    bucket_w, bucket_h = nearest_bucket(image.size, buckets)
+    scale = min(bucket_w / image.width, bucket_h / image.height)
+    content_w = min(bucket_w, max(1, round(image.width * scale)))
+    content_h = min(bucket_h, max(1, round(image.height * scale)))
+    left, top = (bucket_w - content_w) // 2, (bucket_h - content_h) // 2
+    placement = (left, top, content_w, content_h, image.width, image.height)
+
+    resized = image if image.size == (content_w, content_h) else image.resize((content_w, content_h), Image.LANCZOS)
+    if (content_w, content_h) == (bucket_w, bucket_h):
+        return resized, placement
+
+    if pad == "edge":
+        pixels = np.pad(
+            np.asarray(resized),
+            ((top, bucket_h - content_h - top), (left, bucket_w - content_w - left), (0, 0)),
+            mode="edge"
+        )
+        return Image.fromarray(pixels), placement
+
+    canvas = Image.new("RGB", (bucket_w, bucket_h), "white")
+    canvas.paste(resized, (left, top))
+    return canvas, placement
+
+
+def restore_from_bucket(image, placement):
+    """
+    Crop a bucket-sized output back to the input's content area and size.
+
+    Args:
+        image: PIL Image at bucket resolution
+        placement: Placement returned by fit_to_bucket
+
+    Returns:
+        PIL Image at the original input size
+    """
+    left, top, content_w, content_h, original_w, original_h = placement
+    cropped = image.crop((left, top, left + content_w, top + content_h))
+    if cropped.size == (original_w, original_h):
+        return cropped
+    return cropped.resize((original_w, original_h), Image.LANCZOS)
@@ -0,0 +1,121 @@
+"""LRU cache of VAE-encoded source images for InstructPix2Pix."""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+import torch
+
+from monitoring.metrics import CACHE_LOOKUPS
+from .result_cache import image_digest
+
+
+def encode_image(pipe, image, device):
+    """
+    Encode a source image the same way the InstructPix2Pix pipeline does.
+
+    Args:
+        pipe: InstructPix2Pix pipeline whose image processor and VAE to use
+        image: PIL Image
+        device: Device to run the VAE on
+
+    Returns:
+        torch.Tensor: Image latents of shape (1, 4, height / 8, width / 8)
+    """
+    pixels = pipe.image_processor.preprocess(image).to(device=device, dtype=pipe.vae.dtype)
+    with torch.no_grad():
+        return pipe.vae.encode(pixels).latent_dist.mode()
+
+
+class ImageLatentCache:
+    """
+    Memory-bounded LRU cache of image latents keyed by (VAE, VAE tiling,
+    image content).
+
+    The pipeline accepts latents in place of the source image and skips its
+    own VAE encode, so repeated transforms of the same picture encode it
+    once. Entries are kept on CPU and moved to the pipeline device on use.
+    """
+
+    def __init__(self, vae_key_fn, max_bytes=64 * 1024**2):
+        """
+        Args:
+            vae_key_fn: Callable mapping a VAE to a stable key
+            max_bytes: Maximum total size of the cached latents
+        """
+        self.vae_key_fn = vae_key_fn
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @staticmethod
+    def _tiling(vae):
+        # Tiled encoding (switched on per request by the memory modes) changes
+        # the latents; slicing only splits batches, so one image encodes the same
+        return bool(getattr(vae, "use_tiling", False))
+
+    def _key(self, vae, image, tiling):
+        vae_key = repr(self.vae_key_fn(vae))
+        return hashlib.sha256(
+            f"{vae_key}\0{vae.dtype}\0{tiling}\0{image_digest(image)}".encode("utf-8")
+        ).hexdigest()
+
+    def get(self, pipe, image, device):
+        """
+        Return the latents of a source image for a pipeline, encoding it on a miss.
+
+        Args:
+            pipe: InstructPix2Pix pipeline
+            image: PIL Image
+            device: Device the latents should live on
+
+        Returns:
+            torch.Tensor: Image latents of shape (1, 4, height / 8, width / 8)
+        """
+        tiling = self._tiling(pipe.vae)
+        key = self._key(pipe.vae, image, tiling)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                CACHE_LOOKUPS.inc(cache="image_latent", result="hit")
+                return cached.to(device)
+            self._misses += 1
+            CACHE_LOOKUPS.inc(cache="image_latent", result="miss")
+
+        latents = encode_image(pipe, image, device)
+        # A concurrent request may have switched tiling during the encode
+        if self._tiling(pipe.vae) == tiling:
+            self._put(key, latents.detach().to("cpu"))
+        return latents
+
+    def _put(self, key, latents):
+        nbytes = latents.element_size() * latents.nelement()
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.element_size() * previous.nelement()
+            self._entries[key] = latents
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.element_size() * evicted.nelement()
+
+    def get_stats(self):
+        """Return hit/miss counters, the current hit rate and memory use."""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
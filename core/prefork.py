@@ -0,0 +1,409 @@
+"""Prefork worker processes sharing the loaded pipelines copy-on-write."""
+
+import itertools
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import traceback
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+import torch
+
+from config.app_config import config
+from .cancellation import CancellationToken, GenerationCancelled
+
+
+class _WorkerCancellation(CancellationToken):
+    """Token of a job inside a worker, cancelled through a slot shared with the parent."""
+
+    def __init__(self, flags, index, seq):
+        super().__init__()
+        self._flags = flags
+        self._index = index
+        self._seq = seq
+        self.reason = "stopped"
+
+    @property
+    def cancelled(self):
+        return self._flags[self._index] == self._seq
+
+    def raise_if_cancelled(self):
+        """Raise GenerationCancelled if the parent cancelled this job."""
+        if self.cancelled:
+            raise GenerationCancelled(self.reason)
+
+
+def _worker_main(index, model_manager, tasks, results, cancel_flags, current_jobs, profile_requests, num_threads):
+    """Serve tasks from the shared queue until the parent sends None."""
+    from .generation import ImageGenerator
+    from .previews import is_preview_step
+
+    # The parent handles Ctrl+C and terminates the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    torch.set_num_threads(num_threads)
+    torch.set_grad_enabled(False)
+
+    # Batching and the result cache live in the parent. Each worker keeps its
+    # own prompt embedding and latent caches, which fill with the requests it
+    # serves; presets are not precomputed, so start-up stays cheap
+    config.SKETCH_BATCHING["enabled"] = False
+    config.RESULT_CACHE["enabled"] = False
+    config.PROMPT_EMBEDDING_CACHE["precompute_presets"] = False
+    image_generator = ImageGenerator(model_manager)
+    warmup = image_generator.warm_up() if config.WARMUP["enabled"] else None
+    results.put(("ready", None, index, warmup))
+
+    reported_profiles = 0
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        seq, operation, request, report_latents = task
+        # Lets the parent fail this job if the worker dies before reporting it
+        current_jobs[index] = seq
+        results.put(("started", seq, index))
+        token = _WorkerCancellation(cancel_flags, index, seq)
+
+        # Claim one of the profiles the parent was asked for
+        with profile_requests.get_lock():
+            profiled = profile_requests.value > 0
+            if profiled:
+                profile_requests.value -= 1
+        if profiled:
+            image_generator.profiler.arm(1)
+
+        def on_step(step, latents):
+            # Latents only cross the process boundary on steps the parent previews
+            payload = None
+            if report_latents and is_preview_step(step, request.num_inference_steps,
+                                                  config.STEP_PREVIEWS["interval"]):
+                payload = latents.detach().float().cpu().numpy()
+            results.put(("step", seq, step, payload))
+
+        try:
+            with image_generator.profiler.capture(operation):
+                if operation == "sketch":
+                    image = image_generator._run_sketch_batch([request], [on_step], [token])[0]
+                else:
+                    image = image_generator._run_transform(request, on_step, token)
+            if isinstance(image, Exception):
+                raise image
+            results.put(("done", seq, image))
+        except GenerationCancelled:
+            results.put(("cancelled", seq))
+        except Exception as e:
+            results.put(("error", seq, f"{type(e).__name__}: {e}"))
+
+        captures = image_generator.profiler.get_captures()
+        for capture in captures[reported_profiles:]:
+            results.put(("profile", seq, capture))
+        reported_profiles = len(captures)
+        current_jobs[index] = 0
+
+
+def _spawner_main(conn, parent_conn, worker_args):
+    """
+    Fork workers when the parent asks for them and report the ones that exit.
+
+    The spawner is forked from the parent before any thread starts and stays
+    single-threaded, so replacement workers forked from it inherit the loaded
+    pipelines without locks held by threads that no longer exist.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Only the parent may hold its end, so the spawner sees EOF once the parent is gone
+    parent_conn.close()
+    workers = {}
+
+    def stop_workers(signum=None, frame=None):
+        for pid in workers.values():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        if signum is not None:
+            os._exit(0)
+
+    # Terminating the spawner (e.g. when the parent exits) takes the workers with it
+    signal.signal(signal.SIGTERM, stop_workers)
+
+    def reap():
+        for index, pid in list(workers.items()):
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                del workers[index]
+                try:
+                    conn.send(("exited", index, os.waitstatus_to_exitcode(status)))
+                except OSError:
+                    pass
+
+    while True:
+        reap()
+        try:
+            if not conn.poll(0.5):
+                continue
+            command, argument = conn.recv()
+        except EOFError:
+            # The parent is gone
+            command, argument = "stop", 0.0
+
+        if command == "spawn":
+            pid = os.fork()
+            if pid == 0:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                conn.close()
+                code = 1
+                try:
+                    _worker_main(argument, *worker_args)
+                    code = 0
+                except BaseException:
+                    traceback.print_exc()
+                finally:
+                    os._exit(code)
+            workers[argument] = pid
+        elif command == "stop":
+            deadline = time.monotonic() + argument
+            while workers and time.monotonic() < deadline:
+                reap()
+                time.sleep(0.05)
+            stop_workers()
+            return
+
+
+class PreforkPool:
+    """
+    Runs pipeline calls on forked worker processes.
+
+    The parent loads the pipelines once and forks `workers` processes that
+    share the weight pages copy-on-write. Jobs go into one task queue that
+    idle workers pull from, so each job runs on whichever worker is free.
+    Step callbacks and cancellation tokens of the caller keep working across
+    the process boundary, and profiling requests are relayed to the workers.
+    Workers are forked by a spawner process created before any thread
+    starts. A worker that dies is replaced by the spawner and its job fails.
+    """
+
+    def __init__(self, model_manager, workers=2, threads_per_worker=None):
+        """
+        Args:
+            model_manager: Loaded ModelManager; prepared for fork here
+            workers: Number of worker processes
+            threads_per_worker: torch intra-op threads per worker (default:
+                CPU count divided by workers)
+        """
+        model_manager.prepare_for_fork()
+        self.model_manager = model_manager
+        self.num_workers = max(1, int(workers))
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // self.num_workers)
+
+        self._context = multiprocessing.get_context("fork")
+        self._tasks = self._context.Queue()
+        self._results = self._context.Queue()
+        # Slot i holds the sequence number of the job worker i should abort
+        self._cancel_flags = self._context.RawArray("q", self.num_workers)
+        # Slot i holds the sequence number of the job worker i has dequeued (0 when idle)
+        self._current_jobs = self._context.RawArray("q", self.num_workers)
+        # Number of upcoming jobs the workers should profile
+        self._profile_requests = self._context.Value("i", 0)
+        self._profiles = []
+        self._seq = itertools.count(1)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stats = {"jobs": 0, "failed": 0, "restarts": 0}
+        self._closed = False
+        self._warmup = {}
+
+        # Every worker, replacements included, is forked by the spawner, which is
+        # forked here while this process is still single-threaded
+        self._spawner_conn, spawner_conn = self._context.Pipe()
+        worker_args = (self.model_manager, self._tasks, self._results, self._cancel_flags,
+                       self._current_jobs, self._profile_requests, self.threads_per_worker)
+        self._spawner = self._context.Process(
+            target=_spawner_main,
+            args=(spawner_conn, self._spawner_conn, worker_args),
+            name="sketchmagic-spawner",
+            daemon=True,
+        )
+        self._spawner.start()
+        spawner_conn.close()
+        self._alive = set()
+        for index in range(self.num_workers):
+            self._spawn(index)
+        self._wait_ready()
+
+        self._collector = threading.Thread(target=self._collect_loop, name="prefork-collector", daemon=True)
+        self._collector.start()
+        print(f"🍴 Forked {self.num_workers} worker(s) with {self.threads_per_worker} thread(s) each.")
+
+    def _spawn(self, index):
+        """Have the spawner fork worker `index`."""
+        with self._lock:
+            self._cancel_flags[index] = 0
+            self._current_jobs[index] = 0
+            self._spawner_conn.send(("spawn", index))
+            self._alive.add(index)
+
+    def _worker_exits(self):
+        """Return (index, exit code) of every worker the spawner saw exit since the last call."""
+        exits = []
+        with self._lock:
+            while self._spawner_conn.poll():
+                _, index, exitcode = self._spawner_conn.recv()
+                self._alive.discard(index)
+                exits.append((index, exitcode))
+        return exits
+
+    def _wait_ready(self):
+        """Block until every worker has finished its start-up (and warm-up)."""
+        waiting = set(range(self.num_workers))
+        while waiting:
+            try:
+                kind, _, index, warmup = self._results.get(timeout=1.0)
+            except queue.Empty:
+                dead = [index for index, _ in self._worker_exits()]
+                if dead or not self._spawner.is_alive():
+                    self.shutdown(timeout=0.0)
+                    raise RuntimeError(f"Prefork worker(s) {dead or sorted(waiting)} exited during start-up.")
+                continue
+            self._warmup[index] = warmup
+            waiting.discard(index)
+
+    def run(self, operation, request, step_callback=None, token=None):
+        """
+        Run one request on a free worker and block until it finishes.
+
+        Args:
+            operation: "sketch" or "manipulation"
+            request: SketchRequest or TransformRequest
+            step_callback: Optional callable taking (step, latents)
+            token: Optional CancellationToken of the caller
+
+        Returns:
+            PIL Image at the request's (bucket) resolution
+
+        Raises:
+            GenerationCancelled: If the token was cancelled
+            RuntimeError: If the worker failed or died
+        """
+        seq = next(self._seq)
+        future = Future()
+        with self._lock:
+            self._pending[seq] = {"future": future, "step_callback": step_callback, "worker": None,
+                                  "cancelled": False}
+            self._stats["jobs"] += 1
+        self._tasks.put((seq, operation, request, step_callback is not None))
+
+        while True:
+            try:
+                return future.result(timeout=0.1)
+            except FutureTimeout:
+                if token is not None and token.cancelled:
+                    self._cancel(seq)
+            except GenerationCancelled:
+                raise GenerationCancelled(token.reason if token is not None else "stopped") from None
+
+    def _cancel(self, seq):
+        with self._lock:
+            entry = self._pending.get(seq)
+            if entry is None or entry["cancelled"]:
+                return
+            entry["cancelled"] = True
+            if entry["worker"] is not None:
+                self._cancel_flags[entry["worker"]] = seq
+
+    def _collect_loop(self):
+        """Route worker messages to the waiting callers and replace dead workers."""
+        last_check = time.monotonic()
+        while True:
+            if time.monotonic() - last_check >= 1.0:
+                self._check_workers()
+                last_check = time.monotonic()
+            try:
+                message = self._results.get(timeout=1.0)
+            except queue.Empty:
+                continue
+
+            kind, seq, *payload = message
+            if kind == "ready":
+                self._warmup[payload[0]] = payload[1]
+                continue
+            if kind == "profile":
+                with self._lock:
+                    self._profiles.append(payload[0])
+                continue
+            with self._lock:
+                entry = self._pending.get(seq)
+                if entry is None:
+                    continue
+                if kind == "started":
+                    entry["worker"] = payload[0]
+                    if entry["cancelled"]:
+                        self._cancel_flags[payload[0]] = seq
+                    continue
+                if kind != "step":
+                    del self._pending[seq]
+
+            if kind == "step":
+                step, latents = payload
+                if entry["step_callback"] is not None:
+                    entry["step_callback"](step, torch.from_numpy(latents) if latents is not None else None)
+            elif kind == "done":
+                entry["future"].set_result(payload[0])
+            elif kind == "cancelled":
+                entry["future"].set_exception(GenerationCancelled("stopped"))
+            else:
+                with self._lock:
+                    self._stats["failed"] += 1
+                entry["future"].set_exception(RuntimeError(payload[0]))
+
+    def _check_workers(self):
+        """Fail the jobs of workers that exited and have the spawner fork replacements."""
+        for index, exitcode in self._worker_exits():
+            if self._closed:
+                continue
+            print(f"⚠️ Worker {index} exited with code {exitcode}; starting a replacement.")
+            with self._lock:
+                # The dequeued job may not have reported "started" before the worker died
+                dequeued = self._current_jobs[index]
+                lost = [seq for seq, entry in self._pending.items() if entry["worker"] == index or seq == dequeued]
+                entries = [self._pending.pop(seq) for seq in lost]
+                self._stats["restarts"] += 1
+                self._stats["failed"] += len(entries)
+            for entry in entries:
+                entry["future"].set_exception(RuntimeError(f"Worker {index} died while running the job."))
+            self._spawn(index)
+
+    def arm_profiler(self, count=1):
+        """Have the workers profile the next `count` jobs between them."""
+        with self._profile_requests.get_lock():
+            self._profile_requests.value = max(0, int(count))
+
+    def get_profiles(self):
+        """Return the operation and output paths of every capture the workers saved."""
+        with self._lock:
+            return list(self._profiles)
+
+    def get_stats(self):
+        """Return worker count, job totals, worker restarts and per-worker warm-up timings."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._pending)
+            stats["warmup"] = dict(self._warmup)
+            stats["workers"] = len(self._alive)
+        return stats
+
+    def shutdown(self, timeout=5.0):
+        """Stop the workers after their current job, terminating them after `timeout` seconds."""
+        self._closed = True
+        for _ in range(self.num_workers):
+            self._tasks.put(None)
+        with self._lock:
+            try:
+                self._spawner_conn.send(("stop", timeout))
+            except OSError:
+                pass
+        self._spawner.join(timeout + 1.0)
+        if self._spawner.is_alive():
+            self._spawner.terminate()
@@ -0,0 +1,161 @@
+"""LRU cache of CLIP text embeddings shared by both pipelines."""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+
+from monitoring.metrics import CACHE_LOOKUPS
+
+
+def encode_text(tokenizer, text_encoder, text, device):
+    """
+    Encode a single prompt the same way the Stable Diffusion pipelines do.
+
+    Args:
+        tokenizer: CLIP tokenizer of the pipeline
+        text_encoder: CLIP text encoder of the pipeline
+        text: Prompt string ("" for the unconditional embedding)
+        device: Device to run the encoder on
+
+    Returns:
+        torch.Tensor: Embeddings of shape (1, max_length, hidden_size)
+    """
+    tokens = tokenizer(
+        text,
+        padding="max_length",
+        max_length=tokenizer.model_max_length,
+        truncation=True,
+        return_tensors="pt",
+    )
+    attention_mask = None
+    if getattr(text_encoder.config, "use_attention_mask", False):
+        attention_mask = tokens.attention_mask.to(device)
+
+    with torch.no_grad():
+        embeds = text_encoder(tokens.input_ids.to(device), attention_mask=attention_mask)[0]
+    return embeds.to(dtype=text_encoder.dtype)
+
+
+class PromptEmbeddingCache:
+    """
+    Bounded LRU cache of prompt embeddings keyed by (text encoder, text).
+
+    Entries are kept on CPU and moved to the pipeline device on use. The
+    encoder key comes from `encoder_key_fn`, so pipelines that share a text
+    encoder also share cache entries. Keys starting with "id" identify an
+    encoder by object identity, which means nothing in another process, so
+    such entries are never persisted.
+    """
+
+    def __init__(self, encoder_key_fn, max_entries=256, persist_path=None):
+        """
+        Args:
+            encoder_key_fn: Callable mapping a text encoder to a stable key
+            max_entries: Maximum number of cached embeddings
+            persist_path: Optional file to load from and save to
+        """
+        self.encoder_key_fn = encoder_key_fn
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self._entries = OrderedDict()
+        # Keys of entries that must not be persisted
+        self._process_local = set()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        if persist_path:
+            self.load()
+
+    def _key(self, text_encoder, text):
+        """Return the entry key and whether it is only valid in this process."""
+        encoder_key = self.encoder_key_fn(text_encoder)
+        process_local = isinstance(encoder_key, tuple) and encoder_key[:1] == ("id",)
+        digest = hashlib.sha256(f"{encoder_key!r}\0{text}".encode("utf-8")).hexdigest()
+        return digest, process_local
+
+    def get(self, pipe, text, device):
+        """
+        Return the embedding of `text` for a pipeline, encoding it on a miss.
+
+        Args:
+            pipe: Pipeline whose tokenizer and text encoder to use
+            text: Prompt string
+            device: Device the embedding should live on
+
+        Returns:
+            torch.Tensor: Embeddings of shape (1, max_length, hidden_size)
+        """
+        key, process_local = self._key(pipe.text_encoder, text)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                CACHE_LOOKUPS.inc(cache="prompt_embedding", result="hit")
+                return cached.to(device)
+            self._misses += 1
+            CACHE_LOOKUPS.inc(cache="prompt_embedding", result="miss")
+
+        embeds = encode_text(pipe.tokenizer, pipe.text_encoder, text, device)
+        self._put(key, embeds.detach().to("cpu"), process_local)
+        return embeds
+
+    def get_batch(self, pipe, texts, device):
+        """Return embeddings for several prompts concatenated along the batch axis."""
+        return torch.cat([self.get(pipe, text, device) for text in texts], dim=0)
+
+    def _put(self, key, embeds, process_local=False):
+        with self._lock:
+            self._entries[key] = embeds
+            self._entries.move_to_end(key)
+            if process_local:
+                self._process_local.add(key)
+            else:
+                self._process_local.discard(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._process_local.discard(evicted)
+
+    def warm(self, pipe, texts, device):
+        """Precompute embeddings for a list of prompts (e.g. the quick-prompt presets)."""
+        for text in texts:
+            self.get(pipe, text, device)
+
+    def load(self):
+        """Load persisted embeddings from disk, if the file exists."""
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        try:
+            entries = torch.load(self.persist_path, map_location="cpu", weights_only=True)
+        except Exception as e:
+            print(f"⚠️ Could not load prompt embedding cache from {self.persist_path}: {e}")
+            return
+        for key, embeds in entries.items():
+            self._put(key, embeds)
+        print(f"📦 Loaded {len(entries)} cached prompt embeddings from {self.persist_path}.")
+
+    def save(self):
+        """Persist the current embeddings to disk, except those keyed by encoder identity."""
+        if not self.persist_path:
+            return
+        with self._lock:
+            entries = {key: embeds for key, embeds in self._entries.items() if key not in self._process_local}
+        directory = os.path.dirname(self.persist_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        torch.save(entries, self.persist_path)
+
+    def get_stats(self):
+        """Return hit/miss counters and the current hit rate."""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+            }
@@ -0,0 +1,176 @@
+"""Content-addressed cache of generated images for seeded requests."""
+
+import hashlib
+import io
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from monitoring.metrics import CACHE_LOOKUPS
+
+
+def image_digest(image):
+    """Hash an image's mode, size and raw pixel bytes."""
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size}".encode("utf-8"))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier LRU cache of generated images keyed by a hash of every input.
+
+    The memory tier keeps decoded PIL images up to `memory_bytes`. The
+    optional disk tier stores lossless PNGs in `disk_dir` up to `disk_bytes`,
+    evicting the least recently used files first. Only deterministic
+    (seeded) requests should be cached.
+    """
+
+    def __init__(self, memory_bytes=256 * 1024**2, disk_dir=None, disk_bytes=2 * 1024**3):
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._disk_used = 0
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_used = sum(size for _, size, _ in self._disk_entries())
+
+    @staticmethod
+    def make_key(operation, image, params, model_signature):
+        """
+        Build the cache key for a request.
+
+        Args:
+            operation: "sketch" or "transform"
+            image: Input PIL image (sketch or source image)
+            params: Dict of prompts, hyperparameters and seed
+            model_signature: Identifies the models, scheduler, device and dtype
+
+        Returns:
+            str: Hex digest uniquely identifying the request
+        """
+        payload = json.dumps({
+            "operation": operation,
+            "image": image_digest(image),
+            "params": params,
+            "models": model_signature,
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _image_nbytes(image):
+        return image.width * image.height * len(image.getbands())
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.png")
+
+    def _disk_entries(self):
+        """Return (path, size, mtime) for every PNG in the disk tier."""
+        entries = []
+        for filename in os.listdir(self.disk_dir):
+            if filename.endswith(".png"):
+                path = os.path.join(self.disk_dir, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def get(self, key):
+        """Return a copy of the cached image for a key, or None on a miss."""
+        with self._lock:
+            image = self._memory.get(key)
+            if image is not None:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                CACHE_LOOKUPS.inc(cache="result", result="hit")
+                return image.copy()
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                with Image.open(path) as cached:
+                    image = cached.copy()
+                os.utime(path)
+            except (FileNotFoundError, OSError):
+                image = None
+            if image is not None:
+                with self._lock:
+                    self._stats["disk_hits"] += 1
+                CACHE_LOOKUPS.inc(cache="result", result="hit")
+                self._put_memory(key, image)
+                return image.copy()
+
+        with self._lock:
+            self._stats["misses"] += 1
+        CACHE_LOOKUPS.inc(cache="result", result="miss")
+        return None
+
+    def put(self, key, image):
+        """Store a generated image in both tiers."""
+        self._put_memory(key, image.copy())
+        if self.disk_dir:
+            self._put_disk(key, image)
+
+    def _put_memory(self, key, image):
+        size = self._image_nbytes(image)
+        if size > self.memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_used -= self._image_nbytes(self._memory.pop(key))
+            self._memory[key] = image
+            self._memory_used += size
+            while self._memory_used > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_used -= self._image_nbytes(evicted)
+
+    def _put_disk(self, key, image):
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        data = buffer.getvalue()
+
+        path = self._disk_path(key)
+        replaced = os.path.getsize(path) if os.path.exists(path) else 0
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._disk_used += len(data) - replaced
+            if self._disk_used <= self.disk_bytes:
+                return
+            # Evict least recently used files (oldest mtime) until under budget
+            for old_path, size, _ in sorted(self._disk_entries(), key=lambda entry: entry[2]):
+                if self._disk_used <= self.disk_bytes:
+                    break
+                if old_path == path:
+                    continue
+                try:
+                    os.remove(old_path)
+                    self._disk_used -= size
+                except FileNotFoundError:
+                    pass
+
+    def get_stats(self):
+        """Return hit/miss counters, the hit rate and tier usage."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["memory_bytes"] = self._memory_used
+            stats["disk_bytes"] = self._disk_used
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        return stats
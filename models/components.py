@@ -0,0 +1,294 @@
+"""Component-level loading and sharing between diffusion pipelines."""
+
+import hashlib
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from diffusers import AutoencoderKL
+from transformers import CLIPTextModel, CLIPTokenizer
+from huggingface_hub import hf_hub_download, try_to_load_from_cache, get_hf_file_metadata, hf_hub_url
+from huggingface_hub.utils import EntryNotFoundError
+
+
+DIFFUSERS_WEIGHTS = ["diffusion_pytorch_model.safetensors", "diffusion_pytorch_model.bin"]
+TRANSFORMERS_WEIGHTS = ["model.safetensors", "pytorch_model.bin"]
+
+
+# Components that are identical across the SD-1.5 family checkpoints we use,
+# with the files whose contents define them.
+SHAREABLE_COMPONENTS = {
+    "vae": {
+        "cls": AutoencoderKL,
+        "files": ["config.json"],
+        "weights": DIFFUSERS_WEIGHTS,
+    },
+    "text_encoder": {
+        "cls": CLIPTextModel,
+        "files": ["config.json"],
+        "weights": TRANSFORMERS_WEIGHTS,
+    },
+    "tokenizer": {
+        "cls": CLIPTokenizer,
+        "files": ["vocab.json", "merges.txt", "special_tokens_map.json", "tokenizer_config.json"],
+        "weights": [],
+    },
+}
+
+
+# from_pretrained builds modules under accelerate's init_empty_weights and
+# transformers' no_init_weights, which swap process-wide functions
+# (nn.Module.register_parameter, torch.nn.init.*) in and out. Overlapping
+# calls can leave the patched functions installed, so every module
+# construction holds this lock; only file reads run in parallel.
+MODULE_CONSTRUCTION_LOCK = threading.RLock()
+
+
+def _sha256_file(path, chunk_size=1 << 20):
+    """Hash a local file in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _file_digest(model_id, subfolder, filename):
+    """
+    Return a content hash for one checkpoint file.
+
+    Local directories are hashed directly. For Hub repositories the cached
+    blob name (which is the file's content hash) is used when available,
+    otherwise the ETag from the Hub metadata.
+
+    Returns:
+        str or None: The digest, or None if the file does not exist
+
+    Raises:
+        RuntimeError: If the file exists but its hash cannot be determined
+    """
+    if os.path.isdir(model_id):
+        path = os.path.join(model_id, subfolder, filename)
+        return _sha256_file(path) if os.path.isfile(path) else None
+
+    cached = try_to_load_from_cache(model_id, filename, subfolder=subfolder)
+    if isinstance(cached, str):
+        blob_path = os.path.realpath(cached)
+        if os.path.basename(os.path.dirname(blob_path)) == "blobs":
+            return os.path.basename(blob_path)
+        return _sha256_file(blob_path)
+
+    try:
+        metadata = get_hf_file_metadata(hf_hub_url(model_id, filename, subfolder=subfolder))
+    except EntryNotFoundError:
+        return None
+    except Exception as e:
+        raise RuntimeError(f"Could not fetch metadata for {model_id}/{subfolder}/{filename}: {e}")
+
+    if not metadata.etag:
+        raise RuntimeError(f"No content hash available for {model_id}/{subfolder}/{filename}")
+    return metadata.etag
+
+
+def _local_file(model_id, subfolder, filename):
+    """Return the local path of a checkpoint file, downloading it if needed, or None if it does not exist."""
+    if os.path.isdir(model_id):
+        path = os.path.join(model_id, subfolder or "", filename)
+        return path if os.path.isfile(path) else None
+    try:
+        return hf_hub_download(model_id, filename, subfolder=subfolder)
+    except EntryNotFoundError:
+        return None
+
+
+def prefetch_checkpoint(model_id, subfolder, files=(), weights=(), chunk_size=16 << 20):
+    """
+    Download (if needed) and read a component's checkpoint files.
+
+    Reading the files pulls them into the OS page cache, so the serialized
+    from_pretrained call that follows finds them in memory. Only the first
+    existing weights file is read, matching the order from_pretrained uses.
+
+    Returns:
+        int: Bytes read
+    """
+    paths = [_local_file(model_id, subfolder, name) for name in files]
+    for name in weights:
+        path = _local_file(model_id, subfolder, name)
+        if path is not None:
+            paths.append(path)
+            break
+
+    total = 0
+    for path in paths:
+        if path is None:
+            continue
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                total += len(chunk)
+    return total
+
+
+def weights_digest(model_id, subfolder):
+    """
+    Content hash of a model's weights file, whichever format the checkpoint uses.
+
+    Returns:
+        str or None: The digest, or None if no weights file exists
+    """
+    for filename in ("diffusion_pytorch_model.safetensors", "diffusion_pytorch_model.bin",
+                     "model.safetensors", "pytorch_model.bin"):
+        digest = _file_digest(model_id, subfolder, filename)
+        if digest is not None:
+            return digest
+    return None
+
+
+def fingerprint_component(model_id, component):
+    """
+    Compute a content fingerprint for a pipeline component.
+
+    Two checkpoints with equal fingerprints have byte-identical config and
+    weight files for that component, so a single loaded instance can serve both.
+
+    Args:
+        model_id: Hub repository id or local directory of the pipeline
+        component: Name of the component subfolder (e.g. "vae")
+
+    Returns:
+        tuple or None: The fingerprint, or None if it could not be determined
+    """
+    spec = SHAREABLE_COMPONENTS[component]
+    try:
+        digests = [(name, _file_digest(model_id, component, name)) for name in spec["files"]]
+        for name in spec["weights"]:
+            digest = _file_digest(model_id, component, name)
+            if digest is not None:
+                digests.append((name, digest))
+                break
+        else:
+            if spec["weights"]:
+                return None
+    except Exception as e:
+        print(f"⚠️ Could not fingerprint {component} of {model_id}: {e}")
+        return None
+
+    return tuple(digests)
+
+
+class ComponentRegistry:
+    """
+    Loads shareable pipeline components and deduplicates identical ones.
+
+    Instances are held weakly, so a component is freed as soon as no
+    pipeline references it anymore.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._components = weakref.WeakValueDictionary()
+        self._instance_keys = weakref.WeakKeyDictionary()
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def load(self, model_id, component, dtype):
+        """
+        Load a component, reusing an existing instance with identical weights.
+
+        Args:
+            model_id: Hub repository id or local directory of the pipeline
+            component: Name of the component (one of SHAREABLE_COMPONENTS)
+            dtype: torch dtype for model weights
+
+        Returns:
+            The loaded component instance
+        """
+        fingerprint = fingerprint_component(model_id, component) if self.enabled else None
+        key = (component, fingerprint or model_id, str(dtype))
+
+        with self._key_lock(key):
+            instance = self._components.get(key)
+            if instance is not None:
+                print(f"♻️ Reusing shared {component} for {model_id} (identical weights).")
+                return instance
+
+            spec = SHAREABLE_COMPONENTS[component]
+            kwargs = {"subfolder": component}
+            if spec["weights"]:
+                kwargs["torch_dtype"] = dtype
+            print(f"Loading {component}: {model_id}")
+            with MODULE_CONSTRUCTION_LOCK:
+                instance = spec["cls"].from_pretrained(model_id, **kwargs)
+            self._components[key] = instance
+            self._instance_keys[instance] = key
+            return instance
+
+    def prefetch(self, model_id, component):
+        """Read a shareable component's checkpoint files ahead of load()."""
+        spec = SHAREABLE_COMPONENTS[component]
+        return prefetch_checkpoint(model_id, component, spec["files"], spec["weights"])
+
+    def key_of(self, instance):
+        """Return the stable registry key of a loaded component, or None if unknown."""
+        return self._instance_keys.get(instance)
+
+
+def load_components_parallel(tasks, max_workers=None):
+    """
+    Read component files concurrently, then build the components one at a time.
+
+    Downloading and reading the checkpoint files is most of the load time
+    and releases the GIL, so the prefetch callables run on a thread pool.
+    The build callables then run serially on the calling thread under
+    MODULE_CONSTRUCTION_LOCK, reading the files back from the page cache.
+
+    Args:
+        tasks: Mapping of key -> (prefetch, build), two zero-argument
+            callables; build returns the component
+        max_workers: Thread pool size for the prefetches (1 reads serially)
+
+    Returns:
+        tuple: (components, errors, timings), each keyed like tasks; timings
+        are (read seconds, build seconds)
+    """
+    components, errors, timings = {}, {}, {}
+    if not tasks:
+        return components, errors, timings
+
+    def timed(task):
+        start = time.perf_counter()
+        task()
+        return time.perf_counter() - start
+
+    read_seconds = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers or len(tasks))) as pool:
+        futures = {pool.submit(timed, prefetch): key for key, (prefetch, _) in tasks.items()}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                read_seconds[key] = future.result()
+            except Exception as e:
+                errors[key] = e
+
+    for key, (_, build) in tasks.items():
+        if key in errors:
+            continue
+        start = time.perf_counter()
+        try:
+            with MODULE_CONSTRUCTION_LOCK:
+                components[key] = build()
+        except Exception as e:
+            errors[key] = e
+            continue
+        timings[key] = (read_seconds[key], time.perf_counter() - start)
+
+    return components, errors, timings
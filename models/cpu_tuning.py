@@ -0,0 +1,128 @@
+"""CPU execution tuning: thread counts, bfloat16 autocast and channels-last."""
+
+import os
+import time
+from contextlib import nullcontext
+
+import torch
+
+
+# Modules that run every denoising step; the text encoder and VAE stay in float32
+DENOISING_MODULES = ("unet", "controlnet")
+
+
+def bf16_supported():
+    """Whether the CPU has native bfloat16 kernels (AVX512-BF16 / AMX)."""
+    check = getattr(torch.ops.mkldnn, "_is_mkldnn_bf16_supported", None)
+    try:
+        return bool(check()) if check is not None else False
+    except RuntimeError:
+        return False
+
+
+def apply_thread_settings(num_threads=None, interop_threads=None):
+    """
+    Set torch's intra-op and inter-op thread pools.
+
+    Inter-op threads can only be set before the first parallel region runs,
+    so a late call is reported and ignored.
+    """
+    if num_threads:
+        torch.set_num_threads(int(num_threads))
+    if interop_threads:
+        try:
+            torch.set_interop_threads(int(interop_threads))
+        except RuntimeError as e:
+            print(f"⚠️ Could not set inter-op threads: {e}")
+    print(f"🧵 CPU threads: {torch.get_num_threads()} intra-op, {torch.get_num_interop_threads()} inter-op.")
+
+
+def autocast_context(device, bf16=False):
+    """
+    Return the autocast context for a pipeline call.
+
+    CUDA keeps torch's default float16 autocast. On CPU, autocast is only
+    used for the opt-in bfloat16 path; otherwise the call runs in float32.
+    """
+    if device == "cuda":
+        return torch.autocast("cuda")
+    if bf16:
+        return torch.autocast("cpu", dtype=torch.bfloat16)
+    return nullcontext()
+
+
+def apply_cpu_execution(pipe, bf16=False, channels_last=False):
+    """Convert a pipeline's denoising modules to bfloat16 and/or channels-last in place."""
+    for attr in DENOISING_MODULES:
+        module = getattr(pipe, attr, None)
+        if module is None:
+            continue
+        if bf16:
+            module.to(torch.bfloat16)
+        module.to(memory_format=torch.channels_last if channels_last else torch.contiguous_format)
+    if channels_last and getattr(pipe, "vae", None) is not None:
+        pipe.vae.to(memory_format=torch.channels_last)
+
+
+def _thread_candidates(configured):
+    if configured:
+        return [int(configured)]
+    logical = os.cpu_count() or 1
+    # Hyper-threads rarely help dense matmuls, so try the physical core count too
+    return sorted({logical, max(1, logical // 2)}, reverse=True)
+
+
+def autotune(unet, num_threads=None, allow_bf16=True, latent_size=32, repeats=2):
+    """
+    Time a UNet forward pass on a tiny input for each execution setting.
+
+    bfloat16 is measured with autocast over the float32 weights, so the
+    conversion happens only once the winner is known; this slightly
+    overstates its cost.
+
+    Args:
+        unet: The UNet to time
+        num_threads: Fixed intra-op thread count, or None to try candidates
+        allow_bf16: Whether to include the bfloat16 path
+        latent_size: Side of the square latent input
+        repeats: Timed forward passes per setting
+
+    Returns:
+        tuple: (best_settings, all_results), where each entry is a dict with
+        num_threads, bf16, channels_last and seconds
+    """
+    cross_attention_dim = unet.config.cross_attention_dim
+    if not isinstance(cross_attention_dim, int):
+        cross_attention_dim = cross_attention_dim[0]
+    sample = torch.randn(1, unet.config.in_channels, latent_size, latent_size)
+    encoder_hidden_states = torch.randn(1, 77, cross_attention_dim)
+    timestep = torch.tensor([500])
+
+    original_threads = torch.get_num_threads()
+    results = []
+    try:
+        for threads in _thread_candidates(num_threads):
+            torch.set_num_threads(threads)
+            for channels_last in (False, True):
+                memory_format = torch.channels_last if channels_last else torch.contiguous_format
+                unet.to(memory_format=memory_format)
+                for bf16 in ((False, True) if allow_bf16 else (False,)):
+                    with torch.inference_mode(), autocast_context("cpu", bf16):
+                        unet(sample, timestep, encoder_hidden_states)  # warm-up
+                        start = time.perf_counter()
+                        for _ in range(repeats):
+                            unet(sample, timestep, encoder_hidden_states)
+                    results.append({
+                        "num_threads": threads,
+                        "bf16": bf16,
+                        "channels_last": channels_last,
+                        "seconds": (time.perf_counter() - start) / repeats,
+                    })
+    finally:
+        unet.to(memory_format=torch.contiguous_format)
+        torch.set_num_threads(original_threads)
+
+    for result in sorted(results, key=lambda r: r["seconds"]):
+        print(f"⏱️ autotune threads={result['num_threads']} bf16={result['bf16']} "
+              f"channels_last={result['channels_last']}: {1000 * result['seconds']:.1f} ms")
+    return min(results, key=lambda r: r["seconds"]), results
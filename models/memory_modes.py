@@ -0,0 +1,185 @@
+"""Per-request selection of attention slicing, VAE slicing and tiled VAE decode."""
+
+import threading
+import weakref
+from collections import Counter
+from contextlib import contextmanager
+
+from monitoring.metrics import MEMORY_MODE_TOGGLES
+
+
+# Cheapest latency cost first
+MEMORY_MODES = ("vae_slicing", "attention_slicing", "vae_tiling")
+
+# Rough SD-1.5 activation model: UNet feature maps at 1/8 resolution with 320
+# base channels, VAE decoder feature maps at full resolution with 128 channels.
+# The factors cover the intermediate tensors alive at the peak.
+UNET_BASE_CHANNELS = 320
+UNET_FEATURE_FACTOR = 24
+UNET_ATTENTION_HEADS = 8
+VAE_BASE_CHANNELS = 128
+VAE_FEATURE_FACTOR = 6
+VAE_TILE_SIZE = 512
+
+
+def estimate_activation_bytes(width, height, batch_size, dtype_bytes, guidance_copies=2,
+                              memory_efficient_attention=False, modes=()):
+    """
+    Estimate the peak activation memory of one pipeline call.
+
+    Args:
+        width: Output width in pixels
+        height: Output height in pixels
+        batch_size: Images per call
+        dtype_bytes: Bytes per activation element
+        guidance_copies: UNet batch multiplier from classifier-free guidance
+            (2 for text guidance, 3 for InstructPix2Pix text + image guidance)
+        memory_efficient_attention: Whether attention never materializes the
+            full score matrix (xformers)
+        modes: Enabled memory modes
+
+    Returns:
+        int: Estimated peak bytes, the larger of the UNet and VAE decode phases
+    """
+    tokens = (width // 8) * (height // 8)
+    unet_batch = batch_size * guidance_copies
+    attention = 0 if memory_efficient_attention else unet_batch * UNET_ATTENTION_HEADS * tokens**2 * dtype_bytes
+    if "attention_slicing" in modes:
+        attention //= UNET_ATTENTION_HEADS
+    unet_peak = attention + unet_batch * UNET_BASE_CHANNELS * tokens * dtype_bytes * UNET_FEATURE_FACTOR
+
+    vae_batch = 1 if "vae_slicing" in modes else batch_size
+    if "vae_tiling" in modes:
+        width, height = min(width, VAE_TILE_SIZE), min(height, VAE_TILE_SIZE)
+    vae_tokens = (width // 8) * (height // 8)
+    vae_peak = vae_batch * (
+        VAE_BASE_CHANNELS * width * height * dtype_bytes * VAE_FEATURE_FACTOR + vae_tokens**2 * dtype_bytes
+    )
+    return max(unet_peak, vae_peak)
+
+
+def select_modes(budget_bytes, **workload):
+    """Enable memory modes, cheapest first, until the estimate fits the budget."""
+    modes = set()
+    estimate = estimate_activation_bytes(**workload, modes=modes)
+    for mode in MEMORY_MODES:
+        if estimate <= budget_bytes:
+            break
+        reduced = estimate_activation_bytes(**workload, modes=modes | {mode})
+        # Skip modes that do not help this workload (e.g. VAE slicing at batch size 1)
+        if reduced < estimate:
+            modes.add(mode)
+            estimate = reduced
+    return modes, estimate
+
+
+class MemoryModeController:
+    """
+    Applies the memory modes each request needs to its pipeline.
+
+    Modes live on shared modules, so a mode required by a running request is
+    never turned off under it: a new request gets its own modes plus those
+    of every request still running. Modes are only relaxed once the
+    pipelines are idle.
+
+    Tiled VAE decode changes the output pixels, so a request that ran with
+    a different tiling than it needs on its own (because of concurrent
+    requests) must not be reused as the result of the request alone. Callers
+    can pass a set to `apply` that collects every tiling state seen while
+    the block ran.
+    """
+
+    def __init__(self, budget_bytes=None):
+        self.budget_bytes = budget_bytes
+        self._active_modes = Counter()
+        self._attention_sliced = weakref.WeakSet()
+        self._tiling_watchers = []
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.budget_bytes is not None
+
+    def required_modes(self, width, height, batch_size, dtype_bytes, guidance_copies,
+                       memory_efficient_attention=False):
+        """Return the memory modes a workload needs on its own (empty without a budget)."""
+        if not self.enabled:
+            return set()
+        modes, _ = select_modes(
+            self.budget_bytes, width=width, height=height, batch_size=batch_size,
+            dtype_bytes=dtype_bytes, guidance_copies=guidance_copies,
+            memory_efficient_attention=memory_efficient_attention,
+        )
+        return modes
+
+    @contextmanager
+    def apply(self, name, pipe, width, height, batch_size, dtype_bytes, guidance_copies,
+              memory_efficient_attention=False, tiling_seen=None):
+        """
+        Hold the memory modes a workload needs on a pipeline for the duration of the block.
+
+        Args:
+            tiling_seen: Optional set that receives every VAE tiling state
+                (True or False) the pipeline had while the block ran
+        """
+        if not self.enabled:
+            if tiling_seen is not None:
+                tiling_seen.add(bool(getattr(pipe.vae, "use_tiling", False)))
+            yield
+            return
+
+        required, estimate = select_modes(
+            self.budget_bytes, width=width, height=height, batch_size=batch_size,
+            dtype_bytes=dtype_bytes, guidance_copies=guidance_copies,
+            memory_efficient_attention=memory_efficient_attention,
+        )
+        watcher = tiling_seen if tiling_seen is not None else set()
+        with self._lock:
+            target = required | {mode for mode, count in self._active_modes.items() if count > 0}
+            reason = (f"{width}x{height} x{batch_size}, estimated {estimate / 1024**3:.2f} GB "
+                      f"vs budget {self.budget_bytes / 1024**3:.2f} GB")
+            self._set_modes(name, pipe, target, reason)
+            self._active_modes.update(required)
+            watcher.add("vae_tiling" in target)
+            self._tiling_watchers.append(watcher)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active_modes.subtract(required)
+                self._tiling_watchers.remove(watcher)
+
+    def _set_modes(self, name, pipe, target, reason):
+        current = {
+            "attention_slicing": pipe.unet in self._attention_sliced,
+            "vae_slicing": bool(getattr(pipe.vae, "use_slicing", False)),
+            "vae_tiling": bool(getattr(pipe.vae, "use_tiling", False)),
+        }
+        for mode in MEMORY_MODES:
+            wanted = mode in target
+            if current[mode] == wanted:
+                continue
+
+            if mode == "attention_slicing":
+                if wanted:
+                    pipe.enable_attention_slicing(1)
+                    self._attention_sliced.add(pipe.unet)
+                else:
+                    pipe.disable_attention_slicing()
+                    self._attention_sliced.discard(pipe.unet)
+            elif mode == "vae_slicing":
+                if wanted:
+                    pipe.vae.enable_slicing()
+                else:
+                    pipe.vae.disable_slicing()
+            else:
+                if wanted:
+                    pipe.vae.enable_tiling()
+                else:
+                    pipe.vae.disable_tiling()
+                for watcher in self._tiling_watchers:
+                    watcher.add(wanted)
+
+            state = "on" if wanted else "off"
+            MEMORY_MODE_TOGGLES.inc(pipeline=name, mode=mode, state=state)
+            print(f"🧮 {name}: {mode.replace('_', ' ')} {state} ({reason}).")
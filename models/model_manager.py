@@ -2,169 +2,679 @@
 
 import torch
 import gc
-from diffusers import StableDiffusionControlNetPipeline, ControlNetModel, UniPCMultistepScheduler
-from diffusers import StableDiffusionInstructPix2PixPipeline
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from diffusers import StableDiffusionControlNetPipeline, ControlNetModel
+from diffusers import StableDiffusionInstructPix2PixPipeline, UNet2DConditionModel
+from diffusers.pipelines.stable_diffusion.safety_checker import StableDiffusionSafetyChecker
 
 from config.app_config import config
+from monitoring.metrics import FALLBACK_EVENTS, MODEL_LOAD_SECONDS, OOM_EVENTS
+from .cpu_tuning import apply_cpu_execution, apply_thread_settings, autocast_context, autotune, bf16_supported
+from .components import (
+    ComponentRegistry, DIFFUSERS_WEIGHTS, MODULE_CONSTRUCTION_LOCK, SHAREABLE_COMPONENTS, TRANSFORMERS_WEIGHTS,
+    load_components_parallel, prefetch_checkpoint,
+)
+from .memory_modes import MemoryModeController
+from .quantization import quantize_module
+from .onnx_backend import OnnxSketchPipeline, prepare_sketch_sessions
+from .residency import ResidencyManager
+from .schedulers import SchedulerCache
 
 
 class ModelManager:
     """Singleton class for managing AI models."""
-    
+
+    PIPELINE_NAMES = ("sketch", "manipulation")
+    _PIPELINE_ATTRS = {
+        "sketch": "_pipe_sketch",
+        "manipulation": "_pipe_manipulate",
+    }
+
     _instance = None
+    _instance_lock = threading.Lock()
     _pipe_sketch = None
     _pipe_manipulate = None
-    _initial_load_error = None
 
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super(ModelManager, cls).__new__(cls)
-            cls._instance._load_models_internal()
+            with cls._instance_lock:
+                if cls._instance is None:
+                    instance = super(ModelManager, cls).__new__(cls)
+                    instance._init_state()
+                    instance._load_models_internal()
+                    cls._instance = instance
         return cls._instance
 
+    def _init_state(self):
+        """Initialize per-instance loading state."""
+        self._device = config.DEVICE
+        self._dtype = config.DTYPE
+        self._load_errors = {}
+        # Pipelines whose setup has finished; only these are handed out
+        self._ready = set()
+        self._load_locks = {name: threading.Lock() for name in self.PIPELINE_NAMES}
+        self._device_lock = threading.RLock()
+        self._components = ComponentRegistry(enabled=config.SHARE_PIPELINE_COMPONENTS)
+        self._load_timings = {}
+        self._schedulers = SchedulerCache()
+        # Idle scheduler views per (pipeline, scheduler), the scheduler each
+        # loaded pipeline runs itself, and the loaded pipelines held by a call
+        self._scheduler_views = {}
+        self._loaded_schedulers = {}
+        self._pipes_in_use = set()
+        self._views_lock = threading.Lock()
+        self._cpu_profile = {
+            "num_threads": config.CPU_EXECUTION["num_threads"],
+            "bf16": config.CPU_EXECUTION["bf16"],
+            "channels_last": config.CPU_EXECUTION["channels_last"],
+        }
+        self._autotune_results = None
+        self._onnx_sessions = None
+        self._quantized_modules = weakref.WeakSet()
+        self._xformers_enabled = False
+        budget_gb = config.ACTIVATION_MEMORY_BUDGET_GB
+        self._memory_modes = MemoryModeController(int(budget_gb * 1024**3) if budget_gb is not None else None)
+        budget_gb = config.RESIDENCY_MEMORY_BUDGET_GB
+        self._residency = ResidencyManager(
+            budget_bytes=int(budget_gb * 1024**3) if budget_gb is not None else None,
+            policy=config.RESIDENCY_EVICTION_POLICY,
+            device=self._device,
+            drop_callback=lambda name: self._cleanup_models([name]),
+        )
+
     def _load_models_internal(self):
-        """Internal method to load and cache the models."""
-        if self._pipe_sketch is not None and self._pipe_manipulate is not None:
-            print("✅ Models already loaded.")
+        """Resolve the target device and load every pipeline configured as eager."""
+        try:
+            self._resolve_device_and_dtype()
+        except Exception as e:
+            self._handle_loading_error(e, self._device)
             return
 
-        print(f"🚀 Attempting to load AI models to {config.DEVICE} with {config.DTYPE} precision...")
+        eager = [name for name in self.PIPELINE_NAMES if self._load_mode(name) == "eager"]
+        lazy = [name for name in self.PIPELINE_NAMES if name not in eager]
+        if lazy:
+            print(f"💤 Deferring {', '.join(lazy)} pipeline(s) until first use.")
+
+        if eager:
+            self._ensure_pipelines(eager)
+
+    def _resolve_device_and_dtype(self):
+        """Pick the device and dtype the pipelines will be loaded with."""
+        print(f"🚀 Preparing to load AI models to {config.DEVICE} with {config.DTYPE} precision...")
 
         current_device_candidate = config.DEVICE
         current_dtype_candidate = config.DTYPE
-        temp_error_message = None
 
-        try:
-            if current_device_candidate == "cuda":
-                total_memory_bytes = torch.cuda.get_device_properties(0).total_memory
-                total_memory_gb = total_memory_bytes / (1024**3)
-                print(f"CUDA device has {total_memory_gb:.2f} GB VRAM.")
-
-                if total_memory_gb < 6:
-                    temp_error_message = f"❌ Insufficient VRAM detected ({total_memory_gb:.2f} GB). At least 6-8 GB recommended for these models on GPU. Attempting to switch to CPU, which will be very slow."
-                    print(temp_error_message)
-                    current_device_candidate = "cpu"
-                    current_dtype_candidate = torch.float32
-                elif total_memory_gb < 10 and current_dtype_candidate == torch.float32:
-                    print("⚠️ Warning: Less than 10GB VRAM detected. Consider using float16 for better memory efficiency (if not already) and ensure `xformers` is installed for optimal performance.")
-
-            if current_device_candidate == "cpu":
-                print("Running on CPU. Model loading and inference will be significantly slower.")
+        if current_device_candidate == "cuda":
+            total_memory_bytes = torch.cuda.get_device_properties(0).total_memory
+            total_memory_gb = total_memory_bytes / (1024**3)
+            print(f"CUDA device has {total_memory_gb:.2f} GB VRAM.")
+
+            if total_memory_gb < 6:
+                print(f"❌ Insufficient VRAM detected ({total_memory_gb:.2f} GB). At least 6-8 GB recommended for these models on GPU. Attempting to switch to CPU, which will be very slow.")
+                current_device_candidate = "cpu"
                 current_dtype_candidate = torch.float32
+            elif total_memory_gb < 10 and current_dtype_candidate == torch.float32:
+                print("⚠️ Warning: Less than 10GB VRAM detected. Consider using float16 for better memory efficiency (if not already) and ensure `xformers` is installed for optimal performance.")
+
+        if current_device_candidate == "cpu":
+            print("Running on CPU. Model loading and inference will be significantly slower.")
+            current_dtype_candidate = torch.float32
+
+        self._device = current_device_candidate
+        self._dtype = current_dtype_candidate
+        self._residency.device = current_device_candidate
+
+        if current_device_candidate == "cpu":
+            self._configure_cpu_execution()
+
+    def _configure_cpu_execution(self):
+        """Apply the configured CPU thread counts and validate the bfloat16 setting."""
+        apply_thread_settings(config.CPU_EXECUTION["num_threads"], config.CPU_EXECUTION["interop_threads"])
+        if self._cpu_profile["bf16"] and config.INT8_QUANTIZATION["enabled"]:
+            print("⚠️ bfloat16 is not combined with int8 quantization; running the remaining float layers in float32.")
+            self._cpu_profile["bf16"] = False
+        if self._cpu_profile["bf16"] and not bf16_supported():
+            print("⚠️ bfloat16 requested but this CPU has no native bfloat16 kernels; expect it to be slow.")
+
+    def _load_mode(self, name):
+        """Return the configured load mode ("eager" or "lazy") for a pipeline."""
+        mode = config.PIPELINE_LOAD_MODES.get(name, "eager")
+        if mode not in ("eager", "lazy"):
+            print(f"⚠️ Unknown load mode '{mode}' for {name} pipeline, falling back to eager.")
+            return "eager"
+        return mode
+
+    def _get_loaded(self, name):
+        """Return the pipeline if it is already loaded, without triggering a load."""
+        return getattr(self, self._PIPELINE_ATTRS[name])
+
+    def _ensure_pipeline(self, name):
+        """
+        Return the named pipeline, loading it on first use.
+
+        Uses double-checked locking so concurrent first requests wait for a
+        single load instead of each loading their own copy. The lock-free
+        fast path only trusts the ready flag, which is set after device
+        placement, quantization and the other optimizations have finished,
+        so a half-configured pipeline is never returned.
+        """
+        if name not in self._ready and name not in self._load_errors:
+            self._ensure_pipelines([name])
+        return self._get_loaded(name) if name in self._ready else None
+
+    def _ensure_pipelines(self, names):
+        """Load every named pipeline that is not loaded yet, in a single batch."""
+        # Acquire locks in a fixed order so concurrent batches cannot deadlock
+        locks = [self._load_locks[name] for name in self.PIPELINE_NAMES if name in names]
+        for lock in locks:
+            lock.acquire()
+        try:
+            pending = [
+                name for name in names
+                if name not in self._ready and name not in self._load_errors
+            ]
+            if pending:
+                self._load_pipelines(pending)
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def _load_pipelines(self, names):
+        """
+        Load pipelines onto the current device.
 
-            self._load_sketch_model(current_device_candidate, current_dtype_candidate)
-            self._load_manipulation_model(current_device_candidate, current_dtype_candidate)
-            self._move_models_to_device(current_device_candidate)
-            self._enable_optimizations(current_device_candidate)
+        The checkpoint files of all requested pipelines are read concurrently
+        on a thread pool; the components are then built one at a time and
+        each pipeline is assembled from its components.
+        """
+        device, dtype = self._device, self._dtype
+        print(f"🚀 Loading {', '.join(names)} pipeline(s) to {device} with {dtype} precision...")
 
-            print("✅ Models loaded successfully!")
-            self._initial_load_error = None
+        tasks = {}
+        for name in names:
+            for component, task in self._component_tasks(name, dtype).items():
+                tasks[(name, component)] = task
 
+        start = time.perf_counter()
+        components, errors, timings = load_components_parallel(tasks, config.MODEL_LOAD_WORKERS)
+        self._report_load_timings(timings, time.perf_counter() - start)
+
+        for name in names:
+            try:
+                failed = [error for (owner, _), error in errors.items() if owner == name]
+                if failed:
+                    raise failed[0]
+
+                owned = {component: value for (owner, component), value in components.items() if owner == name}
+                assemble_start = time.perf_counter()
+                with MODULE_CONSTRUCTION_LOCK:
+                    self._assemble_pipeline(name, owned, dtype)
+                self._load_timings[f"{name}.assemble"] = time.perf_counter() - assemble_start
+                MODEL_LOAD_SECONDS.set(self._load_timings[f"{name}.assemble"], component=f"{name}.assemble")
+
+                # Export (or load the cached export) while the weights are still float32 on CPU
+                if name == "sketch":
+                    self._setup_sketch_backend(device)
+
+                # With a memory budget, pipelines stay on CPU until the
+                # residency manager swaps them in on first use
+                if not self._residency.enabled:
+                    self._move_models_to_device(device, [name])
+                self._enable_optimizations(device, [name])
+                self._residency.register(name, self._get_loaded(name))
+                self._ready.add(name)
+
+                print(f"✅ {name.capitalize()} pipeline loaded successfully!")
+                self._load_errors.pop(name, None)
+
+            except Exception as e:
+                self._handle_loading_error(e, device, name)
+
+    def _setup_sketch_backend(self, device):
+        """Create ONNX Runtime sessions for the sketch pipeline if configured, else keep PyTorch."""
+        self._onnx_sessions = None
+        if config.SKETCH_BACKEND["backend"] != "onnx":
+            return
+        if device != "cpu":
+            print(f"⚠️ The ONNX sketch backend runs on CPU only; using PyTorch on {device}.")
+            return
+
+        try:
+            start = time.perf_counter()
+            self._onnx_sessions = prepare_sketch_sessions(
+                self._pipe_sketch,
+                config.SKETCH_BACKEND["cache_dir"],
+                config.CONTROLNET_MODEL_ID,
+                config.STABLE_DIFFUSION_MODEL_ID,
+                opset=config.SKETCH_BACKEND["opset"],
+                export_if_missing=config.SKETCH_BACKEND["export_if_missing"],
+                intra_op_threads=config.SKETCH_BACKEND["intra_op_threads"],
+            )
+            self._load_timings["sketch.onnx"] = time.perf_counter() - start
+            print("⚡ Sketch pipeline will run on ONNX Runtime.")
+        except ImportError:
+            print("onnxruntime not found. Install 'onnx' and 'onnxruntime' for the ONNX backend; using PyTorch.")
         except Exception as e:
-            self._handle_loading_error(e, current_device_candidate)
-
-    def _load_sketch_model(self, device, dtype):
-        """Load the sketch-to-image model."""
-        print(f"Loading ControlNet model: {config.CONTROLNET_MODEL_ID}")
-        controlnet = ControlNetModel.from_pretrained(
-            config.CONTROLNET_MODEL_ID,
-            torch_dtype=dtype,
-            local_files_only=False
-        )
+            FALLBACK_EVENTS.inc(kind="pytorch")
+            print(f"⚠️ ONNX backend unavailable ({e}); using the PyTorch sketch pipeline.")
 
-        print(f"Loading Stable Diffusion Pipeline: {config.STABLE_DIFFUSION_MODEL_ID}")
-        self._pipe_sketch = StableDiffusionControlNetPipeline.from_pretrained(
-            config.STABLE_DIFFUSION_MODEL_ID,
-            controlnet=controlnet,
-            torch_dtype=dtype,
-            local_files_only=False
-        )
-        self._pipe_sketch.scheduler = UniPCMultistepScheduler.from_config(
-            self._pipe_sketch.scheduler.config
-        )
+    def _component_tasks(self, name, dtype):
+        """
+        Return the component load tasks for a pipeline, keyed by component name.
+
+        Each task is a (prefetch, build) pair: prefetch reads the checkpoint
+        files and may run on any thread, build calls from_pretrained and is
+        run serially by load_components_parallel.
+        """
+        if name == "sketch":
+            model_id = config.STABLE_DIFFUSION_MODEL_ID
+            tasks = {
+                "controlnet": (
+                    lambda: prefetch_checkpoint(config.CONTROLNET_MODEL_ID, None, ["config.json"], DIFFUSERS_WEIGHTS),
+                    lambda: ControlNetModel.from_pretrained(
+                        config.CONTROLNET_MODEL_ID,
+                        torch_dtype=dtype,
+                        local_files_only=False
+                    ),
+                ),
+                "safety_checker": (
+                    lambda: prefetch_checkpoint(model_id, "safety_checker", ["config.json"], TRANSFORMERS_WEIGHTS),
+                    lambda: StableDiffusionSafetyChecker.from_pretrained(
+                        model_id,
+                        subfolder="safety_checker",
+                        torch_dtype=dtype
+                    ),
+                ),
+            }
+        else:
+            model_id = config.INSTRUCTPIX2PIX_MODEL_ID
+            tasks = {}
 
-    def _load_manipulation_model(self, device, dtype):
-        """Load the image manipulation model."""
-        print(f"Loading InstructPix2Pix Pipeline: {config.INSTRUCTPIX2PIX_MODEL_ID}")
-        self._pipe_manipulate = StableDiffusionInstructPix2PixPipeline.from_pretrained(
-            config.INSTRUCTPIX2PIX_MODEL_ID,
-            torch_dtype=dtype,
-            safety_checker=None,
-            local_files_only=False
+        tasks["unet"] = (
+            lambda: prefetch_checkpoint(model_id, "unet", ["config.json"], DIFFUSERS_WEIGHTS),
+            lambda: UNet2DConditionModel.from_pretrained(
+                model_id,
+                subfolder="unet",
+                torch_dtype=dtype
+            ),
         )
+        for component in SHAREABLE_COMPONENTS:
+            tasks[component] = (
+                lambda component=component: self._components.prefetch(model_id, component),
+                lambda component=component: self._components.load(model_id, component, dtype),
+            )
+        return tasks
+
+    def _assemble_pipeline(self, name, components, dtype):
+        """Build a pipeline from preloaded components."""
+        if name == "sketch":
+            print(f"Assembling Stable Diffusion ControlNet Pipeline: {config.STABLE_DIFFUSION_MODEL_ID}")
+            self._pipe_sketch = StableDiffusionControlNetPipeline.from_pretrained(
+                config.STABLE_DIFFUSION_MODEL_ID,
+                torch_dtype=dtype,
+                local_files_only=False,
+                **components
+            )
+        else:
+            print(f"Assembling InstructPix2Pix Pipeline: {config.INSTRUCTPIX2PIX_MODEL_ID}")
+            self._pipe_manipulate = StableDiffusionInstructPix2PixPipeline.from_pretrained(
+                config.INSTRUCTPIX2PIX_MODEL_ID,
+                torch_dtype=dtype,
+                safety_checker=None,
+                local_files_only=False,
+                **components
+            )
 
-    def _move_models_to_device(self, device):
-        """Move models to the specified device."""
-        print(f"Moving models to {device}...")
-        self._pipe_sketch.to(device)
-        self._pipe_manipulate.to(device)
+        # The checkpoint's scheduler config seeds every registry scheduler
+        pipe = self._get_loaded(name)
+        self._schedulers.register(name, pipe.scheduler.config)
+        pipe.scheduler = self._schedulers.get(name, config.DEFAULT_SCHEDULERS[name])
+        with self._views_lock:
+            self._loaded_schedulers[name] = config.DEFAULT_SCHEDULERS[name]
 
-    def _enable_optimizations(self, device):
+    def _report_load_timings(self, timings, wall_time):
+        """Record and print per-component load timings (file read plus module build)."""
+        for (name, component), (read, build) in sorted(timings.items(), key=lambda item: -sum(item[1])):
+            elapsed = read + build
+            self._load_timings[f"{name}.{component}"] = elapsed
+            MODEL_LOAD_SECONDS.set(elapsed, component=f"{name}.{component}")
+            print(f"⏱️ {name}.{component}: {elapsed:.2f}s (read {read:.2f}s, build {build:.2f}s)")
+        summed = sum(read + build for read, build in timings.values())
+        print(f"⏱️ Component loading took {wall_time:.2f}s wall-clock ({summed:.2f}s summed).")
+
+    def _move_models_to_device(self, device, names=None):
+        """Move the loaded models to the specified device."""
+        for name in names or self.PIPELINE_NAMES:
+            pipe = self._get_loaded(name)
+            if pipe is not None:
+                print(f"Moving {name} pipeline to {device}...")
+                pipe.to(device)
+
+    def _enable_optimizations(self, device, names=None):
         """Enable performance optimizations if available."""
+        if device == "cpu":
+            for name in names or self.PIPELINE_NAMES:
+                pipe = self._get_loaded(name)
+                if pipe is not None:
+                    self._quantize_pipeline(name, pipe)
+                    self._autotune_cpu(pipe)
+                    apply_cpu_execution(pipe, self._cpu_profile["bf16"], self._cpu_profile["channels_last"])
+            print(f"CPU execution: bf16={self._cpu_profile['bf16']}, channels_last={self._cpu_profile['channels_last']}.")
         if device == "cuda":
             try:
                 import xformers
-                self._pipe_sketch.enable_xformers_memory_efficient_attention()
-                self._pipe_manipulate.enable_xformers_memory_efficient_attention()
+                for name in names or self.PIPELINE_NAMES:
+                    pipe = self._get_loaded(name)
+                    if pipe is not None:
+                        pipe.enable_xformers_memory_efficient_attention()
+                self._xformers_enabled = True
                 print("XFormers attention enabled for performance.")
             except ImportError:
                 print("XFormers not found. Install 'xformers' for optimal CUDA performance (`pip install xformers`).")
             except Exception as e:
                 print(f"Warning: Could not enable xformers memory attention: {e}")
 
-    def _handle_loading_error(self, error, device):
+    def _quantize_pipeline(self, name, pipe):
+        """Apply dynamic int8 quantization to the configured components of a CPU pipeline."""
+        if not config.INT8_QUANTIZATION["enabled"]:
+            return
+
+        model_id = config.STABLE_DIFFUSION_MODEL_ID if name == "sketch" else config.INSTRUCTPIX2PIX_MODEL_ID
+        sources = {
+            "text_encoder": (model_id, "text_encoder"),
+            "unet": (model_id, "unet"),
+            "controlnet": (config.CONTROLNET_MODEL_ID, ""),
+        }
+        for component in config.INT8_QUANTIZATION["components"]:
+            module = getattr(pipe, component, None)
+            # Shared components are quantized once, by the first pipeline that uses them
+            if module is None or module in self._quantized_modules:
+                continue
+            start = time.perf_counter()
+            cached = quantize_module(module, config.INT8_QUANTIZATION["cache_dir"], *sources[component])
+            self._quantized_modules.add(module)
+            source = "cached int8 weights" if cached else "fresh quantization"
+            print(f"🗜️ Quantized {name}.{component} to int8 ({source}) in {time.perf_counter() - start:.2f}s.")
+
+    def _autotune_cpu(self, pipe):
+        """Benchmark CPU execution settings on the first loaded UNet and keep the fastest."""
+        with self._device_lock:
+            if not config.CPU_EXECUTION["autotune"] or self._autotune_results is not None:
+                return
+            print("🔧 Autotuning CPU execution settings...")
+            best, self._autotune_results = autotune(
+                pipe.unet,
+                num_threads=config.CPU_EXECUTION["num_threads"],
+                allow_bf16=bf16_supported() and not config.INT8_QUANTIZATION["enabled"],
+                latent_size=config.CPU_EXECUTION["autotune_latent_size"],
+            )
+            self._cpu_profile = {key: best[key] for key in ("num_threads", "bf16", "channels_last")}
+            apply_thread_settings(best["num_threads"])
+
+    def _fall_back_to_cpu(self):
+        """Switch the manager to CPU, moving any already-loaded pipelines along."""
+        with self._device_lock:
+            if self._device == "cpu":
+                return
+            print("Attempting to retry on CPU due to VRAM error...")
+            FALLBACK_EVENTS.inc(kind="cpu")
+            config.DEVICE = "cpu"
+            config.DTYPE = torch.float32
+            self._device = "cpu"
+            self._dtype = torch.float32
+            for name in self.PIPELINE_NAMES:
+                pipe = self._get_loaded(name)
+                if pipe is not None:
+                    pipe.to("cpu", torch.float32)
+            self._residency.device = "cpu"
+            self._configure_cpu_execution()
+            self._enable_optimizations("cpu", [name for name in self.PIPELINE_NAMES if self._get_loaded(name) is not None])
+            torch.cuda.empty_cache()
+            gc.collect()
+
+    def _handle_loading_error(self, error, device, name=None):
         """Handle and categorize loading errors."""
         detailed_error = f"❌ Error during model loading: {error}"
         print(detailed_error)
-        
+
         error_str = str(error).lower()
-        
+        names = [name] if name else list(self.PIPELINE_NAMES)
+
         if any(keyword in error_str for keyword in ["cuda out of memory", "hiplaunchkernel", "out of memory"]):
-            self._initial_load_error = "❌ GPU Memory (VRAM) Error: Insufficient VRAM to load models. Try a GPU with more memory or ensure `xformers` is installed and `diffusers` is updated. Attempting to fall back to CPU."
-            if device == "cuda":
-                print("Attempting to retry on CPU due to VRAM error...")
-                self._cleanup_models()
-                config.DEVICE = "cpu"
-                config.DTYPE = torch.float32
-                self._load_models_internal()
+            load_error = "❌ GPU Memory (VRAM) Error: Insufficient VRAM to load models. Try a GPU with more memory or ensure `xformers` is installed and `diffusers` is updated. Attempting to fall back to CPU."
+            OOM_EVENTS.inc(stage="load")
+            if device == "cuda" and name is not None:
+                self._cleanup_models([name])
+                self._fall_back_to_cpu()
+                self._load_pipelines([name])
+                return
         elif any(keyword in error_str for keyword in ["cannot load", "safetensors_rust", "filenotfounderror"]):
-            self._initial_load_error = f"❌ Model File Error: Could not load model files. Check internet connection, disk space, or try clearing Hugging Face cache. Error: {error}"
+            load_error = f"❌ Model File Error: Could not load model files. Check internet connection, disk space, or try clearing Hugging Face cache. Error: {error}"
         elif "enable_xformers_memory_efficient_attention" in error_str:
-            self._initial_load_error = f"❌ Compatibility Error: Your 'diffusers' library version might be too old or incompatible with `xformers`. Please run `pip install --upgrade diffusers transformers accelerate` and `pip install xformers`."
+            load_error = f"❌ Compatibility Error: Your 'diffusers' library version might be too old or incompatible with `xformers`. Please run `pip install --upgrade diffusers transformers accelerate` and `pip install xformers`."
         else:
-            self._initial_load_error = f"❌ An unexpected error occurred during model loading. Check console for details. Error: {error}"
+            load_error = f"❌ An unexpected error occurred during model loading. Check console for details. Error: {error}"
 
-        self._cleanup_models()
+        for failed_name in names:
+            self._load_errors[failed_name] = load_error
+        self._cleanup_models(names)
 
-    def _cleanup_models(self):
+    def _cleanup_models(self, names=None):
         """Cleans up loaded models and clears GPU cache."""
-        if self._pipe_sketch:
-            del self._pipe_sketch
-            self._pipe_sketch = None
-        if self._pipe_manipulate:
-            del self._pipe_manipulate
-            self._pipe_manipulate = None
+        for name in names or self.PIPELINE_NAMES:
+            self._ready.discard(name)
+            with self._views_lock:
+                # Views hold the pipeline's modules; drop them with it
+                for key in [key for key in self._scheduler_views if key[0] == name]:
+                    del self._scheduler_views[key]
+            if self._get_loaded(name) is not None:
+                setattr(self, self._PIPELINE_ATTRS[name], None)
+            self._residency.unregister(name)
         if config.DEVICE == "cuda":
             torch.cuda.empty_cache()
         gc.collect()
 
-    def get_sketch_pipeline(self):
-        """Get the sketch-to-image pipeline."""
-        return self._pipe_sketch
+    @contextmanager
+    def use_pipeline(self, name, scheduler=None, workload=None, tiling_seen=None):
+        """
+        Context manager that yields a pipeline resident on the compute device.
+
+        The pipeline is loaded on first use and protected from eviction by
+        the residency manager until the block exits.
 
-    def get_manipulate_pipeline(self):
-        """Get the image manipulation pipeline."""
-        return self._pipe_manipulate
+        Args:
+            name: Pipeline name ("sketch" or "manipulation")
+            scheduler: Optional registry scheduler name; the yielded pipeline
+                runs it, being the loaded pipeline itself or a cached view
+                that shares its modules
+            workload: Optional (width, height, batch_size) of the call, used to
+                pick attention slicing, VAE slicing and tiling against
+                ACTIVATION_MEMORY_BUDGET_GB
+            tiling_seen: Optional set that receives every VAE tiling state the
+                pipeline had during the block (see MemoryModeController)
+
+        Yields:
+            The pipeline, or None if it failed to load
+        """
+        with self._residency.lease(name, lambda: self._ensure_pipeline(name)) as loaded, \
+                self._scheduler_view(loaded, name, scheduler) as pipe:
+            if pipe is not None and name == "sketch" and self._onnx_sessions is not None:
+                yield OnnxSketchPipeline(pipe, self._onnx_sessions)
+                return
+            if pipe is None or workload is None:
+                yield pipe
+                return
+
+            width, height, batch_size = workload
+            with self._memory_modes.apply(
+                name, pipe, width, height, batch_size,
+                dtype_bytes=torch.finfo(self._dtype).bits // 8,
+                guidance_copies=2 if name == "sketch" else 3,
+                memory_efficient_attention=self._xformers_enabled,
+                tiling_seen=tiling_seen,
+            ):
+                yield pipe
+
+    def needs_vae_tiling(self, name, width, height):
+        """Whether a single image of this size is decoded with tiled VAE when run on its own."""
+        if name == "sketch" and self._onnx_sessions is not None:
+            return False
+        modes = self._memory_modes.required_modes(
+            width, height, 1,
+            dtype_bytes=torch.finfo(self._dtype).bits // 8,
+            guidance_copies=2 if name == "sketch" else 3,
+            memory_efficient_attention=self._xformers_enabled,
+        )
+        return "vae_tiling" in modes
+
+    @contextmanager
+    def _scheduler_view(self, pipe, name, scheduler):
+        """
+        Yield a pipeline running the named scheduler, for the duration of one call.
+
+        The loaded pipeline is used itself when it already runs that scheduler
+        and no other call holds it. Otherwise an idle view sharing its modules
+        is reused, or built once. Views are cached per (pipeline, scheduler)
+        but never shared by concurrent calls, since schedulers keep per-run
+        state.
+        """
+        if pipe is None or scheduler is None:
+            yield pipe
+            return
+
+        key = (name, scheduler)
+        view = None
+        with self._views_lock:
+            if self._loaded_schedulers.get(name) == scheduler and name not in self._pipes_in_use:
+                self._pipes_in_use.add(name)
+                view = pipe
+            elif self._scheduler_views.get(key):
+                view = self._scheduler_views[key].pop()
+        if view is None:
+            view = self._with_scheduler(pipe, name, scheduler)
+
+        try:
+            yield view
+        finally:
+            with self._views_lock:
+                if view is pipe:
+                    self._pipes_in_use.discard(name)
+                elif self._get_loaded(name) is pipe:
+                    # Not returned if the pipeline was cleaned up meanwhile
+                    self._scheduler_views.setdefault(key, []).append(view)
+
+    def _with_scheduler(self, pipe, name, scheduler):
+        """Return a view of a pipeline that shares its modules but uses another scheduler."""
+        components = dict(pipe.components, scheduler=self._schedulers.get(name, scheduler))
+        return type(pipe)(**components, requires_safety_checker=pipe.config.requires_safety_checker)
+
+    def is_pipeline_loaded(self, name):
+        """Check whether a pipeline is currently loaded, without loading it."""
+        return name in self._ready
+
+    def get_component_key(self, component):
+        """
+        Get a key identifying a component's weights.
+
+        Components loaded through the shared registry are keyed by their
+        content fingerprint; anything else falls back to its object identity,
+        a key starting with "id" that is only valid in this process and must
+        not be persisted.
+        """
+        key = self._components.key_of(component)
+        if key is None:
+            key = ("id", type(component).__name__, id(component))
+        if component in self._quantized_modules:
+            key = key + ("int8",)
+        return key
+
+    def get_residency_stats(self):
+        """Get residency hits, misses, evictions and cumulative swap times."""
+        return self._residency.get_stats()
+
+    def autocast(self):
+        """Return the autocast context pipeline calls should run under."""
+        return autocast_context(self._device, self._device == "cpu" and self._cpu_profile["bf16"])
+
+    def get_execution_signature(self):
+        """Get the execution settings that change generated pixels, for cache keys."""
+        return {
+            "sketch_backend": self.get_sketch_backend(),
+            "bf16": self._device == "cpu" and self._cpu_profile["bf16"],
+            "int8": sorted(config.INT8_QUANTIZATION["components"]) if self._quantized_modules else [],
+        }
+
+    def get_sketch_backend(self):
+        """Get the backend the sketch pipeline runs on ("onnx" or "pytorch")."""
+        return "onnx" if self._onnx_sessions is not None else "pytorch"
+
+    def get_cpu_profile(self):
+        """Get the active CPU execution settings and the autotune measurements, if any."""
+        return {**self._cpu_profile, "autotune": self._autotune_results}
+
+    def get_load_timings(self):
+        """Get per-component load durations in seconds, keyed as "pipeline.component"."""
+        return dict(self._load_timings)
+
+    def is_pipeline_available(self, name):
+        """
+        Check whether a pipeline can serve requests without forcing a load.
+
+        Pipelines that are not loaded yet (lazy, or dropped by the residency
+        manager) count as available unless a previous load attempt failed.
+        """
+        return name not in self._load_errors
 
     def get_load_status(self):
         """Get the current loading status as HTML."""
-        if self._initial_load_error:
-            return f'<div class="status-error">{self._initial_load_error}</div>'
-        else:
-            return f'<div class="status-success"><span class="status-icon">✅</span><strong>AI Models Ready!</strong> Running on <strong>{config.DEVICE.upper()}</strong></div>'
+        if self._load_errors:
+            errors = "<br>".join(dict.fromkeys(self._load_errors.values()))
+            return f'<div class="status-error">{errors}</div>'
+
+        pending = [name for name in self.PIPELINE_NAMES if name not in self._ready]
+        pending_note = f" ({', '.join(pending)} loads on first use)" if pending else ""
+        return f'<div class="status-success"><span class="status-icon">✅</span><strong>AI Models Ready!</strong> Running on <strong>{self._device.upper()}</strong>{pending_note}</div>'
+
+    def prepare_for_fork(self):
+        """
+        Load every pipeline and freeze the process state before forking workers.
+
+        Forked workers share the weight pages copy-on-write as long as nothing
+        writes to them: every pipeline is loaded here rather than lazily in
+        each worker, parameters stop tracking gradients, and the objects alive
+        now are moved out of the garbage collector's reach so collections in
+        the workers do not dirty their pages.
+
+        Raises:
+            RuntimeError: If the setup cannot share weights across forked processes
+        """
+        if self._device != "cpu":
+            raise RuntimeError("Prefork workers require DEVICE='cpu'; CUDA contexts do not survive fork.")
+        if self._onnx_sessions is not None:
+            raise RuntimeError("Prefork workers require the pytorch sketch backend; ONNX Runtime sessions do not survive fork.")
+        if self._residency.enabled:
+            print("⚠️ Residency eviction moves weights and breaks copy-on-write sharing; "
+                  "set RESIDENCY_MEMORY_BUDGET_GB = None with prefork workers.")
+
+        self._ensure_pipelines(self.PIPELINE_NAMES)
+        for name in self.PIPELINE_NAMES:
+            pipe = self._get_loaded(name)
+            if pipe is None:
+                raise RuntimeError(f"{name} pipeline failed to load: {self._load_errors.get(name)}")
+            for component in pipe.components.values():
+                if isinstance(component, torch.nn.Module):
+                    component.requires_grad_(False)
+
+        gc.collect()
+        gc.freeze()
+        print(f"🧊 Froze {gc.get_freeze_count()} objects for copy-on-write sharing.")
 
     def cleanup_memory(self):
         """Clean up GPU memory after generation."""
         if config.DEVICE == "cuda":
             torch.cuda.empty_cache()
-            gc.collect()
\ No newline at end of file
+            gc.collect()
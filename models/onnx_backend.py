@@ -0,0 +1,305 @@
+"""ONNX Runtime backend for the sketch-to-image pipeline on CPU."""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import torch
+from diffusers.pipelines.stable_diffusion import StableDiffusionPipelineOutput
+
+from .components import weights_digest
+
+
+ONNX_GRAPHS = ("text_encoder", "controlnet", "unet", "vae_decoder")
+MANIFEST_NAME = "manifest.json"
+
+
+def export_cache_key(controlnet_model_id, stable_diffusion_model_id, opset):
+    """
+    Key identifying an export by the weights it was made from.
+
+    Returns:
+        str: Hex digest covering the ControlNet, UNet, VAE and text encoder
+        weights, the opset and the torch version
+    """
+    parts = {
+        "controlnet": weights_digest(controlnet_model_id, ""),
+        "unet": weights_digest(stable_diffusion_model_id, "unet"),
+        "vae": weights_digest(stable_diffusion_model_id, "vae"),
+        "text_encoder": weights_digest(stable_diffusion_model_id, "text_encoder"),
+        "opset": opset,
+        "torch": torch.__version__,
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+class _TextEncoder(torch.nn.Module):
+    def __init__(self, text_encoder):
+        super().__init__()
+        self.text_encoder = text_encoder
+
+    def forward(self, input_ids):
+        return self.text_encoder(input_ids, return_dict=False)[0]
+
+
+class _ControlNet(torch.nn.Module):
+    def __init__(self, controlnet):
+        super().__init__()
+        self.controlnet = controlnet
+
+    def forward(self, sample, timestep, encoder_hidden_states, controlnet_cond, conditioning_scale):
+        down, mid = self.controlnet(
+            sample, timestep, encoder_hidden_states=encoder_hidden_states,
+            controlnet_cond=controlnet_cond, conditioning_scale=conditioning_scale, return_dict=False,
+        )
+        return tuple(down) + (mid,)
+
+
+class _UNet(torch.nn.Module):
+    def __init__(self, unet):
+        super().__init__()
+        self.unet = unet
+
+    def forward(self, sample, timestep, encoder_hidden_states, *residuals):
+        return self.unet(
+            sample, timestep, encoder_hidden_states=encoder_hidden_states,
+            down_block_additional_residuals=list(residuals[:-1]),
+            mid_block_additional_residual=residuals[-1], return_dict=False,
+        )[0]
+
+
+class _VaeDecoder(torch.nn.Module):
+    def __init__(self, vae):
+        super().__init__()
+        self.vae = vae
+
+    def forward(self, latents):
+        return self.vae.decode(latents / self.vae.config.scaling_factor, return_dict=False)[0]
+
+
+def _export(module, args, path, input_names, output_names, dynamic_axes, opset):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    torch.onnx.export(
+        module, args, path,
+        input_names=input_names, output_names=output_names,
+        dynamic_axes=dynamic_axes, opset_version=opset, do_constant_folding=True,
+    )
+
+
+@torch.no_grad()
+def export_sketch_pipeline(pipe, output_dir, opset=17):
+    """
+    Export the text encoder, ControlNet, UNet and VAE decoder of a float32 CPU pipeline.
+
+    Graphs are written to a temporary directory and moved into place once
+    complete, so an interrupted export is never mistaken for a cached one.
+
+    Args:
+        pipe: Loaded StableDiffusionControlNetPipeline on CPU in float32
+        output_dir: Final directory of the export
+        opset: ONNX opset version
+    """
+    tmp_dir = output_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    latent_channels = pipe.unet.config.in_channels
+    vae_scale_factor = pipe.vae_scale_factor
+    hidden_size = pipe.text_encoder.config.hidden_size
+    max_length = pipe.tokenizer.model_max_length
+
+    # Batch of two, as with classifier-free guidance, on a small canvas
+    sample = torch.randn(2, latent_channels, 16, 16)
+    timestep = torch.tensor([500.0])
+    encoder_hidden_states = torch.randn(2, max_length, hidden_size)
+    controlnet_cond = torch.rand(2, 3, 16 * vae_scale_factor, 16 * vae_scale_factor)
+    conditioning_scale = torch.tensor([1.0])
+
+    # Pixel-space tensors are vae_scale_factor times the latents, and each
+    # residual is downsampled by its own block, so every spatial size gets
+    # its own symbolic axes rather than being tied to the latent ones
+    latent_axes = {0: "batch", 2: "height", 3: "width"}
+    pixel_axes = {0: "batch", 2: "pixel_height", 3: "pixel_width"}
+    text_axes = {0: "batch"}
+
+    _export(_TextEncoder(pipe.text_encoder), (torch.zeros(2, max_length, dtype=torch.long),),
+            os.path.join(tmp_dir, "text_encoder", "model.onnx"),
+            ["input_ids"], ["last_hidden_state"], {"input_ids": text_axes, "last_hidden_state": text_axes}, opset)
+
+    controlnet_args = (sample, timestep, encoder_hidden_states, controlnet_cond, conditioning_scale)
+    residuals = _ControlNet(pipe.controlnet)(*controlnet_args)
+    residual_names = [f"down_{i}" for i in range(len(residuals) - 1)] + ["mid"]
+    residual_axes = {name: {0: "batch", 2: f"{name}_height", 3: f"{name}_width"} for name in residual_names}
+    _export(_ControlNet(pipe.controlnet), controlnet_args,
+            os.path.join(tmp_dir, "controlnet", "model.onnx"),
+            ["sample", "timestep", "encoder_hidden_states", "controlnet_cond", "conditioning_scale"],
+            residual_names,
+            {"sample": latent_axes, "encoder_hidden_states": text_axes, "controlnet_cond": pixel_axes,
+             **residual_axes}, opset)
+
+    _export(_UNet(pipe.unet), (sample, timestep, encoder_hidden_states) + tuple(residuals),
+            os.path.join(tmp_dir, "unet", "model.onnx"),
+            ["sample", "timestep", "encoder_hidden_states"] + residual_names, ["noise_pred"],
+            {"sample": latent_axes, "encoder_hidden_states": text_axes, "noise_pred": latent_axes,
+             **residual_axes}, opset)
+
+    _export(_VaeDecoder(pipe.vae), (sample[:1],),
+            os.path.join(tmp_dir, "vae_decoder", "model.onnx"),
+            ["latents"], ["image"], {"latents": latent_axes, "image": pixel_axes}, opset)
+
+    with open(os.path.join(tmp_dir, MANIFEST_NAME), "w") as f:
+        json.dump({"residual_names": residual_names, "latent_channels": latent_channels, "opset": opset}, f)
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.replace(tmp_dir, output_dir)
+
+
+def load_sketch_sessions(export_dir, intra_op_threads=None):
+    """
+    Create ONNX Runtime CPU sessions for an exported sketch pipeline.
+
+    Returns:
+        dict: Sessions keyed by graph name, plus the export manifest under "manifest"
+
+    Raises:
+        FileNotFoundError: If the export is missing or incomplete
+        ImportError: If onnxruntime is not installed
+    """
+    manifest_path = os.path.join(export_dir, MANIFEST_NAME)
+    if not os.path.isfile(manifest_path):
+        raise FileNotFoundError(f"No ONNX export at {export_dir}")
+
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if intra_op_threads:
+        options.intra_op_num_threads = int(intra_op_threads)
+
+    sessions = {
+        graph: ort.InferenceSession(
+            os.path.join(export_dir, graph, "model.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+        for graph in ONNX_GRAPHS
+    }
+    with open(manifest_path) as f:
+        sessions["manifest"] = json.load(f)
+    return sessions
+
+
+class OnnxSketchPipeline:
+    """
+    Runs the ControlNet denoising loop on ONNX Runtime sessions.
+
+    Wraps the PyTorch pipeline, whose tokenizer, scheduler, image processors
+    and safety checker are reused; any attribute not defined here is read
+    from it. Supports the call arguments ImageGenerator passes.
+    """
+
+    def __init__(self, pipe, sessions):
+        self._pipe = pipe
+        self._sessions = sessions
+        self._residual_names = sessions["manifest"]["residual_names"]
+        self._latent_channels = sessions["manifest"]["latent_channels"]
+
+    def __getattr__(self, name):
+        return getattr(self._pipe, name)
+
+    def _run(self, graph, **inputs):
+        feeds = {name: value.cpu().float().numpy() if value.dtype.is_floating_point else value.cpu().numpy()
+                 for name, value in inputs.items()}
+        return [torch.from_numpy(output) for output in self._sessions[graph].run(None, feeds)]
+
+    def _encode_prompts(self, prompts):
+        input_ids = self._pipe.tokenizer(
+            prompts, padding="max_length", max_length=self._pipe.tokenizer.model_max_length,
+            truncation=True, return_tensors="pt",
+        ).input_ids
+        return self._run("text_encoder", input_ids=input_ids.long())[0]
+
+    @torch.no_grad()
+    def __call__(self, image, prompt=None, negative_prompt=None, prompt_embeds=None,
+                 negative_prompt_embeds=None, num_inference_steps=20, guidance_scale=7.5,
+                 controlnet_conditioning_scale=1.0, generator=None, callback_on_step_end=None,
+                 callback_on_step_end_tensor_inputs=("latents",)):
+        pipe = self._pipe
+        images = image if isinstance(image, list) else [image]
+        batch_size = len(images)
+        do_cfg = guidance_scale > 1.0
+
+        if prompt_embeds is None:
+            prompts = prompt if isinstance(prompt, list) else [prompt] * batch_size
+            prompt_embeds = self._encode_prompts(prompts)
+        if negative_prompt_embeds is None and do_cfg:
+            negatives = negative_prompt if isinstance(negative_prompt, list) else [negative_prompt or ""] * batch_size
+            negative_prompt_embeds = self._encode_prompts(negatives)
+        prompt_embeds = prompt_embeds.float().cpu()
+        if do_cfg:
+            prompt_embeds = torch.cat([negative_prompt_embeds.float().cpu(), prompt_embeds])
+
+        control = pipe.prepare_image(
+            image=images, width=None, height=None, batch_size=batch_size, num_images_per_prompt=1,
+            device="cpu", dtype=torch.float32, do_classifier_free_guidance=do_cfg,
+        )
+        height, width = control.shape[-2:]
+
+        pipe.scheduler.set_timesteps(num_inference_steps, device="cpu")
+        latents = pipe.prepare_latents(
+            batch_size, self._latent_channels, height, width, torch.float32, torch.device("cpu"), generator
+        )
+        extra_step_kwargs = pipe.prepare_extra_step_kwargs(generator, 0.0)
+        conditioning_scale = torch.tensor([float(controlnet_conditioning_scale)])
+
+        for i, t in enumerate(pipe.scheduler.timesteps):
+            latent_input = torch.cat([latents] * 2) if do_cfg else latents
+            latent_input = pipe.scheduler.scale_model_input(latent_input, t)
+            timestep = t.reshape(1).float()
+
+            residuals = self._run(
+                "controlnet", sample=latent_input, timestep=timestep, encoder_hidden_states=prompt_embeds,
+                controlnet_cond=control, conditioning_scale=conditioning_scale,
+            )
+            noise_pred = self._run(
+                "unet", sample=latent_input, timestep=timestep, encoder_hidden_states=prompt_embeds,
+                **dict(zip(self._residual_names, residuals)),
+            )[0]
+
+            if do_cfg:
+                noise_uncond, noise_text = noise_pred.chunk(2)
+                noise_pred = noise_uncond + guidance_scale * (noise_text - noise_uncond)
+            latents = pipe.scheduler.step(noise_pred, t, latents, **extra_step_kwargs, return_dict=False)[0]
+
+            if callback_on_step_end is not None:
+                outputs = callback_on_step_end(self, i, t, {"latents": latents})
+                latents = outputs.pop("latents", latents)
+
+        decoded = self._run("vae_decoder", latents=latents)[0]
+        decoded, has_nsfw_concept = pipe.run_safety_checker(decoded, torch.device("cpu"), torch.float32)
+        if has_nsfw_concept is None:
+            do_denormalize = [True] * decoded.shape[0]
+        else:
+            do_denormalize = [not has_nsfw for has_nsfw in has_nsfw_concept]
+        output = pipe.image_processor.postprocess(decoded, output_type="pil", do_denormalize=do_denormalize)
+        return StableDiffusionPipelineOutput(images=output, nsfw_content_detected=has_nsfw_concept)
+
+
+def prepare_sketch_sessions(pipe, cache_dir, controlnet_model_id, stable_diffusion_model_id,
+                            opset=17, export_if_missing=True, intra_op_threads=None):
+    """
+    Load the cached ONNX export of a sketch pipeline, exporting it first if allowed.
+
+    Returns:
+        dict: Sessions for OnnxSketchPipeline
+
+    Raises:
+        FileNotFoundError: If the export is missing and export_if_missing is False
+    """
+    key = export_cache_key(controlnet_model_id, stable_diffusion_model_id, opset)
+    export_dir = os.path.join(cache_dir, f"sketch-{key[:16]}")
+    if not os.path.isfile(os.path.join(export_dir, MANIFEST_NAME)) and export_if_missing:
+        print(f"📦 Exporting sketch pipeline to ONNX in {export_dir} (one-time)...")
+        start = time.perf_counter()
+        export_sketch_pipeline(pipe, export_dir, opset)
+        print(f"📦 ONNX export finished in {time.perf_counter() - start:.1f}s.")
+    return load_sketch_sessions(export_dir, intra_op_threads)
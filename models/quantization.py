@@ -0,0 +1,121 @@
+"""Post-training dynamic int8 quantization of pipeline Linear layers for CPU."""
+
+import hashlib
+import os
+from collections import OrderedDict
+
+import torch
+from torch.ao.nn.quantized import dynamic as nnqd
+
+from .components import weights_digest
+
+
+# Bumped whenever the cache file layout changes
+CACHE_FORMAT = 2
+
+
+def _cache_path(cache_dir, model_id, subfolder):
+    digest = weights_digest(model_id, subfolder) or model_id
+    key = hashlib.sha256(
+        f"{model_id}/{subfolder}/{digest}/{torch.__version__}/{CACHE_FORMAT}".encode()
+    ).hexdigest()
+    return os.path.join(cache_dir, f"{subfolder or 'model'}-{key[:16]}.int8.pt")
+
+
+def _encode(value):
+    """
+    Turn a quantized state dict value into plain tensors, numbers and dicts.
+
+    Dynamic int8 Linear layers store a (weight, bias) tuple with a quantized
+    weight and a torch.dtype; both are spelled out so the cache file loads
+    with torch.load(weights_only=True).
+    """
+    if isinstance(value, torch.dtype):
+        return {"dtype": str(value).replace("torch.", "")}
+    if isinstance(value, tuple):
+        return {"tuple": [_encode(item) for item in value]}
+    if isinstance(value, torch.Tensor) and value.is_quantized:
+        if value.qscheme() in (torch.per_tensor_affine, torch.per_tensor_symmetric):
+            return {"int_repr": value.int_repr(), "scale": value.q_scale(), "zero_point": value.q_zero_point()}
+        return {"int_repr": value.int_repr(), "scales": value.q_per_channel_scales(),
+                "zero_points": value.q_per_channel_zero_points(), "axis": value.q_per_channel_axis()}
+    return value
+
+
+def _decode(value):
+    """Rebuild a state dict value written by _encode()."""
+    if not isinstance(value, dict):
+        return value
+    if "tuple" in value:
+        return tuple(_decode(item) for item in value["tuple"])
+    if "scale" in value:
+        return torch._make_per_tensor_quantized_tensor(value["int_repr"], value["scale"], value["zero_point"])
+    if "scales" in value:
+        return torch._make_per_channel_quantized_tensor(
+            value["int_repr"], value["scales"], value["zero_points"], value["axis"]
+        )
+    return getattr(torch, value["dtype"])
+
+
+def _load_cached_state_dict(path):
+    """Load a cached quantized state dict, or return None if the file cannot be read."""
+    try:
+        encoded = torch.load(path, map_location="cpu", weights_only=True)
+    except Exception as e:
+        print(f"⚠️ Ignoring unreadable quantization cache {path}: {e}")
+        return None
+    state_dict = OrderedDict((key, _decode(value)) for key, value in encoded.items())
+    # Per-module versions tell the packed params how to read their entries
+    state_dict._metadata = getattr(encoded, "_metadata", None)
+    return state_dict
+
+
+def _save_state_dict(state_dict, path):
+    """Write a quantized state dict in the plain layout _load_cached_state_dict() reads."""
+    encoded = OrderedDict((key, _encode(value)) for key, value in state_dict.items())
+    encoded._metadata = getattr(state_dict, "_metadata", None)
+    torch.save(encoded, path)
+
+
+def _swap_linear_layers(module):
+    """Replace every nn.Linear with an empty dynamic int8 Linear of the same shape."""
+    for name, child in module.named_children():
+        if type(child) is torch.nn.Linear:
+            setattr(module, name, nnqd.Linear(
+                child.in_features, child.out_features, bias_=child.bias is not None, dtype=torch.qint8
+            ))
+        else:
+            _swap_linear_layers(child)
+
+
+def quantize_module(module, cache_dir, model_id, subfolder):
+    """
+    Quantize a module's Linear layers to dynamic int8 in place.
+
+    The quantized state dict is cached per source weights, so later runs only
+    swap in the quantized layers and load the cached weights. Cache files
+    hold plain tensors only and are loaded with weights_only=True; an
+    unreadable one is replaced by quantizing again.
+
+    Args:
+        module: Float32 CPU module to quantize
+        cache_dir: Directory for cached quantized state dicts
+        model_id: Hub repository id or local directory the module came from
+        subfolder: Subfolder of the module within model_id ("" for the root)
+
+    Returns:
+        bool: True if the cached state dict was used
+    """
+    path = _cache_path(cache_dir, model_id, subfolder)
+    state_dict = _load_cached_state_dict(path) if os.path.isfile(path) else None
+    if state_dict is not None:
+        _swap_linear_layers(module)
+        module.load_state_dict(state_dict)
+        return True
+
+    torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = path + ".tmp"
+    _save_state_dict(module.state_dict(), tmp_path)
+    os.replace(tmp_path, path)
+    return False
@@ -0,0 +1,256 @@
+"""Memory-budgeted residency of pipeline components on the compute device."""
+
+import gc
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import torch
+
+from monitoring.metrics import CACHE_LOOKUPS, PIPELINE_ACQUIRE
+
+
+def module_nbytes(module):
+    """Return the memory held by a module's parameters and buffers, in bytes."""
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def module_device(module):
+    """Return the device type of a module's first parameter, or None if it has none."""
+    for param in module.parameters():
+        return param.device.type
+    return None
+
+
+class ResidencyManager:
+    """
+    Keeps recently used pipelines on the compute device within a memory budget.
+
+    Each pipeline is tracked as resident or evicted, together with the byte
+    size of its component modules recorded when it was registered. Sizes are
+    keyed per module, so a component shared by two pipelines is counted once
+    and is never evicted while either pipeline is running. Leasing a
+    pipeline that is not resident evicts idle ones until it fits. Idle pipelines are evicted in least-recently-used order, either
+    by offloading their exclusive components to CPU ("offload") or by
+    dropping the pipeline entirely so it is reloaded from its memory-mapped
+    safetensors checkpoint on next use ("drop").
+    """
+
+    POLICIES = ("offload", "drop")
+
+    def __init__(self, budget_bytes=None, policy="offload", device="cpu", drop_callback=None):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown residency policy '{policy}', expected one of {self.POLICIES}")
+
+        self.budget_bytes = budget_bytes
+        self.policy = policy
+        self.drop_callback = drop_callback
+
+        self._pipelines = OrderedDict()
+        # Module key -> bytes per pipeline, kept after a drop so the pipeline
+        # can be made room for before it is reloaded
+        self._sizes = {}
+        self._resident = set()
+        self._reserved = {}
+        self._active = {}
+        self._cond = threading.Condition()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "swap_in_seconds": 0.0,
+            "swap_out_seconds": 0.0,
+        }
+        self._device = None
+        self.device = device
+
+    @property
+    def enabled(self):
+        """Whether a memory budget is being enforced."""
+        return self.budget_bytes is not None
+
+    @property
+    def device(self):
+        return self._device
+
+    @device.setter
+    def device(self, device):
+        self._device = device
+        with self._cond:
+            self._resident = {name for name, pipe in self._pipelines.items() if self._on_device(pipe)}
+        if self.enabled and device == "cpu" and self.policy == "offload":
+            print("⚠️ Residency policy 'offload' has no effect on CPU, using 'drop' instead.")
+            self.policy = "drop"
+
+    def register(self, name, pipe):
+        """Start tracking a freshly loaded pipeline and record its size."""
+        with self._cond:
+            self._pipelines[name] = pipe
+            self._pipelines.move_to_end(name, last=False)
+            self._sizes[name] = {key: module_nbytes(module) for key, module in self._modules(pipe).items()}
+            if self._on_device(pipe):
+                self._resident.add(name)
+            else:
+                self._resident.discard(name)
+
+    def unregister(self, name):
+        """Stop tracking a pipeline that has been cleaned up."""
+        with self._cond:
+            self._pipelines.pop(name, None)
+            self._resident.discard(name)
+            self._cond.notify_all()
+
+    @contextmanager
+    def lease(self, name, load_fn):
+        """
+        Hold a pipeline resident on the device for the duration of the block.
+
+        Args:
+            name: Pipeline name
+            load_fn: Callable returning the pipeline, loading it if needed
+
+        Yields:
+            The resident pipeline, or None if it could not be loaded
+        """
+        with self._cond:
+            self._reserved[name] = self._reserved.get(name, 0) + 1
+            was_resident = name in self._resident
+
+        active = False
+        try:
+            start = time.perf_counter()
+            if not was_resident and self.enabled and name in self._sizes:
+                # A dropped pipeline: make room before reloading it
+                with self._cond:
+                    self._evict_for(name)
+            pipe = load_fn()
+            if pipe is not None:
+                self._make_resident(name, pipe, was_resident)
+                active = True
+                PIPELINE_ACQUIRE.observe(time.perf_counter() - start, pipeline=name)
+            yield pipe
+        finally:
+            with self._cond:
+                self._reserved[name] -= 1
+                if active:
+                    self._active[name] -= 1
+                self._cond.notify_all()
+
+    def _modules(self, pipe):
+        """Return the torch modules of a pipeline, keyed by identity."""
+        return {
+            id(component): component
+            for component in pipe.components.values()
+            if isinstance(component, torch.nn.Module)
+        }
+
+    def _on_device(self, pipe):
+        """Whether every module of a pipeline is on the compute device."""
+        return all(module_device(module) in (None, self._device) for module in self._modules(pipe).values())
+
+    def _resident_sizes(self):
+        """Return module key -> bytes for every resident pipeline, shared modules once."""
+        sizes = {}
+        for name in self._resident:
+            sizes.update(self._sizes.get(name, {}))
+        return sizes
+
+    def _make_resident(self, name, pipe, was_resident):
+        """Mark a leased pipeline resident, evicting idle ones to respect the budget."""
+        with self._cond:
+            self._pipelines[name] = pipe
+            self._pipelines.move_to_end(name)
+
+            # It may have been offloaded by another lease since was_resident was read
+            hit = was_resident and name in self._resident
+            self._stats["hits" if hit else "misses"] += 1
+            CACHE_LOOKUPS.inc(cache="residency", result="hit" if hit else "miss")
+            # Also on hits: eagerly loaded pipelines start out resident on CPU
+            # and may not fit together
+            if self.enabled:
+                self._evict_for(name)
+
+            if not hit:
+                missing = [module for module in self._modules(pipe).values()
+                           if module_device(module) != self._device]
+                if missing:
+                    start = time.perf_counter()
+                    for module in missing:
+                        module.to(self._device)
+                    elapsed = time.perf_counter() - start
+                    self._stats["swap_in_seconds"] += elapsed
+                    print(f"🔄 Swapped {name} pipeline onto {self._device} in {elapsed:.2f}s.")
+                self._resident.add(name)
+
+            self._active[name] = self._active.get(name, 0) + 1
+
+    def _evict_for(self, name):
+        """Evict idle pipelines until the named pipeline fits in the budget."""
+        needed = self._sizes[name]
+
+        while True:
+            resident = self._resident_sizes()
+            if sum({**resident, **needed}.values()) <= self.budget_bytes:
+                return
+
+            keep = set(needed)
+            for other in self._pipelines:
+                if self._active.get(other, 0) > 0:
+                    keep.update(self._sizes.get(other, {}))
+
+            candidates = [
+                other for other in self._pipelines
+                if other != name and other in self._resident and self._active.get(other, 0) == 0
+                and (self.policy == "offload" or self._reserved.get(other, 0) == 0)
+                and any(k not in keep for k in self._sizes.get(other, {}))
+            ]
+            if candidates:
+                self._evict(candidates[0], keep)
+                continue
+
+            busy = [other for other in self._pipelines if other != name and self._active.get(other, 0) > 0]
+            if not busy:
+                print(f"⚠️ {name} pipeline does not fit in the residency budget on its own, loading it anyway.")
+                return
+            # Wait for a running pipeline to finish so its components can be evicted
+            self._cond.wait()
+
+    def _evict(self, name, keep):
+        """Evict one idle pipeline, leaving the modules in keep untouched."""
+        start = time.perf_counter()
+        pipe = self._pipelines[name]
+
+        self._resident.discard(name)
+        if self.policy == "offload":
+            for key, module in self._modules(pipe).items():
+                if key not in keep:
+                    module.to("cpu")
+        else:
+            self._pipelines.pop(name)
+            del pipe
+            if self.drop_callback is not None:
+                self.drop_callback(name)
+
+        if self._device == "cuda":
+            torch.cuda.empty_cache()
+        gc.collect()
+
+        elapsed = time.perf_counter() - start
+        self._stats["evictions"] += 1
+        self._stats["swap_out_seconds"] += elapsed
+        action = "Offloaded" if self.policy == "offload" else "Dropped"
+        print(f"💤 {action} idle {name} pipeline in {elapsed:.2f}s to stay within the memory budget.")
+
+    def get_stats(self):
+        """Return residency hit/miss counters, cumulative swap times and resident pipelines."""
+        with self._cond:
+            stats = dict(self._stats)
+            lookups = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+            stats["resident"] = [name for name in self._pipelines if name in self._resident]
+            stats["resident_bytes"] = sum(self._resident_sizes().values())
+            stats["budget_bytes"] = self.budget_bytes
+            stats["policy"] = self.policy
+            return stats
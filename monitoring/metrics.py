@@ -0,0 +1,252 @@
+"""In-process metrics registry rendered in the Prometheus text format."""
+
+import bisect
+import os
+import resource
+import sys
+import threading
+
+
+DEFAULT_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values)) + list(extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    """Base class holding one value (or histogram) per label combination."""
+
+    metric_type = None
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _samples(self):
+        """Return (suffix, label_values, extra_labels, value) tuples for rendering."""
+        with self._lock:
+            return [("", key, None, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        for suffix, key, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.label_names, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    metric_type = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+
+class Gauge(_Metric):
+    """
+    Value that can go up and down, or be computed at scrape time.
+
+    With label names, `function` returns a dict of label value tuples to
+    values, so one computed gauge can expose a whole set of series.
+    """
+
+    metric_type = "gauge"
+
+    def __init__(self, name, help_text, label_names=(), function=None):
+        super().__init__(name, help_text, label_names)
+        self._function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self):
+        if self._function is not None:
+            if self.label_names:
+                return [("", key, None, value) for key, value in self._function().items()]
+            return [("", (), None, self._function())]
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    """Distribution of observations over fixed cumulative buckets."""
+
+    metric_type = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.setdefault(key, {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0})
+            state["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, state in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), state["counts"]):
+                    cumulative += count
+                    samples.append(("_bucket", key, [("le", _format_value(bound))], cumulative))
+                samples.append(("_sum", key, None, state["sum"]))
+                samples.append(("_count", key, None, state["count"]))
+        return samples
+
+
+class MetricsRegistry:
+    """Collection of named metrics rendered together for a scrape."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self._register(Counter(name, help_text, label_names))
+
+    def gauge(self, name, help_text, label_names=(), function=None):
+        return self._register(Gauge(name, help_text, label_names, function))
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._register(Histogram(name, help_text, label_names, buckets))
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+def flatten_stats(stats, prefix=""):
+    """
+    Flatten a nested stats dict into {dotted key: value} for its numeric leaves.
+
+    Booleans become 0/1; strings, lists and None are skipped.
+    """
+    flat = {}
+    for name, value in (stats or {}).items():
+        key = f"{prefix}.{name}" if prefix else str(name)
+        if isinstance(value, dict):
+            flat.update(flatten_stats(value, key))
+        elif isinstance(value, (bool, int, float)):
+            flat[key] = float(value)
+    return flat
+
+
+def current_rss_bytes():
+    """Resident set size of this process, falling back to the peak where unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+metrics = MetricsRegistry()
+
+REQUEST_LATENCY = metrics.histogram(
+    "sketchmagic_request_latency_seconds",
+    "End-to-end latency of generation requests.",
+    ["operation"],
+)
+REQUESTS = metrics.counter(
+    "sketchmagic_requests_total",
+    "Generation requests by outcome.",
+    ["operation", "status"],
+)
+QUEUE_WAIT = metrics.histogram(
+    "sketchmagic_queue_wait_seconds",
+    "Time requests spend waiting before their pipeline call starts.",
+    ["queue"],
+)
+PIPELINE_ACQUIRE = metrics.histogram(
+    "sketchmagic_pipeline_acquire_seconds",
+    "Time to obtain a resident pipeline, including lazy loads and swap-ins.",
+    ["pipeline"],
+)
+DENOISING_STEPS_PER_SECOND = metrics.histogram(
+    "sketchmagic_denoising_steps_per_second",
+    "Denoising throughput of each pipeline call.",
+    ["operation"],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0),
+)
+BATCH_SIZE = metrics.histogram(
+    "sketchmagic_batch_size",
+    "Number of requests per pipeline call.",
+    ["operation"],
+    buckets=(1, 2, 4, 8, 16),
+)
+CACHE_LOOKUPS = metrics.counter(
+    "sketchmagic_cache_lookups_total",
+    "Cache lookups by cache and result.",
+    ["cache", "result"],
+)
+OOM_EVENTS = metrics.counter(
+    "sketchmagic_oom_events_total",
+    "Out-of-memory errors by stage.",
+    ["stage"],
+)
+FALLBACK_EVENTS = metrics.counter(
+    "sketchmagic_fallback_events_total",
+    "Fallbacks to a slower execution path.",
+    ["kind"],
+)
+MEMORY_MODE_TOGGLES = metrics.counter(
+    "sketchmagic_memory_mode_toggles_total",
+    "Attention slicing, VAE slicing and VAE tiling switched on or off for a request.",
+    ["pipeline", "mode", "state"],
+)
+MODEL_LOAD_SECONDS = metrics.gauge(
+    "sketchmagic_model_load_seconds",
+    "Duration of the most recent load of each pipeline component.",
+    ["component"],
+)
+PROCESS_RSS = metrics.gauge(
+    "sketchmagic_process_resident_memory_bytes",
+    "Resident set size of the process.",
+    function=current_rss_bytes,
+)
@@ -0,0 +1,146 @@
+"""On-demand torch.profiler capture of generation calls."""
+
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import torch
+from torch.profiler import ProfilerActivity, profile, record_function
+
+
+# Pipeline stages labelled with record_function while a capture is running
+STAGE_METHODS = {
+    "text_encoder": ("forward",),
+    "controlnet": ("forward",),
+    "unet": ("forward",),
+    "vae": ("encode", "decode"),
+}
+
+
+def _labelled(label, method):
+    def wrapper(*args, **kwargs):
+        with record_function(label):
+            return method(*args, **kwargs)
+    return wrapper
+
+
+class ProfilerCapture:
+    """
+    Profiles the next N generation calls once armed.
+
+    Each captured call writes a Chrome trace (open in chrome://tracing or
+    Perfetto) and a summary table with one row per labelled pipeline stage
+    followed by the top operators. While disarmed, `capture` and
+    `label_stages` return immediately without touching the profiler.
+
+    With a relay (a PreforkPool), the pipeline calls run in other processes:
+    `arm` is forwarded to the relay, whose workers profile their own calls,
+    and this process's `capture` stays a no-op.
+    """
+
+    def __init__(self, output_dir="profiles", row_limit=40, relay=None):
+        self.output_dir = output_dir
+        self.row_limit = row_limit
+        self.relay = relay
+        self._remaining = 0
+        self._capturing = False
+        self._lock = threading.Lock()
+        self._captures = []
+
+    def arm(self, count=1):
+        """Profile the next `count` generation calls."""
+        if self.relay is not None:
+            self.relay.arm_profiler(count)
+            print(f"🔬 Profiling the next {count} generation call(s) on the worker processes into {self.output_dir}.")
+            return
+        with self._lock:
+            self._remaining = max(0, int(count))
+        print(f"🔬 Profiling the next {count} generation call(s) into {self.output_dir}.")
+
+    def capture(self, operation):
+        """Context manager profiling the enclosed call if the profiler is armed."""
+        if not self._remaining:
+            return nullcontext()
+        return self._capture(operation)
+
+    @contextmanager
+    def _capture(self, operation):
+        with self._lock:
+            # torch.profiler sessions cannot overlap, so captures run one at a time
+            claimed = self._remaining > 0 and not self._capturing
+            if claimed:
+                self._remaining -= 1
+                self._capturing = True
+
+        if not claimed:
+            yield
+            return
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        try:
+            with profile(activities=activities, record_shapes=True, profile_memory=True) as prof:
+                with record_function(operation):
+                    yield
+        finally:
+            with self._lock:
+                self._capturing = False
+        self._save(operation, prof)
+
+    def label_stages(self, pipe):
+        """Context manager labelling the pipeline's stages while a capture is running."""
+        if not self._capturing:
+            return nullcontext()
+        return self._label_stages(pipe)
+
+    @contextmanager
+    def _label_stages(self, pipe):
+        patched = []
+        for attr, methods in STAGE_METHODS.items():
+            module = getattr(pipe, attr, None)
+            if module is None:
+                continue
+            for method in methods:
+                # Shared modules may already be labelled by a concurrent call
+                if method in vars(module):
+                    continue
+                setattr(module, method, _labelled(f"{attr}.{method}", getattr(module, method)))
+                patched.append((module, method))
+        try:
+            yield
+        finally:
+            for module, method in patched:
+                delattr(module, method)
+
+    def _save(self, operation, prof):
+        os.makedirs(self.output_dir, exist_ok=True)
+        stem = os.path.join(self.output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{operation}-{len(self._captures)}")
+        trace_path = stem + ".trace.json"
+        summary_path = stem + ".summary.txt"
+        prof.export_chrome_trace(trace_path)
+
+        averages = prof.key_averages()
+        labels = {f"{attr}.{method}" for attr, methods in STAGE_METHODS.items() for method in methods}
+        lines = [f"{'stage':<24}{'calls':>8}{'cpu total ms':>16}{'device total ms':>18}"]
+        for event in sorted(averages, key=lambda e: -e.cpu_time_total):
+            if event.key in labels:
+                device_time = getattr(event, "device_time_total", getattr(event, "cuda_time_total", 0))
+                lines.append(f"{event.key:<24}{event.count:>8}{event.cpu_time_total / 1000:>16.1f}{device_time / 1000:>18.1f}")
+
+        with open(summary_path, "w") as f:
+            f.write("\n".join(lines) + "\n\n")
+            f.write(averages.table(sort_by="self_cpu_time_total", row_limit=self.row_limit))
+
+        with self._lock:
+            self._captures.append({"operation": operation, "trace": trace_path, "summary": summary_path})
+        print(f"🔬 Saved {operation} profile to {trace_path} and {summary_path}.")
+
+    def get_captures(self):
+        """Return the operation and output paths of every capture so far."""
+        with self._lock:
+            captures = list(self._captures)
+        if self.relay is not None:
+            captures.extend(self.relay.get_profiles())
+        return captures
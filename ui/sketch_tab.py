@@ -3,6 +3,7 @@
 import gradio as gr
 from config.app_config import config
 from config.constants import EXAMPLE_PROMPTS, DRAWING_TIPS
+from models.schedulers import scheduler_choices
 from .components import (
     create_main_container, create_sidebar_layout, create_content_area,
     create_section_header, create_param_group, create_prompt_section,
@@ -57,12 +58,18 @@ def create_sketch_tab(model_manager_instance):
                     step=0.05,
                 )
                 
+                scheduler_sketch = gr.Dropdown(
+                    choices=scheduler_choices(),
+                    value=config.DEFAULT_SCHEDULERS["sketch"],
+                    label="Sampler",
+                )
+
                 num_steps_sketch = create_slider_with_info(
                     "Quality Steps",
-                    minimum=10,
+                    minimum=1,
                     maximum=50,
                     value=config.SKETCH_HYPERPARAMS["num_inference_steps"],
-                    step=5,
+                    step=1,
                 )
                 
                 seed_sketch = gr.Number(
@@ -91,8 +98,9 @@ def create_sketch_tab(model_manager_instance):
             
             generate_btn = create_primary_button(
                 "🚀 Generate Image",
-                interactive=(model_manager_instance.get_sketch_pipeline() is not None)
+                interactive=model_manager_instance.is_pipeline_available("sketch")
             )
+            stop_btn = create_secondary_button("⏹️ Stop")
             
             # Drawing Tips - Minimalistic
             create_tips_section(DRAWING_TIPS)
@@ -100,5 +108,5 @@ def create_sketch_tab(model_manager_instance):
     return (
         sketch_input, prompt_input, negative_prompt_input, guidance_scale_sketch,
         num_steps_sketch, seed_sketch, controlnet_scale, generated_image,
-        status_sketch, clear_prompts_btn, generate_btn
+        status_sketch, clear_prompts_btn, generate_btn, stop_btn, scheduler_sketch
     )
\ No newline at end of file
@@ -560,6 +560,22 @@ input:focus, textarea:focus {
     gap: 8px;
 }
 
+.status-progress {
+    background-color: rgba(79, 172, 254, 0.1);
+    border: 1px solid var(--accent-blue);
+    color: var(--accent-blue);
+    padding: 10px 15px;
+    border-radius: 8px;
+    margin: 10px 0;
+    text-align: center;
+    font-size: 0.9em;
+    font-weight: 600;
+    display: flex;
+    align-items: center;
+    justify-content: center;
+    gap: 8px;
+}
+
 .status-icon {
     font-size: 1.2em;
     line-height: 1;
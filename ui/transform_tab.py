@@ -3,6 +3,7 @@
 import gradio as gr
 from config.app_config import config
 from config.constants import EXAMPLE_MODIFICATIONS, TRANSFORM_TIPS
+from models.schedulers import scheduler_choices
 from .components import (
     create_main_container, create_sidebar_layout, create_content_area,
     create_section_header, create_param_group, create_prompt_section,
@@ -51,12 +52,18 @@ def create_manipulation_tab(model_manager_instance):
                     info="How much to preserve original image structure"
                 )
                 
+                scheduler_modify = gr.Dropdown(
+                    choices=scheduler_choices(),
+                    value=config.DEFAULT_SCHEDULERS["manipulation"],
+                    label="Sampler",
+                )
+
                 num_steps_modify = create_slider_with_info(
                     "Quality Steps",
-                    minimum=10,
+                    minimum=1,
                     maximum=50,
                     value=config.MANIPULATION_HYPERPARAMS["num_inference_steps"],
-                    step=5,
+                    step=1,
                     info="More steps = higher quality but slower"
                 )
                 
@@ -100,13 +107,14 @@ def create_manipulation_tab(model_manager_instance):
             
             modify_btn = create_primary_button(
                 "🌟 Apply Transform",
-                interactive=(model_manager_instance.get_manipulate_pipeline() is not None)
+                interactive=model_manager_instance.is_pipeline_available("manipulation")
             )
+            stop_btn = create_secondary_button("⏹️ Stop")
             
             create_tips_section(TRANSFORM_TIPS)
 
     return (
         input_image_upload, modification_input, guidance_scale_modify,
         image_guidance_scale, num_steps_modify, seed_modify, modified_image,
-        status_modify, clear_modify_prompt_btn, modify_btn
+        status_modify, clear_modify_prompt_btn, modify_btn, stop_btn, scheduler_modify
     )